@@ -1,18 +1,17 @@
 import streamlit as st
 import plotly.express as px
-from datetime import date, timedelta
+from datetime import timedelta
 from data_creator import (
     create_market_cap_dict,
-    gen_rebased_df,
+    create_cumulative_df,
+    rebase_cumulative_df,
     ids2names_dict,
     names2ids_dict,
-    create_assets,
     gen_symbols,
-    create_histories_df,
-    create_unix_dates,
     create_returns_df,
     create_rebased_df,
     date_range,
+    utc_today,
 )
 from plot_creator import (
     get_pre_selected_idx,
@@ -23,6 +22,8 @@ from plot_creator import (
     load_images,
     gen_performance_ag_df,
     add_drawdown,
+    start_page_trace,
+    profiling_panel,
 )
 from port_creator import (
     gen_all_returns,
@@ -37,6 +38,10 @@ from port_creator import (
 from risk_metrics import max_drawdown
 from st_aggrid import AgGrid, GridOptionsBuilder
 from persist import persist, load_widget_state
+from refresher import current_dataset, start_refresher
+from instrumentation import span
+
+trace = start_page_trace("aggrid_viewer")
 
 load_widget_state()
 
@@ -63,8 +68,8 @@ st.markdown(
 
 # load start and end dates for investment analysis
 lookback_years = 5  # max date range for backtest will be: lookback_years - 1
-start_date = date.today() - timedelta(365)
-end_date = date.today()
+start_date = utc_today() - timedelta(365)
+end_date = utc_today()
 
 if "start_date" not in st.session_state:
     st.session_state.start_date = start_date
@@ -76,19 +81,24 @@ if "max_coins" not in st.session_state:
 if "start_id" not in st.session_state:
     st.session_state.start_id = 1
 
-# Pull down histories from coincap, and create dataframes for historic prices,
-# returns and rebased cumulative price; histories_df, returns_df, and
-# rebased_df, respectively.
-assets_json = create_assets(total_coins=50)
+# Load the current dataset, kept up to date by the background refresher (see
+# refresher.py), and create dataframes for historic prices, returns and rebased
+# cumulative price; histories_df, returns_df, and rebased_df, respectively.
+start_refresher()
+dataset = current_dataset(total_coins=50, lookback_years=lookback_years)
+if dataset is None:
+    st.info(
+        "The price data is being prepared, please reload the page in a few minutes."
+    )
+    st.stop()
+assets_json = dataset.assets_json
 symbols, names, coin_ids = gen_symbols(assets_json)
 ids2symbols = ids2names_dict(coin_ids, symbols)
 ids2names_dict = ids2names_dict(coin_ids, names)
 names2ids_dict = names2ids_dict(names, coin_ids)
 market_cap_dict = create_market_cap_dict(assets_json)
-start_unix, end_unix = create_unix_dates(
-    today=date.today(), lookback_years=lookback_years
-)
-histories_df = create_histories_df(coin_ids, start_unix, end_unix)
+histories_df = dataset.histories_df
+cumulative_df = create_cumulative_df(histories_df)
 
 # Create list of coin ids with full hisoties over the backtest period
 ids_with_histories = ids_with_histories(
@@ -174,8 +184,8 @@ start_port_date, end_port_date = st.select_slider(
 
 # calculate returns for the portfolios and add to it the  rebased df for assets
 # with hisories. This is the new returns_df
-rebased_df = gen_rebased_df(
-    histories_df,
+rebased_df = rebase_cumulative_df(
+    cumulative_df,
     ids_with_histories,
     st.session_state.start_date,
     st.session_state.end_date,
@@ -192,9 +202,6 @@ def write_something():
 
 def rerun_aggrid():
     st.session_state.selected_indexes = selected_indexes
-    st.session_state.performance_ag_df = gen_performance_ag_df(
-        all_returns_df, market_cap_dict, st.session_state.strategy_dict
-    )
     st.header("ran")
 
 
@@ -253,7 +260,7 @@ else:
             ids2names_dict,
         )
 
-st.session_state.performance_ag_df = gen_performance_ag_df(
+performance_ag_df = gen_performance_ag_df(
     all_returns_df, market_cap_dict, st.session_state.strategy_dict
 )
 
@@ -263,31 +270,30 @@ if "selected_assets" not in st.session_state:
 selected_indexes = []
 for asset in st.session_state.selected_assets:
     try:
-        selected_indexes.append(
-            list(st.session_state.performance_ag_df["Asset"]).index(asset)
-        )
+        selected_indexes.append(list(performance_ag_df["Asset"]).index(asset))
     except:
         pass
 
 if "selected_indexes" not in st.session_state:
     st.session_state.selected_indexes = selected_indexes
 
-gb = GridOptionsBuilder.from_dataframe(st.session_state.performance_ag_df)
+gb = GridOptionsBuilder.from_dataframe(performance_ag_df)
 gb.configure_selection(
     "multiple", use_checkbox=True, pre_selected_rows=st.session_state.selected_indexes
 )
 gridOptions = gb.build()
 
 st.subheader("Performance metrics")
-grid_response = AgGrid(
-    st.session_state.performance_ag_df,
-    gridOptions=gridOptions,
-    data_return_mode="FILTERED",
-    allow_unsafe_jscode=True,
-    height=200,
-    update_mode="MODEL_CHANGED",
-    key=persist("aggrid"),
-)  # MANUAL SELECTION_CHANGED MODEL_CHANGED, VALUE_CHANGED
+with span("aggrid table"):
+    grid_response = AgGrid(
+        performance_ag_df,
+        gridOptions=gridOptions,
+        data_return_mode="FILTERED",
+        allow_unsafe_jscode=True,
+        height=200,
+        update_mode="MODEL_CHANGED",
+        key=persist("aggrid"),
+    )  # MANUAL SELECTION_CHANGED MODEL_CHANGED, VALUE_CHANGED
 
 selected_assets = []
 for row in grid_response["selected_rows"]:
@@ -301,7 +307,12 @@ st.session_state.selected_assets = selected_assets
 
 chart_df = create_comparison_df(all_returns_df, st.session_state.selected_assets)
 
-fig = px.line(chart_df, x=chart_df.index, y="Value (USD)", color="Asset")
+fig = px.line(
+    chart_df, x=chart_df.index, y="Value (USD)", color="Asset", render_mode="webgl"
+)
 
 st.subheader("Performance chart")
-st.write(fig)
+with span("plotly chart"):
+    st.write(fig)
+
+profiling_panel(trace)
@@ -0,0 +1,182 @@
+"""
+Validation and benchmark of the batched efficient frontier solvers in
+engine.frontier against pypfopt's EfficientFrontier.
+
+Problems are built from windows of histories.csv: the 365 days before every
+STEP-th start date, each with universes of the 5, 10, 20 and 50 largest coins
+with a full history over the window, all of which are solved in one batch
+per problem type. Every problem is also solved with pypfopt (max_sharpe,
+min_volatility and efficient_return for the median expected return of the
+universe), and the largest weight difference, the largest shortfall of the
+objective (Sharpe ratio or volatility) from pypfopt's and the time per solve
+of each are reported. Run from the repo root with:
+
+    python -m benchmarks.bench_frontier
+
+N.B. on flat, ill conditioned problems pypfopt's solvers stop with weights
+up to a few % away from the optimum, so weights are validated by their
+objective and feasibility rather than by their distance to pypfopt's. The
+exit status is 1 if any weights are infeasible or have an objective worse
+than pypfopt's by more than TOLERANCE (relative), or if the batched solvers
+are less than MIN_SPEEDUP times faster per solve.
+"""
+
+import sys
+import time
+import warnings
+
+import numpy as np
+from pypfopt import EfficientFrontier, expected_returns, risk_models
+
+from engine.data import availability_index, investable_ids, load_prices
+from engine.frontier import (
+    efficient_return_batch,
+    max_sharpe_batch,
+    min_volatility_batch,
+)
+
+UNIVERSE_SIZES = (5, 10, 20, 50)
+ANALYSIS_DAYS = 365
+STEP = 30
+
+# Largest allowed relative shortfall of the objective from pypfopt's and
+# violation of the constraints, and smallest speed up per solve.
+TOLERANCE = 1e-6
+FEASIBILITY = 1e-8
+MIN_SPEEDUP = 10
+
+
+def frontier_problems(histories_df):
+    """
+    Function to build the batch of problems: returns expected returns of
+    shape (problems, n), covariances of shape (problems, n, n) and the
+    (problems, n) universe masks, where n is the largest universe size.
+    """
+    availability = availability_index(histories_df)
+    n = max(UNIVERSE_SIZES)
+    mus, covs, universes = [], [], []
+    for end in range(ANALYSIS_DAYS + 1, len(histories_df), STEP):
+        window_df = histories_df.iloc[end - ANALYSIS_DAYS - 1 : end]
+        start, stop = window_df.index[0].date(), window_df.index[-1].date()
+        window_ids = investable_ids(availability, start, stop, n)
+        mu = expected_returns.mean_historical_return(window_df[window_ids])
+        cov = risk_models.sample_cov(window_df[window_ids])
+        for size in UNIVERSE_SIZES:
+            if size > len(window_ids):
+                continue
+            padded_mu, padded_cov = np.full(n, np.nan), np.full((n, n), np.nan)
+            padded_mu[: len(window_ids)] = mu
+            padded_cov[: len(window_ids), : len(window_ids)] = cov
+            mus.append(padded_mu)
+            covs.append(padded_cov)
+            universes.append(np.arange(n) < size)
+    return np.array(mus), np.array(covs), np.array(universes)
+
+
+def pypfopt_weights(mu, cov, problem):
+    """
+    Function to solve one problem with pypfopt, returning its unrounded
+    weights or None if pypfopt fails. N.B. the solvers' weights can be
+    slightly negative, gaining a little on the objective, so they are clipped
+    at zero and renormalised.
+    """
+    ef = EfficientFrontier(mu, cov, weight_bounds=(0, 1))
+    try:
+        if problem == "max_sharpe":
+            ef.max_sharpe()
+        elif problem == "min_volatility":
+            ef.min_volatility()
+        else:
+            ef.efficient_return(np.median(mu))
+    except Exception:
+        return None
+    weights = np.array(list(ef.clean_weights(cutoff=0, rounding=None).values()))
+    weights = np.maximum(weights, 0)
+    return weights / weights.sum()
+
+
+def shortfall(weights, expected, mu, cov, problem):
+    """
+    Function to return the relative shortfall of the objective of weights
+    from that of the expected weights, negative where weights do better.
+    """
+    if problem == "max_sharpe":
+        sharpe = [(w @ mu - 0.02) / np.sqrt(w @ cov @ w) for w in (weights, expected)]
+        return (sharpe[1] - sharpe[0]) / abs(sharpe[1])
+    vol = [np.sqrt(w @ cov @ w) for w in (weights, expected)]
+    return (vol[0] - vol[1]) / vol[1]
+
+
+def infeasibility(weights, mu, problem):
+    """
+    Function to return the largest violation of the constraints by weights:
+    long only, fully invested and, for efficient_return, an expected return of
+    at least the median of mu.
+    """
+    violation = max(-weights.min(), abs(weights.sum() - 1))
+    if problem == "efficient_return":
+        violation = max(violation, np.median(mu) - weights @ mu)
+    return violation
+
+
+def batch_weights(mus, covs, universes, problem):
+    if problem == "max_sharpe":
+        return max_sharpe_batch(mus, covs, universe=universes)
+    if problem == "min_volatility":
+        return min_volatility_batch(covs, universe=universes)
+    targets = np.nanmedian(np.where(universes, mus, np.nan), axis=1)
+    return efficient_return_batch(mus, covs, targets, universe=universes)
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    histories_df = load_prices("histories.csv")
+    mus, covs, universes = frontier_problems(histories_df)
+    print("{} problems, universes of {} coins".format(len(mus), UNIVERSE_SIZES))
+
+    failed = False
+    for problem in ("max_sharpe", "min_volatility", "efficient_return"):
+        start = time.perf_counter()
+        weights = batch_weights(mus, covs, universes, problem)
+        batch_s = (time.perf_counter() - start) / len(mus)
+
+        expected, failures, start = [], 0, time.perf_counter()
+        for i, universe in enumerate(universes):
+            size = universe.sum()
+            expected.append(
+                pypfopt_weights(mus[i, :size], covs[i, :size, :size], problem)
+            )
+        pypfopt_s = (time.perf_counter() - start) / len(mus)
+
+        diffs, shortfalls, violations = [], [], []
+        for i, universe in enumerate(universes):
+            size = universe.sum()
+            mu, cov, w = mus[i, :size], covs[i, :size, :size], weights[i, :size]
+            if expected[i] is None:
+                failures += 1
+                continue
+            diffs.append(np.abs(w - expected[i]).max())
+            shortfalls.append(shortfall(w, expected[i], mu, cov, problem))
+            violations.append(infeasibility(w, mu, problem))
+
+        speedup = pypfopt_s / batch_s
+        failed |= (
+            not max(shortfalls) <= TOLERANCE
+            or not max(violations) <= FEASIBILITY
+            or speedup < MIN_SPEEDUP
+        )
+        print(
+            "{:<17} max diff {:.1e}  shortfall {:+.1e}  infeasibility {:.1e}  "
+            "pypfopt {:>6.2f} ms  batch {:>6.3f} ms  x{:.0f}  "
+            "({} pypfopt failures)".format(
+                problem,
+                max(diffs),
+                max(shortfalls),
+                max(violations),
+                pypfopt_s * 1000,
+                batch_s * 1000,
+                speedup,
+                failures,
+            )
+        )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,133 @@
+"""
+Import time budget of the app's pages.
+
+Each page's imports are run in a fresh interpreter with python -X importtime,
+after importing streamlit (which every page needs and a running server has
+already loaded), and timed against the page's budget in PAGE_BUDGETS_MS. It
+also checks that none of the LAZY_MODULES, which should only be loaded on the
+code paths that need them, is imported eagerly. Run from the repo root with:
+
+    python -m benchmarks.bench_imports
+
+The heaviest modules imported by each page are listed, and the exit status is
+1 if any page is over budget or imports a lazy module.
+"""
+
+import ast
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Budget in ms for importing each page's modules on top of streamlit, with
+# headroom over the ~50-100ms they take on a laptop.
+PAGE_BUDGETS_MS = {
+    "cryptoTester.py": 300,
+    "aggrid_viewer.py": 300,
+    "port_viewer.py": 300,
+    "crypto_viewer.py": 300,
+    "frontpage.py": 300,
+}
+
+# Modules which must be imported lazily, only when they are used: the
+# optimisers (pypfopt pulls in cvxpy), the screener parser and the custom
+# slider component.
+LAZY_MODULES = (
+    "pypfopt",
+    "cvxpy",
+    "scipy.optimize",
+    "bs4",
+    "streamlit_custom_slider",
+)
+
+# Number of runs of each page, the fastest of which is reported.
+REPEAT = 3
+
+PROBE = """
+import importlib, json, sys, time
+import streamlit
+start = time.perf_counter()
+for module in {modules!r}:
+    importlib.import_module(module)
+elapsed = time.perf_counter() - start
+lazy = [module for module in {lazy!r} if module in sys.modules]
+print(json.dumps({{"seconds": elapsed, "lazy": lazy}}))
+"""
+
+
+def page_modules(page):
+    """
+    Function to list the modules imported at the top level of a page script.
+    """
+    with open(os.path.join(REPO_ROOT, page)) as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def parse_importtime(stderr):
+    """
+    Function to parse the -X importtime output of the imports made after
+    streamlit into a list of (cumulative us, module) of top level imports,
+    heaviest first.
+    """
+    lines = stderr.splitlines()
+    after_streamlit = 0
+    for i, line in enumerate(lines):
+        if line.endswith("| streamlit"):
+            after_streamlit = i + 1
+    imports = []
+    for line in lines[after_streamlit:]:
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not name.startswith("  ") and cumulative.strip().isdigit():
+            imports.append((int(cumulative), name.strip()))
+    return sorted(imports, reverse=True)
+
+
+def time_page(page):
+    """
+    Function to import the modules of page in fresh interpreters. Returns the
+    fastest import time in seconds, the lazy modules it loaded and the top
+    level imports of the fastest run (see parse_importtime).
+    """
+    code = PROBE.format(modules=page_modules(page), lazy=LAZY_MODULES)
+    best = None
+    for _ in range(REPEAT):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        if best is None or probe["seconds"] < best[0]:
+            best = (probe["seconds"], probe["lazy"], parse_importtime(result.stderr))
+    return best
+
+
+if __name__ == "__main__":
+    failed = False
+    for page, budget_ms in PAGE_BUDGETS_MS.items():
+        seconds, lazy, imports = time_page(page)
+        over = seconds * 1000 > budget_ms
+        failed |= over or bool(lazy)
+        print(
+            "{:<18} {:>7.0f} ms  budget {:>5} ms  {}".format(
+                page, seconds * 1000, budget_ms, "OVER BUDGET" if over else "ok"
+            )
+        )
+        if lazy:
+            print("    eagerly imports {}".format(", ".join(lazy)))
+        for cumulative, name in imports[:5]:
+            print("    {:>7.1f} ms  {}".format(cumulative / 1000, name))
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,103 @@
+"""
+Benchmark of cold ingestion of coincap history payloads into histories_df.
+
+Compares data_creator.histories_to_df with the per-observation loop and
+successive outer merges it replaced, on synthetic 5 year daily histories for
+50, 100 and 500 coins. Run from the repo root with:
+
+    python -m benchmarks.bench_ingest
+"""
+
+import copy
+import time
+import warnings
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from data_creator import histories_to_df
+
+DAY_MS = 86400000
+
+
+def synthetic_histories(n_coins, n_days=5 * 365, seed=0):
+    """
+    Function to create a histories_dict shaped like the coincap history
+    endpoint's response, with coins listed at staggered dates.
+    """
+    rng = np.random.default_rng(seed)
+    end = 19130  # 2022-05-17 as a day number
+    histories_dict = {}
+    for i in range(n_coins):
+        length = n_days if i == 0 else int(rng.integers(200, n_days + 1))
+        prices = np.exp(np.cumsum(rng.normal(0, 0.04, length)))
+        histories_dict["coin-{}".format(i)] = [
+            {
+                "priceUsd": repr(price),
+                "time": int(day) * DAY_MS,
+                "date": datetime.fromtimestamp(
+                    int(day) * 86400, tz=timezone.utc
+                ).strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            }
+            for day, price in zip(range(end - length + 1, end + 1), prices)
+        ]
+    return histories_dict
+
+
+def legacy_histories_to_df(histories_dict, coin_ids):
+    """
+    The ingestion loop which create_histories_df used before histories_to_df:
+    one strptime and float per observation, then one outer merge per coin.
+    """
+    for id in coin_ids:
+        for dict in histories_dict[id]:
+            dict.pop("time")
+            dict["priceUsd"] = float(dict["priceUsd"])
+            dict["date"] = datetime.strptime(dict["date"][0:10], "%Y-%m-%d").date()
+
+    histories_df = pd.json_normalize(histories_dict[coin_ids[0]])
+    histories_df = histories_df.set_index("date", drop=True)
+    for id in coin_ids[1:]:
+        temp_df = pd.json_normalize(histories_dict[id])
+        temp_df = temp_df.set_index("date", drop=True)
+        histories_df = histories_df.merge(
+            temp_df, how="outer", left_index=True, right_index=True
+        )
+    histories_df.columns = coin_ids
+    return histories_df
+
+
+def time_call(func, *args, repeat=3):
+    """
+    Function to return the best wall time in seconds of repeat calls to func.
+    Arguments are deep copied before each call as the legacy loop mutates them.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        call_args = copy.deepcopy(args)
+        start = time.perf_counter()
+        result = func(*call_args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    # the legacy merges fragment the frame, which pandas warns about per merge
+    warnings.simplefilter("ignore", pd.errors.PerformanceWarning)
+    print("{:>6} {:>12} {:>12} {:>9}".format("coins", "legacy s", "bulk s", "speedup"))
+    for n_coins in (50, 100, 500):
+        histories_dict = synthetic_histories(n_coins)
+        coin_ids = list(histories_dict.keys())
+        legacy_s, legacy_df = time_call(
+            legacy_histories_to_df, histories_dict, coin_ids, repeat=1
+        )
+        bulk_s, bulk_df = time_call(histories_to_df, histories_dict, coin_ids)
+        pd.testing.assert_frame_equal(
+            legacy_df, bulk_df, check_names=False, check_index_type=False
+        )
+        print(
+            "{:>6} {:>12.4f} {:>12.4f} {:>8.1f}x".format(
+                n_coins, legacy_s, bulk_s, legacy_s / bulk_s
+            )
+        )
@@ -0,0 +1,137 @@
+"""
+Benchmark of date range lookups on price frames.
+
+Compares frames indexed by object dtype datetime.date values, as
+create_histories_df built them before, with the DatetimeIndex the price store
+now returns, on 5 and 20 year histories: slicing a 365 day window (label
+slicing vs engine.data.date_slice), looking up a start date (get_indexer vs
+engine.data.date_position), masking rows from a start date and finding the
+monthly rebalancing rows of a window, and querying the coins with a full
+history over a window (slicing and dropna vs engine.data.investable_ids on a
+prebuilt availability index). Run from the repo root with:
+
+    python -m benchmarks.bench_slicing
+"""
+
+import time
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import price_store
+from engine.data import availability_index, date_position, date_slice, investable_ids
+from engine.portfolio import rebalance_rows
+
+
+def synthetic_prices(n_days, n_coins=100, seed=0):
+    """
+    Function to create a frame of random prices over the n_days days ending on
+    2022-05-17, indexed by DatetimeIndex as read from the price store.
+    """
+    rng = np.random.default_rng(seed)
+    days = np.arange(19130 - n_days + 1, 19131)
+    prices = np.exp(np.cumsum(rng.normal(0, 0.04, (n_days, n_coins)), axis=0))
+    # coins list on staggered dates, some with a month long gap in their prices
+    listed = rng.integers(0, n_days // 2, n_coins)
+    prices[np.arange(n_days)[:, None] < listed] = np.nan
+    gap_coins = rng.choice(n_coins, n_coins // 10, replace=False)
+    for coin, gap in zip(gap_coins, rng.integers(0, n_days - 30, len(gap_coins))):
+        prices[gap : gap + 30, coin] = np.nan
+    return pd.DataFrame(prices, index=price_store.days2index(days))
+
+
+def time_call(func, *args, number=500):
+    """
+    Function to return the mean wall time in microseconds of number calls.
+    """
+    start = time.perf_counter()
+    for _ in range(number):
+        func(*args)
+    return (time.perf_counter() - start) / number * 1e6
+
+
+def object_slice(df, start_date, end_date):
+    return df[start_date:end_date]
+
+
+def object_lookup(df, day):
+    return df.index.get_indexer([day])[0]
+
+
+def datetime_lookup(df, day):
+    return date_position(df.index, day)
+
+
+def object_mask(df, start_date):
+    return df.index >= start_date
+
+
+def datetime_mask(df, start_date):
+    return df.index >= pd.Timestamp(start_date)
+
+
+def object_rebalance_rows(df, start_date, end_date):
+    return rebalance_rows(object_slice(df, start_date, end_date).index, "monthly")
+
+
+def datetime_rebalance_rows(df, start_date, end_date):
+    return rebalance_rows(date_slice(df, start_date, end_date).index, "monthly")
+
+
+def object_universe(df, start_date, end_date):
+    return object_slice(df, start_date, end_date).dropna(axis=1).columns
+
+
+def datetime_universe(availability, start_date, end_date):
+    return investable_ids(availability, start_date, end_date)
+
+
+if __name__ == "__main__":
+    print(
+        "{:>6} {:>20} {:>12} {:>12} {:>9}".format(
+            "years", "operation", "object us", "datetime us", "speedup"
+        )
+    )
+    for years in (5, 20):
+        datetime_df = synthetic_prices(365 * years)
+        object_df = datetime_df.copy()
+        object_df.index = pd.Index(datetime_df.index.date, name="date")
+        end_date = object_df.index[-30]
+        start_date = end_date - timedelta(365)
+
+        pd.testing.assert_frame_equal(
+            object_slice(object_df, start_date, end_date).reset_index(drop=True),
+            date_slice(datetime_df, start_date, end_date).reset_index(drop=True),
+        )
+        availability = availability_index(datetime_df)
+        assert list(object_universe(object_df, start_date, end_date)) == list(
+            datetime_universe(availability, start_date, end_date)
+        )
+        for operation, object_func, datetime_func, args in (
+            ("365 day slice", object_slice, date_slice, (start_date, end_date)),
+            ("date lookup", object_lookup, datetime_lookup, (start_date,)),
+            ("start date mask", object_mask, datetime_mask, (start_date,)),
+            (
+                "monthly rebalance",
+                object_rebalance_rows,
+                datetime_rebalance_rows,
+                (start_date, end_date),
+            ),
+            (
+                "universe query",
+                object_universe,
+                datetime_universe,
+                (start_date, end_date),
+            ),
+        ):
+            datetime_arg = (
+                availability if operation == "universe query" else datetime_df
+            )
+            object_us = time_call(object_func, object_df, *args)
+            datetime_us = time_call(datetime_func, datetime_arg, *args)
+            print(
+                "{:>6} {:>20} {:>12.1f} {:>12.1f} {:>8.1f}x".format(
+                    years, operation, object_us, datetime_us, object_us / datetime_us
+                )
+            )
@@ -0,0 +1,152 @@
+"""
+Check of market_data.py's fetch layer against the Yahoo stand-in serving the
+fixtures in fixtures/yahoo (see yahoo_server.py), without network access.
+
+The screener page is parsed with parse_screener and the chart responses with
+chart_to_df, then the refresh paths of load_market_frame are exercised on a
+temporary price store, counting the requests the stand-in receives:
+
+- a frame fetched in the current refresh period is served from the store
+  without a request, and one fetched in an earlier period is refetched,
+- daily bars are refreshed incrementally, with a single request from the last
+  stored day, and match a full fetch,
+- a stored frame is served, stale, when its refresh fails.
+
+Run from the repo root with:
+
+    python -m benchmarks.check_market_data
+
+The exit status is 1 if any check fails.
+"""
+
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import market_data
+import price_store
+from yahoo_server import FIXTURES_DIR, make_handler
+
+TICKER = "BTC-USD"
+
+
+def serve_counting(fixtures_dir=FIXTURES_DIR):
+    """
+    Function to start the stand-in on a daemon thread, recording the path of
+    every request it receives. Returns the server, its base url and the list
+    of recorded paths.
+    """
+    paths = []
+
+    class CountingHandler(make_handler(fixtures_dir)):
+        def do_GET(self):
+            paths.append(self.path)
+            super().do_GET()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1]), paths
+
+
+def store_stale(frame, name, ttl, path):
+    """
+    Function to store frame as the market frame called name, fetched in the
+    refresh period of length ttl before the current one.
+    """
+    frame = frame.copy()
+    frame.attrs["fetched_at"] = (market_data.refresh_period(ttl) - 1) * ttl
+    price_store.write_market_frame(frame, name, path)
+
+
+def run_checks(path, paths):
+    """
+    Function to run the checks on the price store at path, with paths the list
+    of requests recorded by the stand-in. Returns a list of (name, passed).
+    """
+    results = []
+
+    snapshot_df = market_data.market_snapshot(path)
+    results.append(
+        (
+            "parse_screener",
+            list(snapshot_df.columns) == list(market_data.SCREENER_COLUMNS.values())
+            and len(snapshot_df) > 0
+            and snapshot_df.Symbol.iloc[0] == "BTC"
+            and not snapshot_df.Symbol.str.endswith("-USD").any()
+            and not snapshot_df.Name.str.endswith(" USD").any(),
+        )
+    )
+
+    del paths[:]
+    market_data.load_market_frame(
+        "snapshot",
+        market_data.SNAPSHOT_TTL,
+        lambda stored_df: market_data.fetch_snapshot(),
+        path,
+    )
+    results.append(("fresh frame served from the store", len(paths) == 0))
+
+    store_stale(snapshot_df, "snapshot", market_data.SNAPSHOT_TTL, path)
+    market_data.load_market_frame(
+        "snapshot",
+        market_data.SNAPSHOT_TTL,
+        lambda stored_df: market_data.fetch_snapshot(),
+        path,
+    )
+    results.append(("stale frame refetched", len(paths) == 1))
+
+    full_df = market_data.daily_bars(TICKER, path)
+    minute_df = market_data.minute_bars(TICKER, path)
+    results.append(
+        (
+            "chart_to_df",
+            len(full_df) > 0
+            and len(minute_df) > 0
+            and list(full_df.columns) == market_data.OHLC_COLUMNS
+            and full_df.index.is_monotonic_increasing,
+        )
+    )
+
+    del paths[:]
+    name = TICKER + "_1d"
+    store_stale(full_df.iloc[:-10], name, market_data.DAILY_TTL, path)
+    daily_df = market_data.load_market_frame(
+        name,
+        market_data.DAILY_TTL,
+        lambda stored_df: market_data.fetch_daily(TICKER, stored_df),
+        path,
+    )
+    query = parse_qs(urlsplit(paths[0]).query) if len(paths) == 1 else {}
+    period1 = int(full_df.index[-11].timestamp())
+    results.append(
+        (
+            "incremental daily refresh",
+            query.get("period1") == [str(period1)] and daily_df.equals(full_df),
+        )
+    )
+
+    stale_df = full_df.iloc[:-10]
+    store_stale(stale_df, "MISSING-USD_1d", market_data.DAILY_TTL, path)
+    served_df = market_data.load_market_frame(
+        "MISSING-USD_1d",
+        market_data.DAILY_TTL,
+        lambda stored_df: market_data.fetch_daily("MISSING-USD", stored_df),
+        path,
+    )
+    results.append(("stored frame served on failure", served_df.equals(stale_df)))
+    return results
+
+
+if __name__ == "__main__":
+    server, url, paths = serve_counting()
+    market_data.YAHOO_SCREENER_URL = url + "/cryptocurrencies"
+    market_data.YAHOO_CHART_URL = url + "/v8/finance/chart"
+    with tempfile.TemporaryDirectory() as path:
+        results = run_checks(path, paths)
+    server.shutdown()
+
+    for name, passed in results:
+        print("{:<36} {}".format(name, "ok" if passed else "FAILED"))
+    sys.exit(0 if all(passed for _, passed in results) else 1)
@@ -0,0 +1,136 @@
+"""
+Check of the walk forward Markowitz weights (engine.portfolio.walk_forward_markowitz)
+against pypfopt, which markowitz_weights_dict falls back to on dates without
+precomputed weights.
+
+For every STEP-th start date of histories.csv and investment sets of the 5 and
+10 largest coins with a full history over the following year (as the pages
+choose them), the analysis window is sliced as markowitz_weights_dict does and
+pypfopt's mean_historical_return, sample_cov and max_sharpe weights are
+compared with the precomputed ones. Many windows hold coins listed part way
+through, whose returns and covariances pypfopt takes over the days they have
+prices. Run from the repo root with:
+
+    python -m benchmarks.check_walk_forward
+
+The exit status is 1 if pypfopt solves a date without precomputed weights, if
+the moments differ by more than MOMENT_TOLERANCE (relative), if the Sharpe
+ratio of the precomputed weights is worse than that of pypfopt's cleaned
+weights by more than TOLERANCE (relative), or if no window with a late listed
+coin was checked.
+"""
+
+import sys
+import warnings
+from datetime import timedelta
+
+import numpy as np
+from pypfopt import EfficientFrontier, expected_returns, risk_models
+
+from benchmarks.bench_frontier import shortfall
+from engine.data import date_slice, load_prices
+from engine.portfolio import (
+    fix_nonpositive_semidefinite,
+    ids_with_histories,
+    walk_forward_moments,
+    walk_forward_weights,
+)
+
+UNIVERSE_SIZES = (5, 10)
+ANALYSIS_DAYS = 365
+STEP = 10
+
+MOMENT_TOLERANCE = 1e-8
+TOLERANCE = 1e-6
+
+
+def pypfopt_problem(histories_df, start_date, ids):
+    """
+    Function to return pypfopt's expected returns, covariance and cleaned max
+    Sharpe weights for start_date, as markowitz_weights_dict computes them, and
+    whether a coin was listed during the window. Returns None if pypfopt fails.
+
+    N.B. pypfopt's solver leaves weights of about -1e-4 and sums off 1 by as
+    much, which can beat the long only optimum, so the weights are clipped and
+    renormalised before they are compared.
+    """
+    analysis_df = date_slice(
+        histories_df, start_date - timedelta(ANALYSIS_DAYS), start_date
+    )[ids]
+    try:
+        mu = expected_returns.mean_historical_return(analysis_df)
+        S = risk_models.sample_cov(analysis_df)
+        ef = EfficientFrontier(mu, S, weight_bounds=(0, 1))
+        ef.max_sharpe()
+        weights = np.clip(list(ef.clean_weights().values()), 0, None)
+    except Exception:
+        return None
+    late = bool(analysis_df.isna().any().any())
+    return mu.to_numpy(), S.to_numpy(), weights / weights.sum(), late
+
+
+def moment_errors(histories_df, row, ids, mu, S):
+    """
+    Function to return the largest relative differences of the precomputed
+    expected returns and covariance of ids on row from pypfopt's mu and S.
+    """
+    cols = histories_df.columns.get_indexer(ids)
+    n_coins = min(histories_df.shape[1], 1 << int(cols.max()).bit_length())
+    all_mu, all_cov = walk_forward_moments(histories_df, n_coins, ANALYSIS_DAYS)
+    precomputed_mu = all_mu[row, cols]
+    precomputed_cov = fix_nonpositive_semidefinite(
+        all_cov[row][np.ix_(cols, cols)][None]
+    )[0]
+    mu_error = np.max(np.abs(precomputed_mu - mu) / np.maximum(1, np.abs(mu)))
+    cov_error = np.max(np.abs(precomputed_cov - S)) / np.max(np.abs(S))
+    return mu_error, cov_error
+
+
+if __name__ == "__main__":
+    warnings.filterwarnings("ignore")
+    histories_df = load_prices("histories.csv")
+    last_date = histories_df.index[-1].date()
+
+    checked, late_checked, missing = 0, 0, []
+    mu_errors, cov_errors, shortfalls = [0.0], [0.0], [-np.inf]
+    for row in range(2, len(histories_df), STEP):
+        start_date = histories_df.index[row].date()
+        end_date = min(start_date + timedelta(365), last_date)
+        universe = ids_with_histories(histories_df, start_date, end_date)
+        for size in UNIVERSE_SIZES:
+            ids = universe[:size]
+            problem = pypfopt_problem(histories_df, start_date, ids)
+            if problem is None:
+                continue
+            mu, S, expected, late = problem
+            weights = walk_forward_weights(histories_df, start_date, ids, ANALYSIS_DAYS)
+            if weights is None:
+                missing.append((start_date, size))
+                continue
+            checked += 1
+            late_checked += late
+            mu_error, cov_error = moment_errors(histories_df, row, ids, mu, S)
+            mu_errors.append(mu_error)
+            cov_errors.append(cov_error)
+            weights = np.array([weights[id] for id in ids])
+            shortfalls.append(shortfall(weights, expected, mu, S, "max_sharpe"))
+
+    print(
+        "{} problems solved by pypfopt, {} with a coin listed in the window".format(
+            checked + len(missing), late_checked
+        )
+    )
+    print("without precomputed weights  {}".format(len(missing)))
+    for start_date, size in missing[:10]:
+        print("    {} {} coins".format(start_date, size))
+    print("expected return difference   {:.1e}".format(max(mu_errors)))
+    print("covariance difference        {:.1e}".format(max(cov_errors)))
+    print("Sharpe shortfall             {:+.1e}".format(max(shortfalls)))
+    failed = (
+        bool(missing)
+        or not max(mu_errors) <= MOMENT_TOLERANCE
+        or not max(cov_errors) <= MOMENT_TOLERANCE
+        or not max(shortfalls) <= TOLERANCE
+        or not late_checked
+    )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,308 @@
+"""
+Benchmark suite of the app's data pipeline, run on histories.csv and on
+synthetic universes of 100 and 500 coins x 5 years and 2,000 coins x 10 years.
+
+For each universe it times the cold (uncached) computation of the default
+cryptoTester view over the last 365 days: ingestion of coincap payloads
+(histories_to_df, the work load_histories_df does after downloading),
+ids_with_histories, gen_rebased_df, markowitz_weights_dict for the 10
+largest coins, gen_all_returns, gen_performance_df and max_drawdown of every
+column of the returns. Every timed call starts with empty compute caches, in
+memory and on disk.
+
+Results are written as a json report and compared against a stored baseline,
+flagging every benchmark slower than the baseline by more than --tolerance.
+Run from the repo root with:
+
+    python -m benchmarks.suite                    # compare to baseline.json
+    python -m benchmarks.suite --quick            # histories.csv and 100 coins
+    python -m benchmarks.suite --save-baseline    # replace baseline.json
+
+The exit status is 1 if any benchmark regressed. Baselines are only
+comparable on the machine they were recorded on, see the report's "machine".
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+# keep the persistent compute cache tier out of the repo and away from results
+# of earlier runs, before anything imports compute_cache
+os.environ.setdefault("COMPUTE_CACHE_DIR", tempfile.mkdtemp(prefix="bench_cache_"))
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_slicing import synthetic_prices
+import compute_cache
+from compute_cache import clear_caches
+from engine.data import gen_rebased_df, histories_to_df, load_prices
+from engine.metrics import gen_performance_df, max_drawdown
+from engine.portfolio import (
+    gen_all_returns,
+    ids_with_histories,
+    markowitz_weights_dict,
+    uniform_weights_dict,
+)
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# name: (number of coins, years of history), None for histories.csv
+CASES = {
+    "histories.csv": None,
+    "synthetic-100x5y": (100, 5),
+    "synthetic-500x5y": (500, 5),
+    "synthetic-2000x10y": (2000, 10),
+}
+QUICK_CASES = ("histories.csv", "synthetic-100x5y")
+
+# Ingestion payloads hold one dict per observation, so ingestion is only timed
+# for universes up to this size to bound the suite's memory.
+MAX_INGEST_COINS = 500
+
+# Number of coins in the portfolios, as in the app's default view.
+PORTFOLIO_COINS = 10
+
+# Slowdowns under this many seconds are treated as noise.
+NOISE_FLOOR = 0.0005
+
+
+def load_case(name):
+    """
+    Function to return the prices of a case, with coins named like coincap ids
+    and in market cap order, largest first.
+    """
+    if CASES[name] is None:
+        return load_prices("histories.csv")
+    n_coins, years = CASES[name]
+    prices_df = synthetic_prices(365 * years, n_coins)
+    prices_df.columns = ["coin-{}".format(i) for i in range(n_coins)]
+    return prices_df
+
+
+def histories_payload(histories_df):
+    """
+    Function to convert a frame of prices into the histories_dict shaped like
+    the coincap history endpoint's responses that histories_to_df ingests.
+    """
+    times = histories_df.index.asi8 // 1000000
+    histories_dict = {}
+    for id in histories_df.columns:
+        prices = histories_df[id].to_numpy()
+        valid = ~np.isnan(prices)
+        histories_dict[id] = [
+            {"priceUsd": repr(price), "time": int(unix)}
+            for unix, price in zip(times[valid], prices[valid])
+        ]
+    return histories_dict
+
+
+def time_call(func, *args, repeat=5):
+    """
+    Function to time repeat calls to func, each cold: with empty in-memory
+    compute caches and a new, empty COMPUTE_CACHE_DIR, so that neither func
+    nor the cached functions it calls are served results persisted by an
+    earlier repeat or run. Returns a dict of the best and median wall time in
+    seconds.
+    """
+    func = getattr(func, "__wrapped__", func)
+    cache_dir = compute_cache.CACHE_DIR
+    times = []
+    try:
+        for _ in range(repeat):
+            clear_caches()
+            with tempfile.TemporaryDirectory(prefix="bench_cache_") as repeat_dir:
+                compute_cache.CACHE_DIR = repeat_dir
+                start = time.perf_counter()
+                func(*args)
+                times.append(time.perf_counter() - start)
+    finally:
+        compute_cache.CACHE_DIR = cache_dir
+    return {
+        "best_s": min(times),
+        "median_s": statistics.median(times),
+        "repeat": repeat,
+    }
+
+
+def all_max_drawdowns(all_returns_df):
+    return [max_drawdown(all_returns_df[column]) for column in all_returns_df]
+
+
+def run_case(histories_df, repeat=5):
+    """
+    Function to run every benchmark on the prices of one case. Returns a dict
+    of timings by benchmark name.
+    """
+    end_date = histories_df.index[-1].date()
+    start_date = end_date - timedelta(365)
+    ids = ids_with_histories(histories_df, start_date, end_date)
+    rebased_df = gen_rebased_df(histories_df, ids, start_date, end_date)
+    portfolio_ids = ids[:PORTFOLIO_COINS]
+    strategy_dict = {
+        "Uniform": uniform_weights_dict(portfolio_ids),
+        "Markowitz": markowitz_weights_dict(histories_df, start_date, portfolio_ids),
+    }
+    all_returns_df = gen_all_returns(rebased_df, ids, strategy_dict)
+    market_cap_dict = {id: 10**9 / (i + 1) for i, id in enumerate(ids)}
+
+    benchmarks = {}
+    if histories_df.shape[1] <= MAX_INGEST_COINS:
+        histories_dict = histories_payload(histories_df)
+        coin_ids = list(histories_df.columns)
+        benchmarks["histories_to_df"] = (histories_to_df, histories_dict, coin_ids)
+    benchmarks.update(
+        {
+            "ids_with_histories": (
+                ids_with_histories,
+                histories_df,
+                start_date,
+                end_date,
+            ),
+            "gen_rebased_df": (gen_rebased_df, histories_df, ids, start_date, end_date),
+            "markowitz_weights_dict": (
+                markowitz_weights_dict,
+                histories_df,
+                start_date,
+                portfolio_ids,
+            ),
+            "gen_all_returns": (gen_all_returns, rebased_df, ids, strategy_dict),
+            "gen_performance_df": (
+                gen_performance_df,
+                all_returns_df,
+                market_cap_dict,
+                strategy_dict,
+            ),
+            "max_drawdown": (all_max_drawdowns, all_returns_df),
+        }
+    )
+    return {
+        name: time_call(func, *args, repeat=repeat)
+        for name, (func, *args) in benchmarks.items()
+    }
+
+
+def machine_info():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "commit": commit,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Function to compare the median times of report with those of baseline.
+    Returns a list of rows of (case, benchmark, baseline_s, current_s, ratio,
+    status), where status is "regression" if the benchmark is slower than the
+    baseline by more than a fraction tolerance and NOISE_FLOOR seconds,
+    "improvement" if it is faster by as much, "new" if it isn't in the
+    baseline and "ok" otherwise.
+    """
+    rows = []
+    for case, results in report["results"].items():
+        for name, timing in results.items():
+            current = timing["median_s"]
+            previous = baseline["results"].get(case, {}).get(name)
+            if previous is None:
+                rows.append((case, name, None, current, None, "new"))
+                continue
+            previous = previous["median_s"]
+            ratio = current / previous
+            if ratio > 1 + tolerance and current - previous > NOISE_FLOOR:
+                status = "regression"
+            elif ratio < 1 / (1 + tolerance) and previous - current > NOISE_FLOOR:
+                status = "improvement"
+            else:
+                status = "ok"
+            rows.append((case, name, previous, current, ratio, status))
+    return rows
+
+
+def print_rows(rows):
+    print(
+        "{:<20} {:<24} {:>12} {:>12} {:>7}  {}".format(
+            "case", "benchmark", "baseline ms", "current ms", "ratio", "status"
+        )
+    )
+    for case, name, previous, current, ratio, status in rows:
+        print(
+            "{:<20} {:<24} {:>12} {:>12.2f} {:>7}  {}".format(
+                case,
+                name,
+                "-" if previous is None else "{:.2f}".format(previous * 1000),
+                current * 1000,
+                "-" if ratio is None else "{:.2f}".format(ratio),
+                status,
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--cases", nargs="+", choices=list(CASES))
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default="benchmark_report.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--save-baseline", action="store_true")
+    args = parser.parse_args()
+
+    cases = args.cases or (QUICK_CASES if args.quick else list(CASES))
+    report = {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "machine": machine_info(),
+        "repeat": args.repeat,
+        "results": {},
+    }
+    for case in cases:
+        start = time.perf_counter()
+        histories_df = load_case(case)
+        report["results"][case] = run_case(histories_df, args.repeat)
+        print(
+            "{} {}: {:.1f}s".format(
+                case, histories_df.shape, time.perf_counter() - start
+            )
+        )
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print("Wrote {}".format(args.out))
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Saved baseline {}".format(args.baseline))
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}, run with --save-baseline".format(args.baseline))
+        sys.exit(0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(report, baseline, args.tolerance)
+    print_rows(rows)
+    if baseline.get("machine", {}).get("platform") != report["machine"]["platform"]:
+        print("N.B. the baseline was recorded on a different platform")
+    sys.exit(1 if any(row[-1] == "regression" for row in rows) else 0)
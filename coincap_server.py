@@ -0,0 +1,183 @@
+"""
+A local stand-in for the coincap.io v2 api, serving the /assets and
+/assets/{id}/history endpoints from the prices in histories.csv.
+
+Run it with:
+
+    python coincap_server.py --port 8765
+
+and point the app (or data_creator.load_histories) at it with:
+
+    COINCAP_API_URL=http://127.0.0.1:8765/v2 streamlit run cryptoTester.py
+
+Requests are still limited to coincap's rate (see engine.data.HOST_RATE_LIMITS),
+add COINCAP_RATE_LIMIT=0 to lift the limit.
+
+--latency adds a delay to every response and --max-rps answers requests above
+the given rate with a 429, which exercises the retry/backoff path.
+"""
+
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+# Ticker symbols of the largest coins, so that the app finds their logos.
+SYMBOLS = {
+    "bitcoin": "BTC",
+    "ethereum": "ETH",
+    "tether": "USDT",
+    "usd-coin": "USDC",
+    "binance-coin": "BNB",
+    "xrp": "XRP",
+    "binance-usd": "BUSD",
+    "cardano": "ADA",
+    "solana": "SOL",
+    "dogecoin": "DOGE",
+    "polkadot": "DOT",
+    "avalanche": "AVAX",
+    "wrapped-bitcoin": "WBTC",
+    "multi-collateral-dai": "DAI",
+    "shiba-inu": "SHIB",
+    "polygon": "MATIC",
+    "litecoin": "LTC",
+    "crypto-com-coin": "CRO",
+    "near-protocol": "NEAR",
+    "chainlink": "LINK",
+    "cosmos": "ATOM",
+    "terrausd": "UST",
+}
+
+
+def load_prices(path="histories.csv"):
+    """
+    Function to load histories.csv as a dataframe of prices indexed by the
+    UNIX time in milliseconds of each day.
+    """
+    prices_df = pd.read_csv(path, index_col=0)
+    prices_df.index = (
+        pd.to_datetime(prices_df.index).values.astype("datetime64[ms]").astype("int64")
+    )
+    return prices_df
+
+
+def assets_json(prices_df, limit):
+    """
+    Function to generate a response for the /assets endpoint. Coins are ranked
+    by column order in prices_df, with a market cap derived from the last price.
+    """
+    data = []
+    for rank, id in enumerate(prices_df.columns[:limit]):
+        last_price = prices_df[id].dropna().iloc[-1]
+        data.append(
+            {
+                "id": id,
+                "rank": str(rank + 1),
+                "symbol": SYMBOLS.get(id, id[:4].upper()),
+                "name": id.replace("-", " ").title(),
+                "priceUsd": str(last_price),
+                "marketCapUsd": str(last_price * 10**9 / (rank + 1)),
+            }
+        )
+    return {"data": data, "timestamp": int(time.time() * 1000)}
+
+
+def history_json(prices_df, id, start=None, end=None):
+    """
+    Function to generate a response for the /assets/{id}/history endpoint over
+    the interval [start, end] given in UNIX milliseconds.
+    """
+    prices = prices_df[id].dropna()
+    if start is not None:
+        prices = prices[prices.index >= start]
+    if end is not None:
+        prices = prices[prices.index <= end]
+    data = []
+    for unix, price in prices.items():
+        day = datetime.fromtimestamp(unix / 1000, tz=timezone.utc)
+        data.append(
+            {
+                "priceUsd": str(price),
+                "time": int(unix),
+                "date": day.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+            }
+        )
+    return {"data": data, "timestamp": int(time.time() * 1000)}
+
+
+def make_handler(prices_df, latency=0.0, max_rps=None):
+    """
+    Function to create a request handler class serving prices_df.
+    """
+    lock = threading.Lock()
+    window = []
+
+    class CoincapHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            if max_rps is not None:
+                with lock:
+                    now = time.monotonic()
+                    window[:] = [t for t in window if now - t < 1]
+                    limited = len(window) >= max_rps
+                    if not limited:
+                        window.append(now)
+                if limited:
+                    return self.send_json({"error": "rate limited"}, 429)
+
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            path = parts.path.rstrip("/").split("/")
+            if path[-1] == "assets":
+                limit = int(query.get("limit", 100))
+                return self.send_json(assets_json(prices_df, limit))
+            if path[-1] == "history" and path[-2] in prices_df.columns:
+                start = int(query["start"]) if "start" in query else None
+                end = int(query["end"]) if "end" in query else None
+                return self.send_json(history_json(prices_df, path[-2], start, end))
+            self.send_json({"error": "{} not found".format(parts.path)}, 404)
+
+        def send_json(self, body, status=200):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return CoincapHandler
+
+
+def serve_in_thread(path="histories.csv", port=0, latency=0.0, max_rps=None):
+    """
+    Function to start the stand-in server on a daemon thread. Returns the
+    server and its base url, e.g. "http://127.0.0.1:54321/v2". Call
+    server.shutdown() to stop it.
+    """
+    handler = make_handler(load_prices(path), latency, max_rps)
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}/v2".format(server.server_address[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--csv", default="histories.csv")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--max-rps", type=int, default=None)
+    args = parser.parse_args()
+
+    handler = make_handler(load_prices(args.csv), args.latency, args.max_rps)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), handler)
+    print("Serving coincap stand-in on http://127.0.0.1:{}/v2".format(args.port))
+    server.serve_forever()
@@ -0,0 +1,409 @@
+"""
+A bounded compute cache for the app's DataFrame functions, used in place of
+@st.cache(persist=True).
+
+st.cache hashes the full contents of every DataFrame argument on every call and
+pickles every distinct result to disk. The cached decorator below instead keys
+calls on the explicit inputs of their frames (see set_frame_key): a frame read
+from the price store is identified by its data version, coins and first date,
+a date slice by its parent's key and its rows, and a cached function's result
+by the function and the keys of its arguments, so the cost of a lookup doesn't
+grow with the length of the history. Only frames built elsewhere are hashed on
+all of their values. Results are held in a per-function in-memory LRU with size and TTL
+eviction, shared by every session in the process, and can optionally be
+spilled to a disk tier capped at CACHE_MAX_BYTES.
+
+    @cached(maxsize=64)
+    def gen_rebased_df(histories_df, ids_with_histories, start_date, end_date):
+        ...
+
+Concurrent misses on the same key are coalesced (see SingleFlight), so when
+several sessions ask for the same uncached result at once it is computed once
+and every caller receives it.
+
+cache_stats() returns hit/miss counts for every cached function, and while a
+trace is running each call is recorded as a span with its hit or miss (see
+instrumentation.py).
+"""
+
+import functools
+import hashlib
+import os
+import pickle
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import current_trace, frame_rows
+
+CACHE_DIR = os.environ.get("COMPUTE_CACHE_DIR", ".compute_cache")
+
+# Size in bytes above which the oldest files of the disk tier are deleted.
+CACHE_MAX_BYTES = int(os.environ.get("COMPUTE_CACHE_MAX_BYTES", 512 * 1024**2))
+
+_caches = {}
+
+# Keys of the frames identified by their inputs (see set_frame_key), by id,
+# each with a weak reference to its frame.
+_frame_keys = {}
+
+
+class LRUCache:
+    """
+    A thread safe least recently used cache holding at most maxsize entries,
+    each of which expires ttl seconds after it was stored (never if ttl is
+    None). With persist=True, entries are also pickled to CACHE_DIR and read
+    back on an in-memory miss, e.g. after a restart. Hits read back from disk
+    are counted as disk_hits as well as hits.
+    """
+
+    def __init__(self, name, maxsize=128, ttl=None, persist=False):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.persist = persist
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Function to look up key. Returns a (hit, value) pair.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[0]
+            if entry is not None:
+                del self._entries[key]
+                self.evictions += 1
+
+        if self.persist:
+            entry = self._read_disk(key)
+            if entry is not None and not self._expired(entry):
+                self._store(key, entry)
+                with self._lock:
+                    self.hits += 1
+                    self.disk_hits += 1
+                return True, entry[0]
+
+        with self._lock:
+            self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        entry = (value, time.time())
+        self._store(key, entry)
+        if self.persist:
+            self._write_disk(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+        }
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry[1] > self.ttl
+
+    def _disk_path(self, key):
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(CACHE_DIR, "{}-{}.pkl".format(self.name, digest))
+
+    def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            # mark the file as recently used, see prune_disk
+            os.utime(path)
+            return entry
+        except (OSError, pickle.PickleError, EOFError):
+            return None
+
+    def _write_disk(self, key, entry):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        path = self._disk_path(key)
+        tmp_path = "{}.{}.tmp".format(path, threading.get_ident())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entry, f)
+            os.replace(tmp_path, path)
+        except (OSError, pickle.PickleError):
+            return
+        prune_disk()
+
+
+def prune_disk(max_bytes=None):
+    """
+    Function to delete the least recently used files of the disk tier until
+    it holds at most max_bytes (default CACHE_MAX_BYTES).
+    """
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    try:
+        names = [name for name in os.listdir(CACHE_DIR) if name.endswith(".pkl")]
+    except OSError:
+        return
+    files = []
+    for name in names:
+        try:
+            stat = os.stat(os.path.join(CACHE_DIR, name))
+        except OSError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in files)
+    for _, size, name in sorted(files):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except OSError:
+            continue
+        total -= size
+
+
+class SingleFlight:
+    """
+    A group of in-flight calls, keyed on their arguments. While a call for a
+    key is running, other threads calling do with the same key wait for it to
+    finish and receive its result (or exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Function to return func(*args, **kwargs), unless a call for key is
+        already in flight, in which case that call's result is returned.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call["done"].wait()
+            if "error" in call:
+                raise call["error"]
+            return call["value"]
+
+        try:
+            call["value"] = func(*args, **kwargs)
+            return call["value"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+    def busy(self):
+        """
+        Function to return whether any call is in flight.
+        """
+        with self._lock:
+            return bool(self._calls)
+
+
+def single_flight(func):
+    """
+    Decorator coalescing concurrent calls to func with the same arguments (see
+    SingleFlight), without caching the result once the call has finished.
+    """
+    flights = SingleFlight()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (fingerprint(args), fingerprint(sorted(kwargs.items())))
+        return flights.do(key, func, *args, **kwargs)
+
+    wrapper.flights = flights
+    return wrapper
+
+
+def set_frame_key(df, key):
+    """
+    Function to identify the DataFrame or Series df in cache keys by key, a
+    hashable description of the explicit inputs it was read or derived from,
+    e.g. its data version, coins and dates. The key lasts as long as df, which
+    mustn't be mutated afterwards. Returns df.
+    """
+    df_id = id(df)
+
+    def forget(ref):
+        if _frame_keys.get(df_id, (None,))[0] is ref:
+            del _frame_keys[df_id]
+
+    _frame_keys[df_id] = (weakref.ref(df, forget), key)
+    return df
+
+
+def frame_key(df):
+    """
+    Function to return the key set for df by set_frame_key, None if it has none.
+    """
+    entry = _frame_keys.get(id(df))
+    if entry is None or entry[0]() is not df:
+        return None
+    return entry[1]
+
+
+def frame_fingerprint(df):
+    """
+    Function to create a fingerprint of a DataFrame or Series. Frames with a
+    key (see set_frame_key) are identified by it without reading their values,
+    other frames by their shape, labels and a hash of all of their values.
+    """
+    key = frame_key(df)
+    if key is not None:
+        return (type(df).__name__, key)
+    values = np.ascontiguousarray(df.to_numpy())
+    if values.dtype == object:
+        digest = hashlib.blake2b(repr(values.tolist()).encode()).hexdigest()
+    else:
+        digest = hashlib.blake2b(values.tobytes()).hexdigest()
+    columns = tuple(df.columns) if isinstance(df, pd.DataFrame) else df.name
+    n_rows = len(df)
+    return (
+        type(df).__name__,
+        df.shape,
+        columns,
+        df.index[0] if n_rows else None,
+        df.index[-1] if n_rows else None,
+        digest,
+    )
+
+
+def fingerprint(obj):
+    """
+    Function to convert a function argument into a hashable key with a stable
+    repr. Frames are fingerprinted with frame_fingerprint, containers
+    recursively and everything else must already be hashable.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return frame_fingerprint(obj)
+    if isinstance(obj, pd.Index):
+        return ("Index", tuple(obj))
+    if isinstance(obj, np.ndarray):
+        return ("ndarray", obj.shape, hashlib.blake2b(obj.tobytes()).hexdigest())
+    if isinstance(obj, dict):
+        return ("dict", tuple((k, fingerprint(v)) for k, v in obj.items()))
+    if isinstance(obj, (list, tuple)):
+        return (type(obj).__name__, tuple(fingerprint(x) for x in obj))
+    hash(obj)
+    return obj
+
+
+def code_hash(code):
+    """
+    Function to hash a function's code object from its bytecode, constants
+    (including those of nested functions and comprehensions) and the names it
+    uses, so that editing a constant or a called function's name changes it.
+    """
+    consts = []
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            consts.append(code_hash(const))
+        elif isinstance(const, frozenset):
+            # the iteration order of a set of strings changes between processes
+            consts.append(sorted(map(repr, const)))
+        else:
+            consts.append(repr(const))
+    source = code.co_code + repr((consts, code.co_names)).encode()
+    return hashlib.sha1(source).hexdigest()[:12]
+
+
+def cached(maxsize=128, ttl=None, persist=False):
+    """
+    Decorator caching a function's results in an LRUCache keyed on the
+    fingerprints of its arguments and a hash of its code (see code_hash), so
+    results are invalidated when the function is edited. Concurrent misses on
+    the same key are coalesced into a single call.
+    N.B. results are returned by reference, callers must not mutate them.
+    """
+
+    def decorator(func):
+        name = "{}.{}".format(func.__module__, func.__qualname__)
+        func_hash = code_hash(func.__code__)
+        cache = LRUCache(name, maxsize=maxsize, ttl=ttl, persist=persist)
+        flights = SingleFlight()
+        _caches[name] = cache
+
+        def compute(key, args, kwargs):
+            value = func(*args, **kwargs)
+            cache.put(key, value)
+            return value
+
+        def lookup(args, kwargs):
+            key = (func_hash, fingerprint(args), fingerprint(sorted(kwargs.items())))
+            hit, value = cache.get(key)
+            if not hit:
+                value = flights.do(key, compute, key, args, kwargs)
+            if (
+                isinstance(value, (pd.DataFrame, pd.Series))
+                and frame_key(value) is None
+            ):
+                # a result is identified by the call that computed it
+                set_frame_key(value, (name, key))
+            return hit, value
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            trace = current_trace()
+            if trace is None:
+                return lookup(args, kwargs)[1]
+            with trace.span(name, rows=frame_rows(args)) as span_args:
+                hit, value = lookup(args, kwargs)
+                span_args["cache"] = "hit" if hit else "miss"
+                trace.count("cache hits" if hit else "cache misses")
+                return value
+
+        wrapper.cache = cache
+        wrapper.flights = flights
+        return wrapper
+
+    return decorator
+
+
+def cache_stats():
+    """
+    Function to return the hit/miss statistics of every cached function.
+    """
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+def clear_caches():
+    for cache in _caches.values():
+        cache.clear()
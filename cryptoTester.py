@@ -1,18 +1,18 @@
+import logging
 import streamlit as st
 import plotly.express as px
-from datetime import date, timedelta
+from datetime import timedelta
 from data_creator import (
     create_market_cap_dict,
-    gen_rebased_df,
+    create_cumulative_df,
+    rebase_cumulative_df,
     ids2names_dict,
     names2ids_dict,
-    create_assets,
     gen_symbols,
-    create_histories_df,
-    create_unix_dates,
     create_returns_df,
     create_rebased_df,
     date_range,
+    utc_today,
 )
 from plot_creator import (
     write_coins,
@@ -21,6 +21,8 @@ from plot_creator import (
     load_images,
     gen_performance_df,
     add_drawdown,
+    start_page_trace,
+    profiling_panel,
 )
 from port_creator import (
     gen_all_returns,
@@ -33,6 +35,12 @@ from port_creator import (
     create_weights_df,
 )
 from risk_metrics import max_drawdown
+from refresher import current_dataset, start_refresher
+from instrumentation import span
+from pipeline import Pipeline
+
+# N.B. only records when profiling is enabled, see plot_creator.start_page_trace
+trace = start_page_trace("cryptoTester")
 
 
 st.markdown(
@@ -58,8 +66,8 @@ st.markdown(
 
 # load start and end dates for investment analysis
 lookback_years = 5  # max date range for backtest will be: lookback_years - 1
-start_date = date.today() - timedelta(365)
-end_date = date.today()
+start_date = utc_today() - timedelta(365)
+end_date = utc_today()
 
 if "start_date" not in st.session_state:
     st.session_state.start_date = start_date
@@ -71,25 +79,54 @@ if "max_coins" not in st.session_state:
 if "start_id" not in st.session_state:
     st.session_state.start_id = 1  # this is the id of the selected portfolio.
 
-# Pull down histories from coincap, and create dataframes for historic prices,
-# returns and rebased cumulative price; histories_df, returns_df, and
-# rebased_df, respectively.
-assets_json = create_assets(total_coins=50)
-symbols, names, coin_ids = gen_symbols(assets_json)
-ids2symbols = ids2names_dict(coin_ids, symbols)
-ids2names_dict = ids2names_dict(coin_ids, names)
-names2ids_dict = names2ids_dict(names, coin_ids)
-market_cap_dict = create_market_cap_dict(assets_json)
-start_unix, end_unix = create_unix_dates(
-    today=date.today(), lookback_years=lookback_years
-)
-histories_df = create_histories_df(coin_ids, start_unix, end_unix)
+# Load the current dataset, kept up to date by the background refresher (see
+# refresher.py).
+start_refresher()
+dataset = current_dataset(total_coins=50, lookback_years=lookback_years)
+if dataset is None:
+    st.info(
+        "The price data is being prepared, please reload the page in a few minutes."
+    )
+    st.stop()
+
+# The page's computations are nodes of a pipeline kept in the session, so that a
+# rerun only recomputes the nodes downstream of the inputs which changed, e.g.
+# changing the focus only redraws the figure (see pipeline.py).
+if "pipeline" not in st.session_state:
+    st.session_state.pipeline = Pipeline("cryptoTester")
+pipeline = st.session_state.pipeline
+pipeline.set_input("dataset", dataset, key=dataset.version)
+pipeline.set_input("start_date", st.session_state.start_date)
+pipeline.set_input("end_date", st.session_state.end_date)
+
+
+@pipeline.node("data", "dataset")
+def load_data(dataset):
+    # create the coin labels and dataframes for historic prices and cumulative
+    # price; histories_df and cumulative_df, respectively.
+    symbols, names, coin_ids = gen_symbols(dataset.assets_json)
+    return {
+        "coin_ids": coin_ids,
+        "ids2names": ids2names_dict(coin_ids, names),
+        "names2ids": names2ids_dict(names, coin_ids),
+        "market_cap_dict": create_market_cap_dict(dataset.assets_json),
+        "histories_df": dataset.histories_df,
+        "cumulative_df": create_cumulative_df(dataset.histories_df),
+    }
 
-# Create list of coin ids with full hisoties over the backtest period
-ids_with_histories = ids_with_histories(
-    histories_df, st.session_state.start_date, st.session_state.end_date
-)
-names_with_histories = list(map(ids2names_dict.get, ids_with_histories))
+
+@pipeline.node("universe", "data", "start_date", "end_date")
+def find_universe(data, start_date, end_date):
+    # Create list of coin ids with full hisoties over the backtest period
+    return ids_with_histories(data["histories_df"], start_date, end_date)
+
+
+data = pipeline.get("data")
+coin_ids = data["coin_ids"]
+ids2names = data["ids2names"]
+names2ids = data["names2ids"]
+history_ids = pipeline.get("universe")
+names_with_histories = list(map(ids2names.get, history_ids))
 
 
 def change_date_range():
@@ -187,20 +224,32 @@ with st.sidebar:
       """,
         )
 
-# calculate weghts for the uniform and markowitz pfs
-uniform_weights = uniform_weights_dict(
-    ids_with_histories[: int(st.session_state.max_coins)]
-)
-update_Markowitz = True
-try:
-    markowitz_weights = markowitz_weights_dict(
-        histories_df,
-        st.session_state.start_date,
-        ids_with_histories[: int(st.session_state.max_coins)],
-        analysis_days=365,
-    )
-except:
-    update_Markowitz = False
+pipeline.set_input("max_coins", int(st.session_state.max_coins))
+
+
+@pipeline.node("weights", "data", "universe", "start_date", "max_coins")
+def compute_weights(data, universe, start_date, max_coins):
+    # calculate weghts for the uniform and markowitz pfs, the markowitz weights
+    # are None if the optimiser fails for this date range
+    uniform_weights = uniform_weights_dict(universe[:max_coins])
+    try:
+        markowitz_weights = markowitz_weights_dict(
+            data["histories_df"],
+            start_date,
+            universe[:max_coins],
+            analysis_days=365,
+        )
+    except ValueError as e:
+        logging.getLogger("cryptoTester").warning(
+            "No Markowitz weights for %s: %s", start_date, e
+        )
+        markowitz_weights = None
+    return uniform_weights, markowitz_weights
+
+
+uniform_weights, markowitz_weights = pipeline.get("weights")
+update_Markowitz = markowitz_weights is not None
+if not update_Markowitz:
     st.warning("Markowitz weights could not be updated for this date range")
 
 if "strategy_dict" not in st.session_state:
@@ -225,18 +274,22 @@ with st.sidebar:
     )
 
 
-# calculate returns for the portfolios and add to it the  rebased df for assets
-# with hisories. This is the new returns_df
-rebased_df = gen_rebased_df(
-    histories_df,
-    ids_with_histories,
-    st.session_state.start_date,
-    st.session_state.end_date,
-)
+pipeline.set_input("strategy_dict", st.session_state.strategy_dict)
+
+
+@pipeline.node("rebased", "data", "universe", "start_date", "end_date")
+def rebase(data, universe, start_date, end_date):
+    return rebase_cumulative_df(data["cumulative_df"], universe, start_date, end_date)
 
-all_returns_df = gen_all_returns(
-    rebased_df, ids_with_histories, st.session_state.strategy_dict
-)
+
+@pipeline.node("portfolios", "rebased", "universe", "strategy_dict")
+def compute_portfolios(rebased_df, universe, strategy_dict):
+    # calculate returns for the portfolios and add to it the rebased df for
+    # assets with hisories. This is the new returns_df
+    return gen_all_returns(rebased_df, universe, strategy_dict)
+
+
+all_returns_df = pipeline.get("portfolios")
 
 if portfolio_type != "Create your own":
     st.session_state.portfolio_type = portfolio_type
@@ -244,21 +297,30 @@ if portfolio_type != "Create your own":
 st.subheader("Portfolio vs coin")
 focus = st.radio("Focus on", ("Portfolio 📉", "Coin 📈"))
 
-chart_df = create_chart_df(
-    all_returns_df, st.session_state.portfolio_type, names2ids_dict[selected_coin]
-)
+pipeline.set_input("portfolio_type", st.session_state.portfolio_type)
+pipeline.set_input("coin_id", names2ids[selected_coin])
+pipeline.set_input("focus", focus)
 
-fig = px.line(chart_df, x=chart_df.index, y="Value (USD)", color="Asset")
-if focus == "Portfolio 📉":
-    fig, port_dd, port_dd_start, port_dd_end = add_drawdown(
-        fig, all_returns_df, st.session_state.portfolio_type
-    )
-else:
-    fig, coin_dd, coin_dd_start, coin_dd_end = add_drawdown(
-        fig, all_returns_df, names2ids_dict[selected_coin]
+
+@pipeline.node("chart", "portfolios", "portfolio_type", "coin_id")
+def create_chart(all_returns_df, portfolio_type, coin_id):
+    return create_chart_df(all_returns_df, portfolio_type, coin_id)
+
+
+@pipeline.node("figure", "chart", "portfolios", "portfolio_type", "coin_id", "focus")
+def draw_figure(chart_df, all_returns_df, portfolio_type, coin_id, focus):
+    fig = px.line(
+        chart_df, x=chart_df.index, y="Value (USD)", color="Asset", render_mode="webgl"
     )
+    # draw the maximum drawdown of the asset under focus
+    focus_id = portfolio_type if focus == "Portfolio 📉" else coin_id
+    return add_drawdown(fig, all_returns_df, focus_id)
+
+
+fig, max_dd, dd_start, dd_end = pipeline.get("figure")
 
-st.write(fig)
+with span("plotly chart"):
+    st.write(fig)
 
 with st.expander("Asset performance"):
     if focus == "Portfolio 📉":
@@ -269,7 +331,7 @@ with st.expander("Asset performance"):
             "Initial $ amount", min_value=0, value=1000, step=1
         )
         final_amount = outlay * all_returns_df[st.session_state.portfolio_type][-1]
-        max_loss = outlay * port_dd
+        max_loss = outlay * max_dd
 
         with cols[1]:
             st.markdown(
@@ -283,7 +345,7 @@ with st.expander("Asset performance"):
             st.markdown(
                 """You would have suffered a maximum loss of **{:.0f}%** of your portfolio value
       between **{}** and **{}**""".format(
-                    port_dd * 100, port_dd_start, port_dd_end
+                    max_dd * 100, dd_start, dd_end
                 ),
                 unsafe_allow_html=True,
             )
@@ -294,8 +356,8 @@ with st.expander("Asset performance"):
         outlay = cols[0].number_input(
             "Initial $ amount", min_value=0, value=1000, step=1
         )
-        final_amount = outlay * all_returns_df[names2ids_dict[selected_coin]][-1]
-        max_loss = outlay * coin_dd
+        final_amount = outlay * all_returns_df[names2ids[selected_coin]][-1]
+        max_loss = outlay * max_dd
 
         with cols[1]:
             st.markdown(
@@ -309,7 +371,7 @@ with st.expander("Asset performance"):
             st.markdown(
                 """You would have suffered a maximum loss of **{:.0f}%** of your investment value
       between **{}** and **{}**""".format(
-                    coin_dd * 100, coin_dd_start, coin_dd_end
+                    max_dd * 100, dd_start, dd_end
                 ),
                 unsafe_allow_html=True,
             )
@@ -353,23 +415,31 @@ with st.sidebar:
         write_coins(
             non_zero_coins,
             st.session_state.strategy_dict[st.session_state.portfolio_type],
-            ids2names_dict,
+            ids2names,
         )
 
-performance_df = gen_performance_df(
-    all_returns_df, market_cap_dict, st.session_state.strategy_dict
-)
+
+@pipeline.node("metrics", "portfolios", "data", "strategy_dict")
+def compute_metrics(all_returns_df, data, strategy_dict):
+    return gen_performance_df(all_returns_df, data["market_cap_dict"], strategy_dict)
+
+
+performance_df = pipeline.get("metrics")
 
 
 st.subheader("Overview of performance of all available assets")
-st.dataframe(
-    performance_df.style.background_gradient(
-        cmap="Greens", subset=["Risk / return", "Total return %"]
-    )
-    .background_gradient(cmap="Reds", subset=["Annual vol", "Max loss %"])
-    .format(
-        "{:,.2f}",
-        subset=["Risk / return", "Total return %", "Annual vol", "Max loss %"],
+with span("styled performance table"):
+    st.dataframe(
+        performance_df.style.background_gradient(
+            cmap="Greens", subset=["Risk / return", "Total return %"]
+        )
+        .background_gradient(cmap="Reds", subset=["Annual vol", "Max loss %"])
+        .format(
+            "{:,.2f}",
+            subset=["Risk / return", "Total return %", "Annual vol", "Max loss %"],
+        )
+        .format("{:,.0f}", subset=["Market cap $M"])
     )
-    .format("{:,.0f}", subset=["Market cap $M"])
-)
+
+
+profiling_panel(trace)
@@ -1,15 +1,13 @@
 import streamlit as st
-import requests
-import json
 import plotly.express as px
 import pandas as pd
 import datetime as dt
 from risk_metrics import annual_return, absolute_return, annual_vol, max_drawdown
-
-try:
-    from PIL import Image
-except ImportError:
-    import Image
+from data_creator import create_rebased_df, create_returns_df, gen_symbols, utc_today
+from engine.charts import melt_downsampled
+from port_creator import create_port_rtns
+from image_cache import cart_png, logo_png
+from refresher import current_dataset, start_refresher
 import numpy as np
 
 st.markdown(
@@ -25,120 +23,41 @@ st.markdown(
 )
 
 
-def load_data(limit="10"):
-    """
-    Returns a dictionary with data for each of the top 'limit' cypto currencies
-    ranked by market cap. The data is generated by querying the coincap API
-    /assets endpoint. See coincap documentation for more info:
-    https://docs.coincap.io/
-
-    Parameters:
-      limit (str): The number of crypto coins that you want to return data for.
-        Ranked in order of market cap.
-
-    Returns:
-      (dict): A dictionary object of data.
-
-    """
-    url = "https://api.coincap.io/v2/assets"
-    # N.B. here adampt the params dict to only request what you need
-    payload = {"limit": limit}
-    headers = {}
-    return requests.request("GET", url, params=payload, headers=headers).json()
-
-
-def load_histories(ids_list):
-    url = "http://api.coincap.io/v2/assets/{}/history?interval=d1"
-
-    payload = {}
-    headers = {}
-
-    histories_dict = {}
-    for id in ids_list:
-        response_histories = requests.request(
-            "GET", url.format(id), headers=headers, data=payload
-        )
-        histories_json = response_histories.json()
-        histories_dict[id] = histories_json["data"]
-    return histories_dict
-
-
-def gen_symbols(assets_json):
-    symbols_list = []
-    names_list = []
-    ids_list = []
-    for dict in assets_json["data"]:
-        symbols_list.append(dict["symbol"])
-        names_list.append(dict["name"])
-        ids_list.append(dict["id"])
-    return symbols_list, names_list, ids_list
-
-
 def write_symbols(symbols_list):
     cols = st.columns(len(symbols_list))
     for i, symbol in enumerate(symbols_list):
         col = cols[i]
-        col.image(f"logos/{symbol}.png", width=40)
-        globals()[st.session_state.names[i]] = col.checkbox(symbol, value=0)
+        col.image(logo_png(symbol, 40), width=40)
+        globals()[names_list[i]] = col.checkbox(symbol, value=0)
         # col.checkbox(symbol, st.image(f'logos/{symbol}.png',width=40))
 
 
-if "assets_json" not in st.session_state:
-    st.session_state.assets_json = load_data()
-    symbols, names, ids = gen_symbols(st.session_state.assets_json)
-    st.session_state.symbols = symbols
-    st.session_state.names = names
-    st.session_state.ids = ids
-    st.session_state.histories = load_histories(ids)
-    id_symbol_map = {}
-    for i, id in enumerate(ids):
-        id_symbol_map[id] = symbols[i]
-    st.session_state.id_symbol_map = id_symbol_map
-
-
-# write_symbols(st.session_state.symbols)
-symbols_list = st.session_state.symbols
-names_list = st.session_state.names
-ids_list = st.session_state.ids
-asset_json = st.session_state.assets_json
-histories_dict = st.session_state.histories
-id_symbol_map = st.session_state.id_symbol_map
-
-
-def date_conv(date):
-    return dt.datetime.strptime(date, "%Y-%m-%d")
-
-
-price_histories_df = pd.DataFrame(columns=["coin", "date", "price"])
-return_histories_df = pd.DataFrame(columns=["coin", "date", "price"])
-for id in ids_list:
-    price = []
-    date = []
-    for observation in histories_dict[id]:
-        date.append(date_conv(observation["date"][0:10]))
-        # date.append(observation['time'])
-        price.append(float(observation["priceUsd"]))
-    price_df = pd.DataFrame({"coin": id, "date": date, "price": price})
-    price_histories_df = pd.concat([price_histories_df, price_df])
-    returns = [float(b) / float(a) for b, a in zip(price[1:], price[:-1])]
-    returns_df = pd.DataFrame({"coin": id, "date": date[1:], "price": returns})
-    return_histories_df = pd.concat([return_histories_df, returns_df])
-
-
-start_date = dt.date.today() - dt.timedelta(360)
-rebased_prices_df = pd.DataFrame(columns=["coin", "date", "price", "rebased_price"])
-for id in ids_list:
-    temp_rebase_df = return_histories_df[
-        (return_histories_df["date"] >= pd.Timestamp(start_date))
-        & (return_histories_df["coin"] == id)
-    ]
-    rebased_price = [1]
-    for i in range(1, len(temp_rebase_df)):
-        rebased_price.append(temp_rebase_df["price"].iloc[i] * rebased_price[i - 1])
-    temp_rebase_df["rebased_price"] = rebased_price
-    rebased_prices_df = pd.concat([rebased_prices_df, temp_rebase_df])
-
-fig2 = px.line(rebased_prices_df, x="date", y="rebased_price", color="coin")
+# The coin universe and price histories are the dataset shared by every session
+# (see refresher.py), sessions only hold their own widget state.
+start_refresher()
+dataset = current_dataset(total_coins=10)
+if dataset is None:
+    st.info(
+        "The price data is being prepared, please reload the page in a few minutes."
+    )
+    st.stop()
+asset_json = dataset.assets_json
+symbols_list, names_list, ids_list = gen_symbols(asset_json)
+histories_df = dataset.histories_df
+id_symbol_map = dict(zip(ids_list, symbols_list))
+
+
+# Both charts are computed on the wide returns matrix: one cumprod rebases every
+# coin at once and the portfolio is a single weighted sum of the rebased coins
+# (see port_creator.create_port_rtns), instead of looping over coins and dates.
+returns_df = create_returns_df(histories_df)
+start_date = utc_today() - dt.timedelta(360)
+rebased_prices_df = create_rebased_df(returns_df, start_date, utc_today())
+chart_df = melt_downsampled(rebased_prices_df, ids_list, "coin", "rebased_price")
+
+fig2 = px.line(
+    chart_df, x=chart_df.index, y="rebased_price", color="coin", render_mode="webgl"
+)
 st.write(fig2)
 cols = st.columns(len(symbols_list))
 checkboxes = []
@@ -155,14 +74,12 @@ def write_coins(id_symbol_map, n_cols=5):
     # cols = st.columns(n_coins)
     # checkboxes=[]
     for i, id in enumerate(id_symbol_map):
-        cols[i].image("logos/{}.png".format(id_symbol_map[id]), width=40)
-        globals()[st.session_state.names[i]] = cols[i].checkbox(
-            "include", value=1, key=id
-        )
+        cols[i].image(logo_png(id_symbol_map[id], 40), width=40)
+        globals()[names_list[i]] = cols[i].checkbox("include", value=1, key=id)
         globals()["slider_" + ids_list[i]] = cols[i].slider(
             id, min_value=0, max_value=100, value=50, key=id
         )
-        checkboxes.append(globals()[st.session_state.names[i]])
+        checkboxes.append(globals()[names_list[i]])
 
 
 write_coins(id_symbol_map)
@@ -171,8 +88,8 @@ write_coins(id_symbol_map)
 # for i, symbol in enumerate(symbols_list):
 #  col = cols[i]
 #  col.image(f'logos/{symbol}.png',width=40)
-#  globals()[st.session_state.names[i]] = col.checkbox(symbol, value = 1)
-#  checkboxes.append(globals()[st.session_state.names[i]])
+#  globals()[names_list[i]] = col.checkbox(symbol, value = 1)
+#  checkboxes.append(globals()[names_list[i]])
 
 
 # if any(checkboxes):
@@ -208,23 +125,6 @@ bottom_right = [650, 450]
 grid = create_grid(top_left, bottom_right)
 
 
-def add_logo(background, symbol, position, size=(70, 70)):
-    bg = Image.open(background)
-    fg = Image.open("logos/{}.png".format(symbol))
-
-    bg = bg.convert("RGBA")
-    fg = fg.convert("RGBA")
-
-    # Resize logo
-    fg_resized = fg.resize(size)
-
-    # Overlay logo onto background at position
-    bg.paste(fg_resized, box=position, mask=fg_resized)
-
-    # Save result
-    bg.save(background)
-
-
 cart_cols = st.columns([3, 2])
 
 
@@ -237,16 +137,17 @@ if any(checkboxes):
             # cart_cols[2].slider(ids_list[i],min_value=0, max_value=100, value=50)
 
 
-# change the below to make it run only if checked_ids ecists - i.e. wrap it up oin a function
-original = Image.open("images/cart.png")
-original.save("images/background.png")
+# The cart is composited in memory from cached logo tiles (see image_cache.py),
+# so each session gets its own image without writing to a shared file.
 position_ids = [round(x) for x in np.linspace(0, len(grid) - 1, num=len(checked_ids))]
-for i, id in enumerate(checked_ids):
-    size = tuple([int(num * globals()["slider_" + id] / 50) for num in (70, 70)])
-
-    add_logo(
-        "images/background.png", id_symbol_map[id], grid[position_ids[i]], size=size
+tiles = tuple(
+    (
+        id_symbol_map[id],
+        grid[position_ids[i]],
+        tuple([int(num * globals()["slider_" + id] / 50) for num in (70, 70)]),
     )
+    for i, id in enumerate(checked_ids)
+)
 
 weights = []
 for id in checked_ids:
@@ -263,7 +164,7 @@ pie_fig.update_layout(showlegend=False)
 bar_fig = px.bar(weights_df, x="portfolio", y="weights", color="ids", width=200)
 bar_fig.update_layout(showlegend=False)
 
-cart_cols[0].image("images/background.png", width=400)
+cart_cols[0].image(cart_png(tiles, width=400), width=400)
 cart_cols[1].write(bar_fig)
 gen_port = st.button("Generate portfolio return")
 
@@ -287,34 +188,13 @@ def write_metrics(prices, *metrics):
 
 
 if gen_port:
-    # adjust weight calculation to read in from globals()["slider_"+ids_list[i]]
-    # weights = [1/len(checked_ids)]*len(checked_ids)
-    portfolio_dict = {checked_ids[i]: weights[i] for i in range(len(checked_ids))}
-    start_date = dt.date.today() - dt.timedelta(360)
-    weighted_prices_df = pd.DataFrame(
-        columns=["coin", "date", "price", "weighted_price"]
+    start_date = utc_today() - dt.timedelta(360)
+    port_returns = create_port_rtns(
+        returns_df, weights, checked_ids, start_date, start_date + dt.timedelta(359)
+    )
+    port_returns_df = pd.DataFrame(
+        {"date": port_returns.index, "price": port_returns.to_numpy()}
     )
-    for id in checked_ids:
-        temp_weight_df = return_histories_df[
-            (return_histories_df["date"] >= pd.Timestamp(start_date))
-            & (return_histories_df["coin"] == id)
-        ]
-        weighted_price = [portfolio_dict[id]]
-        for i in range(1, len(temp_weight_df)):
-            weighted_price.append(
-                temp_weight_df["price"].iloc[i] * weighted_price[i - 1]
-            )
-        temp_weight_df["weighted_price"] = weighted_price
-        weighted_prices_df = pd.concat([weighted_prices_df, temp_weight_df])
-    date_list = [start_date + dt.timedelta(days=x) for x in range(360)]
-    port_returns = []
-    for date in date_list:
-        port_returns.append(
-            weighted_prices_df["weighted_price"][
-                weighted_prices_df["date"] == pd.Timestamp(date)
-            ].sum()
-        )
-    port_returns_df = pd.DataFrame({"date": date_list, "price": port_returns})
     prices = port_returns_df["price"]
     max_dd, start_idx, end_idx = max_drawdown(prices)
     start_dt = port_returns_df["date"].iloc[start_idx]
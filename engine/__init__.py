@@ -0,0 +1,10 @@
+"""
+A headless backtest engine: data loading (engine.data), portfolio construction
+and backtesting (engine.portfolio), batched efficient frontier solvers
+(engine.frontier), performance metrics (engine.metrics) and chart downsampling
+(engine.charts), with no dependency on streamlit. The app's
+data_creator, port_creator and risk_metrics modules are thin wrappers over it,
+and batch backtests can be run from the command line with:
+
+    python -m engine backtest --source histories.csv --out results.csv
+"""
@@ -0,0 +1,76 @@
+"""
+Downsampling of daily price series for charts, so that the number of points
+sent to the browser per series is bounded by a fixed budget however long the
+date range is.
+"""
+
+import numpy as np
+import pandas as pd
+
+from engine.metrics import performance_metrics
+
+# Default number of points per series in a chart.
+CHART_POINTS = 500
+
+
+def downsample_mask(values, max_points=CHART_POINTS):
+    """
+    A function to choose which rows of each column of a 2-D array of prices
+    (days x assets) to plot, keeping at most about max_points per column.
+
+    Uses min/max bucketing: the rows are split into max_points // 2 equal
+    buckets and the lowest and highest price of each bucket are kept, so every
+    peak and trough of the line survives at bucket resolution. On top of these
+    the first and last rows and the start and end of each column's max
+    drawdown (as drawn by plot_creator.add_drawdown) are always kept.
+
+    Returns a boolean array of the same shape as values, all True when there
+    are no more than max_points rows.
+    """
+    values = np.asarray(values, dtype="float64")
+    n_rows, n_cols = values.shape
+    if n_rows <= max_points:
+        return np.ones((n_rows, n_cols), dtype=bool)
+
+    # pad the rows with NaN to a whole number of buckets and reshape to
+    # (buckets x bucket size x columns); NaN is ignored by the argmin/argmax
+    n_buckets = max(max_points // 2, 1)
+    size = -(-n_rows // n_buckets)
+    n_buckets = -(-n_rows // size)
+    padded = np.full((n_buckets * size, n_cols), np.nan)
+    padded[:n_rows] = values
+    buckets = padded.reshape(n_buckets, size, n_cols)
+    offsets = np.arange(n_buckets)[:, None] * size
+    lows = offsets + np.argmin(np.nan_to_num(buckets, nan=np.inf), axis=1)
+    highs = offsets + np.argmax(np.nan_to_num(buckets, nan=-np.inf), axis=1)
+
+    cols = np.arange(n_cols)
+    keep = np.zeros((n_rows, n_cols), dtype=bool)
+    keep[np.minimum(lows, n_rows - 1), cols] = True
+    keep[np.minimum(highs, n_rows - 1), cols] = True
+    keep[[0, -1]] = True
+    metrics = performance_metrics(values)
+    keep[metrics["drawdown_start"], cols] = True
+    keep[metrics["drawdown_end"], cols] = True
+    return keep
+
+
+def melt_downsampled(df, columns, var_name, value_name, max_points=CHART_POINTS):
+    """
+    A function to melt the given columns of a dataframe of daily prices into
+    the long format px.line takes, as pd.melt(df, value_vars=columns,
+    ignore_index=False) does, keeping only the rows of each column chosen by
+    downsample_mask.
+    """
+    values = df[list(columns)].to_numpy(dtype="float64")
+    keep = downsample_mask(values, max_points)
+    # nonzero of the transpose orders the points column by column, as melt does
+    cols, rows = np.nonzero(keep.T)
+    melt_df = pd.DataFrame(
+        {
+            var_name: pd.Index(columns, dtype=object)[cols],
+            value_name: values[rows, cols],
+        },
+        index=df.index[rows],
+    )
+    return melt_df
@@ -0,0 +1,181 @@
+"""
+Command line entry point of the backtest engine, for running batches of
+backtests without streamlit. For example, to backtest the uniform and
+Markowitz portfolios of the largest 5, 10 and 20 coins held for a year from
+every 30th day, under a monthly and a 5% drift rebalancing schedule:
+
+    python -m engine backtest --source histories.csv --sizes 5 10 20 \\
+        --step 30 --schedules monthly 0.05 --cost-bps 10 --out results.csv
+
+--source is either a wide csv of prices or a price store directory. Results
+are written in one go as a csv with one row per start date, universe size,
+strategy and schedule.
+"""
+
+import argparse
+import time
+from datetime import timedelta
+
+import pandas as pd
+
+import price_store
+from engine.data import availability_index, investable_ids, load_prices
+from engine.metrics import performance_metrics
+from engine.portfolio import (
+    REBALANCE_FREQUENCIES,
+    backtest_rebalanced,
+    uniform_weights_dict,
+    walk_forward_weights,
+)
+
+STRATEGIES = ("Uniform", "Markowitz")
+
+
+def parse_schedule(value):
+    """
+    Function to convert a --schedules argument into a backtest_rebalanced
+    schedule: a calendar schedule name or a float drift threshold.
+    """
+    if value in ("buy_and_hold", "daily") or value in REBALANCE_FREQUENCIES:
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("unknown schedule {!r}".format(value))
+
+
+def start_dates(histories_df, analysis_days, holding_days, step):
+    """
+    Function to list every step-th date of histories_df which has analysis_days
+    of history before it and holding_days of history after it.
+    """
+    dates = histories_df.index
+    lo = dates.searchsorted(dates[0] + timedelta(analysis_days), side="left")
+    hi = dates.searchsorted(dates[-1] - timedelta(holding_days), side="right")
+    return dates[lo:hi:step]
+
+
+def universe(histories_df, start_date, end_date, analysis_days, size):
+    """
+    A function to return the largest size coins (histories_df columns are in
+    market cap order) with a full price history over both the analysis window
+    before start_date and the backtest period [start_date, end_date].
+    """
+    ids = investable_ids(
+        availability_index(histories_df),
+        start_date - timedelta(analysis_days),
+        end_date,
+        size,
+    )
+    return list(ids)
+
+
+def run_backtests(
+    histories_df,
+    sizes=(10,),
+    analysis_days=365,
+    holding_days=365,
+    step=30,
+    schedules=("buy_and_hold", "monthly"),
+    cost_bps=0.0,
+    slippage_bps=0.0,
+    strategies=STRATEGIES,
+):
+    """
+    A function to backtest each strategy in strategies for every universe size
+    in sizes, starting on every date from start_dates, under every schedule in
+    schedules. Markowitz weights come from walk_forward_markowitz, and start
+    dates without a solution are skipped for that strategy.
+
+    Returns a dataframe of performance metrics with one row per start date,
+    size, strategy and schedule.
+    """
+    results = []
+    for start_date in start_dates(histories_df, analysis_days, holding_days, step):
+        end_date = start_date + timedelta(holding_days)
+        for size in sizes:
+            ids = universe(histories_df, start_date, end_date, analysis_days, size)
+            if len(ids) < 2:
+                continue
+            strategy_dict = {}
+            if "Uniform" in strategies:
+                strategy_dict["Uniform"] = uniform_weights_dict(tuple(ids))
+            if "Markowitz" in strategies:
+                weights = walk_forward_weights(
+                    histories_df, start_date, ids, analysis_days
+                )
+                if weights is not None:
+                    strategy_dict["Markowitz"] = weights
+            if not strategy_dict:
+                continue
+
+            values_df = backtest_rebalanced(
+                histories_df[ids],
+                strategy_dict,
+                start_date,
+                end_date,
+                tuple(schedules),
+                cost_bps,
+                slippage_bps,
+            )
+            metrics = performance_metrics(values_df.to_numpy())
+            for i, (strategy, schedule) in enumerate(values_df.columns):
+                result = {
+                    "start_date": start_date,
+                    "end_date": end_date,
+                    "size": size,
+                    "coins": len(ids),
+                    "strategy": strategy,
+                    "schedule": schedule,
+                }
+                result.update({name: metrics[name][i] for name in metrics})
+                results.append(result)
+    return pd.DataFrame(results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m engine")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backtest = commands.add_parser("backtest", help="run a batch of backtests")
+    backtest.add_argument(
+        "--source",
+        default=price_store.PRICE_STORE_PATH,
+        help="csv of prices or price store directory",
+    )
+    backtest.add_argument("--sizes", type=int, nargs="+", default=[10])
+    backtest.add_argument("--analysis-days", type=int, default=365)
+    backtest.add_argument("--holding-days", type=int, default=365)
+    backtest.add_argument("--step", type=int, default=30)
+    backtest.add_argument(
+        "--schedules",
+        type=parse_schedule,
+        nargs="+",
+        default=["buy_and_hold", "monthly"],
+    )
+    backtest.add_argument("--cost-bps", type=float, default=0.0)
+    backtest.add_argument("--slippage-bps", type=float, default=0.0)
+    backtest.add_argument(
+        "--strategies", nargs="+", choices=STRATEGIES, default=list(STRATEGIES)
+    )
+    backtest.add_argument("--out", default="results.csv")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    histories_df = load_prices(args.source)
+    results_df = run_backtests(
+        histories_df,
+        sizes=args.sizes,
+        analysis_days=args.analysis_days,
+        holding_days=args.holding_days,
+        step=args.step,
+        schedules=args.schedules,
+        cost_bps=args.cost_bps,
+        slippage_bps=args.slippage_bps,
+        strategies=args.strategies,
+    )
+    results_df.to_csv(args.out, index=False)
+    print(
+        "Wrote {} results to {} in {:.1f}s".format(
+            len(results_df), args.out, time.perf_counter() - start
+        )
+    )
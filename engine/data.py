@@ -0,0 +1,576 @@
+"""
+Data loading for the backtest engine: downloading coin histories from the
+coincap api, persisting them in the price store and turning them into the
+price, return and rebased frames the rest of the engine works on.
+"""
+
+import calendar
+import logging
+import os
+import requests
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta, datetime, timezone
+import time
+import numpy as np
+import pandas as pd
+from os.path import exists
+from urllib.parse import urlsplit
+import price_store
+from compute_cache import cached, frame_key, set_frame_key, single_flight
+from instrumentation import instrumented
+
+logger = logging.getLogger(__name__)
+
+# Base url of the coincap api. Point this at a local stand-in server (see
+# coincap_server.py) to run the app or the downloader without hitting coincap.
+COINCAP_API_URL = os.environ.get("COINCAP_API_URL", "https://api.coincap.io/v2")
+
+# Requests per second coincap allows a client without an API key (200 a
+# minute). Set COINCAP_RATE_LIMIT=0 for no limit, e.g. against a local stand-in.
+COINCAP_RATE_LIMIT = float(os.environ.get("COINCAP_RATE_LIMIT", 200 / 60)) or None
+
+# Requests per second allowed to each host, shared by every request sent to it
+# (see host_limiter). Hosts which aren't listed aren't limited.
+HOST_RATE_LIMITS = {urlsplit(COINCAP_API_URL).netloc: COINCAP_RATE_LIMIT}
+
+
+# Response codes which are worth retrying: rate limited or server side errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@single_flight
+def fetch_assets(total_coins=50):
+    """
+    A function to retrieve info about the largest total_coins number of
+    cryptocurrencies, ranked by market cap, generated by a call to coincap assets
+    api. Concurrent calls share a single request.
+    """
+    url = COINCAP_API_URL + "/assets"
+
+    # N.B. here adampt the params dict to only request what you need
+    payload = {"limit": total_coins}
+    headers = {}
+
+    assets_json = requests.request("GET", url, params=payload, headers=headers).json()
+    return assets_json
+
+
+@cached()
+def gen_symbols(assets_json):
+    """
+    Function to generate three lists: symbols, names and ids, from the result of
+    a call to the coincap assets api, assets_json.
+    """
+    symbols_list = []
+    names_list = []
+    ids_list = []
+    for dict in assets_json["data"]:
+        symbols_list.append(dict["symbol"])
+        names_list.append(dict["name"])
+        ids_list.append(dict["id"])
+    return symbols_list, names_list, ids_list
+
+
+@cached()
+def create_market_cap_dict(assets_json):
+    market_cap_dict = {}
+    for asset_dict in assets_json["data"]:
+        market_cap_dict[asset_dict["id"]] = int(float(asset_dict["marketCapUsd"]))
+    return market_cap_dict
+
+
+class RateLimiter:
+    """
+    A thread safe token bucket which limits the number of requests per second
+    sent to a single host. A rate of None means no limit.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate is None:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._last) * self.rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+_host_limiters = {}
+_host_limiters_lock = threading.Lock()
+
+
+def host_limiter(url):
+    """
+    Function to return the RateLimiter shared by every request sent to the host
+    of url, so that concurrent downloads respect a single per-host rate, that
+    of the host in HOST_RATE_LIMITS.
+    """
+    host = urlsplit(url).netloc
+    with _host_limiters_lock:
+        limiter = _host_limiters.get(host)
+        if limiter is None:
+            rate = HOST_RATE_LIMITS.get(host)
+            limiter = RateLimiter(rate, burst=max(1, int(rate or 1)))
+            _host_limiters[host] = limiter
+    return limiter
+
+
+def create_session(pool_size=8):
+    """
+    Function to create a requests.Session with a connection pool large enough
+    for pool_size concurrent keep-alive connections to the same host.
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_json(session, url, params=None, limiter=None, retries=5, backoff=0.5):
+    """
+    Function to GET url and return the decoded json body. Responses with a
+    status in RETRY_STATUSES and connection errors are retried up to retries
+    times with exponential backoff, honouring any Retry-After header.
+    """
+    limiter = limiter or host_limiter(url)
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            response = session.get(url, params=params, timeout=30)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2**attempt)
+            continue
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            response.raise_for_status()
+            return response.json()
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            time.sleep(int(retry_after))
+        else:
+            time.sleep(backoff * 2**attempt)
+
+
+@instrumented
+def load_histories(coin_ids, start, end, max_workers=8, retries=5, backoff=0.5):
+    """
+    Function to load daily historic prices for all crypto currencies in the
+    coin_ids list within the time period defined by the interval [start, end].
+
+    Histories are downloaded concurrently by up to max_workers threads sharing
+    a single pooled session. Requests to the coincap host are capped at its
+    rate in HOST_RATE_LIMITS, and failed requests are retried with exponential
+    backoff (see get_json).
+    """
+    url = COINCAP_API_URL + "/assets/{}/history"
+
+    payload = {"interval": "d1", "start": start, "end": end}
+    limiter = host_limiter(url)
+
+    with create_session(pool_size=max_workers) as session:
+
+        def load_history(id):
+            histories_json = get_json(
+                session,
+                url.format(id),
+                params=payload,
+                limiter=limiter,
+                retries=retries,
+                backoff=backoff,
+            )
+            return histories_json["data"]
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            histories = list(executor.map(load_history, coin_ids))
+    return dict(zip(coin_ids, histories))
+
+
+def date_conv(date):
+    """
+    Function to convert string to datetime.date.
+    """
+    return datetime.strptime(date, "%Y-%m-%d").date()
+
+
+def utc_today():
+    """
+    Function to return today's date in UTC, the day of coincap's daily
+    observations, whatever the server's time zone.
+    """
+    return datetime.now(timezone.utc).date()
+
+
+def create_unix_dates(today=None, lookback_years=5):
+    """
+    A function to create start_unix and end_unix times in UNIX time in milliseconds,
+    lookback_years before today (utc_today() if None) and today.
+    N.B. both are UTC midnights (see date2unix), so that the window matches
+    coincap's daily observations whatever the server's time zone.
+    """
+    today = today or utc_today()
+    start_unix = date2unix(today - timedelta(365 * lookback_years))
+    end_unix = date2unix(today)
+    return start_unix, end_unix
+
+
+@instrumented
+def histories_to_df(histories_dict, coin_ids):
+    """
+    A function to convert the histories_dict returned by load_histories into a
+    dataframe of prices indexed by date with one column per coin id.
+    Coins with no observations are kept as all NaN columns.
+    N.B. All observations are flattened into one long array and pivoted in a
+    single scatter, using the UTC millisecond 'time' of each observation as
+    its day rather than parsing the 'date' strings.
+    """
+    counts = [len(histories_dict[id]) for id in coin_ids]
+    observations = [obs for id in coin_ids for obs in histories_dict[id]]
+
+    days = np.fromiter(
+        (obs["time"] for obs in observations), dtype="int64", count=len(observations)
+    )
+    days //= 86400000
+    prices = np.array([obs["priceUsd"] for obs in observations], dtype="float64")
+    columns = np.repeat(np.arange(len(coin_ids)), counts)
+
+    unique_days, rows = np.unique(days, return_inverse=True)
+    values = np.full((len(unique_days), len(coin_ids)), np.nan)
+    values[rows, columns] = prices
+    return pd.DataFrame(
+        values,
+        index=price_store.days2index(unique_days),
+        columns=list(coin_ids),
+    )
+
+
+def load_saved_histories(path=price_store.PRICE_STORE_PATH, seed_csv="histories.csv"):
+    """
+    Function to load the histories_df persisted by save_histories, or None if
+    nothing has been saved yet. An empty store is seeded from seed_csv when it
+    exists.
+    """
+    if not price_store.store_exists(path):
+        if seed_csv is None or not exists(seed_csv):
+            return None
+        price_store.csv_to_store(seed_csv, path)
+    return price_store.read_store(path)
+
+
+def save_histories(histories_df, path=price_store.PRICE_STORE_PATH):
+    """
+    Function to persist histories_df as a new version of the price store.
+    """
+    price_store.write_store(histories_df, path)
+
+
+def date2unix(day):
+    """
+    Function to convert a datetime.date into UNIX time in milliseconds at UTC
+    midnight, which is the timestamp coincap uses for daily observations.
+    """
+    return calendar.timegm(day.timetuple()) * 1000
+
+
+def missing_history_starts(histories_df, coin_ids, start_unix):
+    """
+    A function to find, for each coin in coin_ids, the UNIX time in milliseconds
+    from which its history needs downloading: the day of its last stored price,
+    which may have been provisional when it was downloaded, or start_unix for
+    coins with nothing stored (i.e. coins which are new to the top-N).
+    """
+    last_dates = histories_df.apply(pd.Series.last_valid_index)
+    starts = {}
+    for id in coin_ids:
+        last_date = last_dates.get(id)
+        if last_date is None or pd.isna(last_date):
+            starts[id] = start_unix
+        else:
+            starts[id] = max(start_unix, date2unix(last_date))
+    return starts
+
+
+@instrumented
+def update_histories_df(histories_df, coin_ids, start_unix, end_unix):
+    """
+    A function to bring histories_df up to date by downloading only the days
+    from each coin's last stored price, plus the full history over
+    [start_unix, end_unix] for coins which are not stored yet. Coins which share
+    a start date are downloaded in the same batch.
+    N.B. downloaded prices replace stored ones, so a last day stored before
+    its close was final is corrected.
+    """
+    starts = missing_history_starts(histories_df, coin_ids, start_unix)
+    batches = {}
+    for id, start in starts.items():
+        if start <= end_unix:
+            batches.setdefault(start, []).append(id)
+
+    for start, ids in batches.items():
+        logger.info("Downloading %d coin histories from coincap.io", len(ids))
+        histories_dict = load_histories(ids, start, end_unix)
+        new_df = histories_to_df(histories_dict, ids)
+        # new prices take precedence, stored prices are kept where coincap
+        # returned none
+        histories_df = new_df.combine_first(histories_df)
+    return histories_df
+
+
+@single_flight
+def load_histories_df(
+    coin_ids, start_unix, end_unix, path=price_store.PRICE_STORE_PATH
+):
+    """
+    A function to create a dataframe of historical prices for all of the
+    crypto currencies in the coin_ids=ids list, over a period defined by the
+    interval [start_unix, end_unix].
+    N.B. Histories are persisted in the price store at path, so only the days
+    since the last refresh (and the full history of coins new to coin_ids) are
+    downloaded from coincap. Concurrent calls in this process share one
+    refresh, and the store lock makes other processes wait for it and then
+    find the store already up to date rather than downloading again.
+    """
+    with price_store.store_lock(path):
+        saved_df = load_saved_histories(path)
+        if saved_df is None:
+            saved_df = pd.DataFrame(index=price_store.days2index([]))
+
+        # download missing histories from coincap.io
+        histories_df = update_histories_df(saved_df, coin_ids, start_unix, end_unix)
+
+        # store coin_ids first and in order, so that reading them back is a
+        # view of the store rather than a copy (see price_store.read_store)
+        stored_ids = set(coin_ids)
+        other_ids = [id for id in histories_df.columns if id not in stored_ids]
+        histories_df = histories_df[list(coin_ids) + other_ids]
+        if not histories_df.equals(saved_df):
+            save_histories(histories_df, path)
+
+    return read_histories_df(coin_ids, start_unix, path)
+
+
+@instrumented
+def read_histories_df(coin_ids, start_unix, path=price_store.PRICE_STORE_PATH):
+    """
+    A function to read the prices of the coins in coin_ids from start_unix
+    onwards from the price store at path, without downloading anything. Coins
+    which are not in the store are all NaN columns.
+    N.B. the frame is read only and may be a view of the store's memory map,
+    so it is shared rather than copied by every session and process.
+    """
+    start_date = datetime.utcfromtimestamp(start_unix / 1000).date()
+    histories_df = price_store.read_store(path, coin_ids, start_date)
+    version = histories_df.attrs["data_version"]
+    if list(histories_df.columns) != list(coin_ids):
+        histories_df = histories_df.reindex(columns=list(coin_ids))
+        histories_df.attrs["data_version"] = version
+    return set_frame_key(histories_df, (version, tuple(coin_ids), start_date))
+
+
+def load_prices(source=price_store.PRICE_STORE_PATH):
+    """
+    A function to load every price in source, either a price store directory
+    or a wide csv of prices such as histories.csv, as a dataframe indexed by
+    date with one column per coin in market cap order.
+    """
+    if os.path.isdir(source):
+        histories_df = price_store.read_store(source)
+    else:
+        histories_df = pd.read_csv(source, index_col=0)
+        histories_df.index = price_store.days2index(
+            price_store.dates2days(histories_df.index)
+        )
+        histories_df.attrs["data_version"] = "{}@{}".format(
+            source, os.path.getmtime(source)
+        )
+    return set_frame_key(histories_df, (histories_df.attrs["data_version"],))
+
+
+def date_slice(df, start_date=None, end_date=None):
+    """
+    A function to select the rows of df dated in [start_date, end_date] (open
+    ended if None). The bounds may be datetime.date, strings or timestamps and
+    are found by binary search of the int64 values of the sorted DatetimeIndex,
+    so the cost doesn't depend on the length of the history. The slice of a
+    frame with a cache key (see compute_cache.set_frame_key) is keyed on it and
+    its rows.
+    """
+    values = df.index.asi8
+    lo, hi = 0, len(values)
+    if start_date is not None:
+        lo = values.searchsorted(pd.Timestamp(start_date).value, side="left")
+    if end_date is not None:
+        hi = values.searchsorted(pd.Timestamp(end_date).value, side="right")
+    sliced_df = df.iloc[lo:hi]
+    key = frame_key(df)
+    if key is not None:
+        set_frame_key(sliced_df, ("date_slice", key, lo, hi))
+    return sliced_df
+
+
+def date_position(index, day):
+    """
+    Function to return the row of day in a sorted DatetimeIndex by binary
+    search, or -1 if it isn't there.
+    """
+    values = index.asi8
+    value = pd.Timestamp(day).value
+    row = values.searchsorted(value)
+    return row if row < len(values) and values[row] == value else -1
+
+
+@cached(maxsize=4)
+def availability_index(histories_df):
+    """
+    A function to index the dates on which each coin in histories_df has a
+    price, built once per data refresh. Returns a dict of arrays of row
+    positions:
+      first, last: each coin's first and last valid row (-1 if it has none).
+      gap_coins, gap_start, gap_end: one entry per run of missing prices
+        between a coin's first and last valid rows, covering the rows
+        [gap_start, gap_end) of column gap_coins.
+    plus the frame's dates (as int64) and columns, for use by investable_ids.
+    """
+    valid = histories_df.notna().to_numpy()
+    n_rows, n_coins = valid.shape
+    has_prices = valid.any(axis=0)
+    first = np.where(has_prices, valid.argmax(axis=0), -1)
+    last = np.where(has_prices, n_rows - 1 - valid[::-1].argmax(axis=0), -1)
+
+    # with the validity of each coin padded by a missing row at either end,
+    # its rises (missing -> valid) and falls (valid -> missing) alternate
+    # rise, fall, rise, fall... and the gaps run from each fall but the last
+    # to the following rise
+    padded = np.zeros((n_coins, n_rows + 2), dtype=np.int8)
+    padded[:, 1:-1] = valid.T
+    steps = np.diff(padded, axis=1)
+    rise_coins, rises = np.nonzero(steps == 1)
+    fall_coins, falls = np.nonzero(steps == -1)
+    last_fall = np.append(fall_coins[1:] != fall_coins[:-1], True)
+    first_rise = np.insert(rise_coins[1:] != rise_coins[:-1], 0, True)
+    return {
+        "dates": histories_df.index.asi8,
+        "columns": histories_df.columns,
+        "first": first,
+        "last": last,
+        "gap_coins": fall_coins[~last_fall],
+        "gap_start": falls[~last_fall],
+        "gap_end": rises[~first_rise],
+    }
+
+
+def investable_ids(availability, start_date, end_date, num_coins=None):
+    """
+    A function to return the coins of an availability_index with a price on
+    every date in [start_date, end_date], in column (i.e. market cap) order,
+    limited to the first num_coins if given. The date range is found by
+    binary search and coins are checked with vectorised comparisons, so the
+    cost doesn't depend on the length of the history.
+    N.B. as with dropna, an empty date range excludes no coins.
+    """
+    dates = availability["dates"]
+    lo = dates.searchsorted(pd.Timestamp(start_date).value, side="left")
+    hi = dates.searchsorted(pd.Timestamp(end_date).value, side="right")
+    columns = availability["columns"]
+    if hi <= lo:
+        return columns[:num_coins]
+
+    first, last = availability["first"], availability["last"]
+    complete = (first >= 0) & (first <= lo) & (last >= hi - 1)
+    in_range = (availability["gap_start"] < hi) & (availability["gap_end"] > lo)
+    complete[availability["gap_coins"][in_range]] = False
+    return columns[complete][:num_coins]
+
+
+@cached(maxsize=4)
+def create_returns_df(histories_df):
+    return histories_df.pct_change(1)
+
+
+# N.B. works on a copy of the slice because cached results are shared, so the
+# cached returns_df must not be changed when setting the start date return to 0.
+@cached(maxsize=64)
+def create_rebased_df(returns_df, start_date, end_date):
+    returns_df = date_slice(returns_df, start_date, end_date).copy()
+    returns_df.iloc[:1] = 0
+    return (1 + returns_df).cumprod()
+
+
+@cached(maxsize=8)
+def date_range(end_date, lookback_years):
+    return [end_date - timedelta(x) for x in range(365 * lookback_years)][::-1]
+
+
+@cached()
+def ids2names_dict(coin_ids, names):
+    ids2names_dict = {}
+    for i, id in enumerate(coin_ids):
+        ids2names_dict[id] = names[i]
+    return ids2names_dict
+
+
+@cached()
+def names2ids_dict(names, coin_ids):
+    names2ids_dict = {}
+    for i, name in enumerate(names):
+        names2ids_dict[name] = coin_ids[i]
+    return names2ids_dict
+
+
+@cached(maxsize=4)
+def create_cumulative_df(histories_df):
+    """
+    A function to create the cumulative return matrix of histories_df, built
+    once per data refresh. Each column is the coin's price forward filled over
+    gaps, i.e. its cumulative return up to a constant, so that the rebased
+    series over any date range is just a division by its row at the start of
+    the range (see rebase_cumulative_df).
+    """
+    return histories_df.ffill()
+
+
+@instrumented
+def rebase_cumulative_df(cumulative_df, ids_with_histories, start_date, end_date):
+    """
+    A function to rebase the coins in ids_with_histories to 1 at start_date over
+    the interval [start_date, end_date]. The date range is found by binary
+    search and only the rows inside it are touched, so the cost doesn't depend
+    on the length of the history. The result is keyed on cumulative_df's cache
+    key, the coins and the dates (see compute_cache.set_frame_key).
+    """
+    window_df = date_slice(cumulative_df, start_date, end_date)[ids_with_histories]
+    base = window_df.iloc[0]
+    if base.isna().any():
+        # coins listed during the window are rebased to their first price
+        base = window_df.bfill().iloc[0]
+    rebased_df = window_df / base
+    key = frame_key(cumulative_df)
+    if key is not None:
+        key = ("rebased", key, tuple(ids_with_histories), start_date, end_date)
+        set_frame_key(rebased_df, key)
+    return rebased_df
+
+
+@cached(maxsize=64)
+def gen_rebased_df(histories_df, ids_with_histories, start_date, end_date):
+    return rebase_cumulative_df(
+        create_cumulative_df(histories_df), ids_with_histories, start_date, end_date
+    )
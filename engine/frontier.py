@@ -0,0 +1,231 @@
+"""
+Long only efficient frontier portfolios (max Sharpe, min volatility and
+efficient return, as in pypfopt's EfficientFrontier) for a batch of expected
+returns and covariance matrices at once, e.g. every start date of a walk
+forward backtest. Problems of different universes, e.g. the 5, 10 and 20
+largest coins, can share a batch by passing a universe mask of the coins
+each problem may invest in, the others are given zero weight.
+
+Each problem is a small quadratic programme, min x^T Q x subject to a couple
+of linear equality constraints and x >= 0, which is solved exactly with a
+primal active set method: the equality constrained problem over the free
+variables is solved, and variables are fixed at zero when they would become
+negative and freed again when their Lagrange multiplier is negative. Every
+problem in the batch takes the same step together, with one stacked
+np.linalg.solve of the KKT systems per iteration, so there is no per-solve
+setup as with cvxpy, and problems drop out of the batch once they are solved.
+
+Problems without a solution (e.g. max Sharpe when no coin's expected return
+exceeds the risk free rate) return rows of NaN.
+"""
+
+import numpy as np
+
+# Ridge added to the diagonal of every covariance, relative to its mean
+# variance, so that the KKT systems of singular covariances can be solved.
+RIDGE = 1e-12
+
+# Relative tolerance on negative weights and Lagrange multipliers.
+TOLERANCE = 1e-10
+
+
+def active_set_qp(Q, A, b, x, free, allowed=None, max_iter=None):
+    """
+    A function to solve a batch of quadratic programmes
+
+        min 1/2 x^T Q x  subject to  A^T x = b,  x >= 0
+
+    with Q of shape (problems, n, n), A of shape (problems, n, m) and b of
+    shape (problems, m), from feasible starting points x of shape
+    (problems, n), with free the (problems, n) mask of variables not fixed
+    at zero. Variables outside the (problems, n) mask allowed, if given, are
+    never freed. Returns the solutions and a mask of the problems which
+    converged within max_iter iterations (default 10 n).
+    """
+    n_problems, n, m = A.shape
+    x = x.astype("float64").copy()
+    free = free.copy()
+    eye = np.eye(n)
+    running = np.ones(n_problems, dtype=bool)
+    for _ in range(max_iter or 10 * n):
+        rows = np.flatnonzero(running)
+        if not len(rows):
+            break
+        f = free[rows]
+        A_free = A[rows] * f[:, :, None]
+
+        # KKT systems of the equality constrained problems over the free
+        # variables, with an identity row x_i = 0 for each fixed variable
+        kkt = np.zeros((len(rows), n + m, n + m))
+        kkt[:, :n, :n] = np.where(f[:, :, None] & f[:, None, :], Q[rows], eye)
+        kkt[:, :n, n:] = A_free
+        kkt[:, n:, :n] = A_free.transpose(0, 2, 1)
+        kkt[:, n:, n:] = -RIDGE * np.eye(m)
+        rhs = np.zeros((len(rows), n + m))
+        rhs[:, n:] = b[rows]
+        solution = np.linalg.solve(kkt, rhs[:, :, None])[:, :, 0]
+        x_new, multipliers = solution[:, :n], solution[:, n:]
+
+        # step towards x_new, stopping at the first free variable to hit zero
+        x_old = x[rows]
+        scale = np.abs(x_new).max(axis=1, keepdims=True)
+        blocked = f & (x_new < -TOLERANCE * scale)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            ratios = np.where(blocked, x_old / (x_old - x_new), np.inf)
+        blocking = ratios.argmin(axis=1)
+        step = np.minimum(ratios.min(axis=1), 1)[:, None]
+        x_step = x_old + step * (x_new - x_old)
+        is_blocked = blocked.any(axis=1)
+        x_step[is_blocked, blocking[is_blocked]] = 0
+        f[is_blocked, blocking[is_blocked]] = False
+
+        # at x_new, free the fixed variable with the most negative multiplier
+        # of x_i >= 0, or stop if there is none
+        grad = np.einsum("pij,pj->pi", Q[rows], x_new) + np.einsum(
+            "pim,pm->pi", A[rows], multipliers
+        )
+        scale = np.abs(grad).max(axis=1, keepdims=True)
+        entry = ~f & (grad < -TOLERANCE * scale)
+        if allowed is not None:
+            entry &= allowed[rows]
+        candidates = np.where(entry, grad, np.inf)
+        entering = candidates.argmin(axis=1)
+        can_enter = ~is_blocked & np.isfinite(candidates.min(axis=1))
+        f[can_enter, entering[can_enter]] = True
+
+        x_step[~is_blocked] = np.where(f[~is_blocked], x_new[~is_blocked], 0)
+        x[rows] = x_step
+        free[rows] = f
+        running[rows[~is_blocked & ~can_enter]] = False
+    return np.maximum(x, 0), ~running
+
+
+def regularised(cov, universe):
+    """
+    Function to zero the covariances of coins outside each problem's universe
+    and add RIDGE times the mean variance to the diagonal of each of a batch
+    of covariance matrices.
+    """
+    n = cov.shape[-1]
+    cov = np.where(universe[:, :, None] & universe[:, None, :], cov, 0)
+    mean_variance = np.trace(cov, axis1=-2, axis2=-1) / universe.sum(axis=1)
+    return cov + RIDGE * mean_variance[:, None, None] * np.eye(n)
+
+
+def universe_mask(universe, shape):
+    """
+    Function to return the universe mask of a batch of problems of shape
+    (problems, n), every coin if universe is None.
+    """
+    if universe is None:
+        return np.ones(shape, dtype=bool)
+    return np.broadcast_to(np.asarray(universe, dtype=bool), shape)
+
+
+def min_volatility_batch(cov, universe=None):
+    """
+    A function to find the long only, fully invested weights with the least
+    volatility for each of a batch of covariance matrices of shape
+    (problems, n, n), investing only in the coins of the (problems, n) mask
+    universe, if given. Returns weights of shape (problems, n).
+    """
+    n_problems, n, _ = cov.shape
+    rows = np.arange(n_problems)
+    universe = universe_mask(universe, (n_problems, n))
+    # start fully invested in the least volatile coin
+    variances = np.diagonal(cov, axis1=1, axis2=2)
+    start = np.where(universe, variances, np.inf).argmin(axis=1)
+    x = np.zeros((n_problems, n))
+    x[rows, start] = 1
+    free = x > 0
+    A = np.ones((n_problems, n, 1))
+    b = np.ones((n_problems, 1))
+    weights, converged = active_set_qp(
+        regularised(cov, universe), A, b, x, free, universe
+    )
+    weights[~converged] = np.nan
+    return weights
+
+
+def max_sharpe_batch(mu, cov, risk_free_rate=0.02, universe=None):
+    """
+    A function to find the long only, fully invested weights maximising the
+    Sharpe ratio for each of a batch of expected returns of shape
+    (problems, n) and covariance matrices of shape (problems, n, n),
+    investing only in the coins of the (problems, n) mask universe, if given.
+
+    As in pypfopt, the problem is transformed into minimising y^T cov y
+    subject to (mu - risk_free_rate)^T y = 1 and y >= 0, and the weights are
+    y / sum(y). Problems where no coin's expected return exceeds the risk
+    free rate have no solution and are returned as NaN.
+    N.B. the excess returns are scaled to a largest magnitude of 1, which
+    leaves the weights unchanged, so that problems with huge expected returns
+    (e.g. annualised from a few days) are solved too.
+    """
+    n_problems, n = mu.shape
+    rows = np.arange(n_problems)
+    universe = universe_mask(universe, (n_problems, n))
+    excess = np.where(universe, mu - risk_free_rate, 0)
+    scale = np.abs(excess).max(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        excess = excess / np.where(scale > 0, scale, 1)
+    solvable = (excess > 0).any(axis=1)
+    # start fully invested in the coin with the highest expected return
+    start = excess.argmax(axis=1)
+    x = np.zeros((n_problems, n))
+    x[rows[solvable], start[solvable]] = 1 / excess[rows[solvable], start[solvable]]
+    free = x > 0
+    A = excess[:, :, None]
+    b = np.ones((n_problems, 1))
+    y, converged = active_set_qp(regularised(cov, universe), A, b, x, free, universe)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        weights = y / y.sum(axis=1, keepdims=True)
+    weights[~(solvable & converged)] = np.nan
+    return weights
+
+
+def efficient_return_batch(mu, cov, target_return, universe=None):
+    """
+    A function to find the long only, fully invested weights with the least
+    volatility and an expected return of at least target_return (a scalar or
+    one per problem) for each of a batch of expected returns of shape
+    (problems, n) and covariance matrices of shape (problems, n, n),
+    investing only in the coins of the (problems, n) mask universe, if given.
+
+    Where the min volatility portfolio already meets the target it is
+    returned, otherwise the return constraint is binding and the problem is
+    solved with it as an equality. Targets above every coin's expected return
+    can't be met and are returned as NaN.
+    """
+    n_problems, n = mu.shape
+    rows = np.arange(n_problems)
+    target = np.broadcast_to(np.asarray(target_return, dtype="float64"), n_problems)
+    universe = universe_mask(universe, (n_problems, n))
+    highest = np.where(universe, mu, -np.inf).max(axis=1)
+    mu = np.where(universe, mu, 0)
+    weights = min_volatility_batch(cov, universe)
+    binding = (np.einsum("pi,pi->p", weights, mu) < target) & (highest >= target)
+    weights[highest < target] = np.nan
+    if not binding.any():
+        return weights
+
+    # start from the mix of the highest and lowest return coins meeting the
+    # target exactly, which exist as the min volatility return is below it
+    p = rows[binding]
+    mu_b = mu[p]
+    high = np.where(universe[p], mu_b, -np.inf).argmax(axis=1)
+    low = np.where(universe[p], mu_b, np.inf).argmin(axis=1)
+    k = np.arange(len(p))
+    x = np.zeros((len(p), n))
+    x[k, high] = (target[p] - mu_b[k, low]) / (mu_b[k, high] - mu_b[k, low])
+    x[k, low] = 1 - x[k, high]
+    free = np.zeros((len(p), n), dtype=bool)
+    free[k, high] = free[k, low] = True
+    A = np.stack([np.ones((len(p), n)), mu_b], axis=2)
+    b = np.stack([np.ones(len(p)), target[p]], axis=1)
+    solved, converged = active_set_qp(
+        regularised(cov[p], universe[p]), A, b, x, free, universe[p]
+    )
+    solved[~converged] = np.nan
+    weights[p] = solved
+    return weights
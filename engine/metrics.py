@@ -0,0 +1,139 @@
+"""
+Return and risk metrics of daily price series.
+"""
+
+import numpy as np
+import pandas as pd
+
+from compute_cache import cached
+from instrumentation import instrumented
+
+
+def absolute_return(prices):
+    "a function to calculate the absolute return given a daily price series"
+    abs_rtn = (prices.iloc[-1] / prices[0]) - 1
+    return abs_rtn
+
+
+def annual_return(prices):
+    "a function to calculate the annualised return given a daily price series"
+    abs_rtn = absolute_return(prices)
+    annual_rnt = (pow((abs_rtn / 100) + 1, 365 / len(prices)) - 1) * 100
+    return annual_rnt
+
+
+@instrumented
+def max_drawdown(prices):
+    """
+    A function to calculate the max drawdown for a given price series "prices"
+    as well as the index of the start of the max drawdown period, "start_idx"
+    and the index of end of the max drawdwon period, "end index"
+    """
+    if type(prices) == type(pd.Series(dtype="object")):
+        prices = prices.values
+    end_idx = np.argmax(np.maximum.accumulate(prices) - prices)  # end of the period
+    start_idx = np.argmax(prices[:end_idx])  # start of period
+    max_dd = (prices[start_idx] - prices[end_idx]) / prices[start_idx]
+    return max_dd, start_idx, end_idx
+
+
+def annual_vol(prices):
+    """
+    A function to calculate the annuaised volatility of a price series assuming
+    cryptos trade 365 days a year
+    """
+    return prices.pct_change().std() * (365**0.5)
+
+
+@instrumented
+def performance_metrics(prices):
+    """
+    A function to calculate the return and risk metrics of every column of a 2-D
+    array of daily prices (days x assets) in a single NumPy pass, rather than one
+    call per column to the functions above. Returns a dict of 1-D arrays:
+      absolute_return, annual_return, annual_vol, sharpe: absolute_return /
+      annual_vol, max_drawdown, drawdown_start and drawdown_end: the row
+      indexes of the start and end of the max drawdown period.
+    """
+    prices = np.asarray(prices, dtype="float64")
+    if prices.ndim == 1:
+        prices = prices[:, None]
+    n_days, n_assets = prices.shape
+    cols = np.arange(n_assets)
+
+    abs_rtn = prices[-1] / prices[0] - 1
+    annual_rtn = pow(abs_rtn + 1, 365 / n_days) - 1
+    with np.errstate(invalid="ignore", divide="ignore"):
+        returns = prices[1:] / prices[:-1] - 1
+        std = np.nanstd if np.isnan(returns).any() else np.std
+        ann_vol = std(returns, axis=0, ddof=1) * (365**0.5)
+        sharpe = abs_rtn / ann_vol
+
+    # end of the max drawdown is the largest fall below the running maximum,
+    # and its start is the highest price before the end
+    drawdowns = np.fmax.accumulate(prices, axis=0) - prices
+    end_idx = np.argmax(np.nan_to_num(drawdowns, nan=-np.inf), axis=0)
+    before_end = np.arange(n_days)[:, None] < end_idx
+    start_idx = np.argmax(np.where(before_end, prices, -np.inf), axis=0)
+    start_prices = prices[start_idx, cols]
+    max_dd = (start_prices - prices[end_idx, cols]) / start_prices
+
+    return {
+        "absolute_return": abs_rtn,
+        "annual_return": annual_rtn,
+        "annual_vol": ann_vol,
+        "sharpe": sharpe,
+        "max_drawdown": max_dd,
+        "drawdown_start": start_idx,
+        "drawdown_end": end_idx,
+    }
+
+
+@cached(maxsize=64)
+def gen_performance_df(all_returns_df, market_cap_dict, strategy_dict):
+    """
+    A function to create the performance table of every portfolio and coin in
+    all_returns_df: total return, risk / return, annual volatility and max
+    loss over the period, plus market cap.
+    """
+    assets = all_returns_df.columns
+    performance_df = pd.DataFrame(index=assets)
+    performance_df["Type"] = [
+        "Portfolio" if x in strategy_dict else "Coin" for x in assets
+    ]
+    metrics = performance_metrics(all_returns_df.to_numpy())
+    abs_return = metrics["absolute_return"]
+    ann_vol = metrics["annual_vol"]
+    sharpe = metrics["sharpe"]
+    market_caps = [int(market_cap_dict.get(asset, 0)) for asset in assets]
+    performance_df["Total return %"] = abs_return * 100
+    performance_df["Risk / return"] = sharpe * 100
+    performance_df["Annual vol"] = ann_vol * 100
+    performance_df["Max loss %"] = metrics["max_drawdown"] * 100
+    performance_df["Market cap $M"] = [cap / 1000000 for cap in market_caps]
+    return performance_df
+
+
+@cached(maxsize=64)
+def gen_performance_ag_df(all_returns_df, market_cap_dict, strategy_dict):
+    """
+    A function to create the performance table of gen_performance_df with the
+    column names and asset column of the AgGrid viewer.
+    """
+    assets = all_returns_df.columns
+    performance_df = pd.DataFrame(index=assets)
+    performance_df["Asset"] = assets
+    performance_df["Type"] = [
+        "Portfolio" if x in strategy_dict else "Coin" for x in assets
+    ]
+    metrics = performance_metrics(all_returns_df.to_numpy())
+    abs_return = metrics["absolute_return"]
+    ann_vol = metrics["annual_vol"]
+    sharpe = metrics["sharpe"]
+    market_caps = [int(market_cap_dict.get(asset, 0)) for asset in assets]
+    performance_df["Risk adjusted return %"] = sharpe * 100
+    performance_df["Return over period %"] = abs_return * 100
+    performance_df["Annual volatility"] = ann_vol * 100
+    performance_df["Max loss %"] = metrics["max_drawdown"] * 100
+    performance_df["Market cap $M"] = [cap / 1000000 for cap in market_caps]
+    return performance_df
@@ -0,0 +1,572 @@
+"""
+Portfolio construction for the backtest engine: strategy weights (uniform and
+Markowitz max Sharpe), portfolio value series and rebalancing backtests.
+"""
+
+import numpy as np
+import pandas as pd
+from compute_cache import cached
+from engine.data import (
+    availability_index,
+    date_position,
+    date_slice,
+    investable_ids,
+)
+from engine.frontier import max_sharpe_batch
+from datetime import date, timedelta
+
+
+@cached(maxsize=64)
+def uniform(returns_df, num_coins, start_date, end_date):
+    # THERE IS AN ERROR
+    # Need to change this from num_coins being a number to investment_set being
+    # a list of assets available. otherwise there could be assets in your
+    # portfolio that are not included in your investment set graph
+    """
+    A function to return a uniform distribution of weights across all assets with
+    a full returns history (no NaN values) between start_date and end_date.
+
+    Returns:
+      weights: a vector of weights of dimension num_coins.
+      investment_cols: a vector of column names for coins with full histories.
+    """
+    investment_cols = investable_ids(
+        availability_index(returns_df), start_date, end_date, num_coins
+    )
+    weights = [1 / num_coins for _ in range(num_coins)]
+    return weights, investment_cols
+
+
+@cached()
+def markowitz(returns_df):
+    pass
+
+
+@cached(maxsize=64)
+def create_port_rtns(returns_df, weights, investment_cols, start_date, end_date):
+    investment_df = date_slice(returns_df, start_date, end_date)[investment_cols].copy()
+    investment_df.iloc[:1] = 0
+    rebased_df = (1 + investment_df).cumprod()
+    port_returns = rebased_df.dot(weights)
+    port_returns.index.name = "date"
+    port_returns.name = "price (USD)"
+    return port_returns
+
+
+@cached(maxsize=256, persist=True)
+def markowitz_weights(
+    histories_df, start_port_date, investment_cols, analysis_days=365
+):
+    weights = walk_forward_weights(
+        histories_df, start_port_date, investment_cols, analysis_days
+    )
+    if weights is not None:
+        return weights
+
+    # imported here as pypfopt (and cvxpy) is slow to import and only needed
+    # when walk_forward_markowitz has no solution
+    from pypfopt import EfficientFrontier, expected_returns, risk_models
+
+    start_analysis_date = start_port_date - timedelta(analysis_days)
+    analysis_df = date_slice(histories_df, start_analysis_date, start_port_date)[
+        investment_cols
+    ]
+
+    # Calculate expected returns and sample covariance
+    mu = expected_returns.mean_historical_return(analysis_df)
+    S = risk_models.sample_cov(analysis_df)
+    # Optimize for maximal Sharpe ratio
+    attempts = 0
+    while attempts < 50:
+        try:
+            ef = EfficientFrontier(mu, S, weight_bounds=(0, 1))
+            ef.max_sharpe()
+            break
+        except Exception as e:
+            attempts += 1
+    try:
+        cleaned_weights = ef.clean_weights()
+    except Exception as e:
+        print(
+            "Could not find optimal solution, try changing optimisation constraints or investment set"
+        )
+    return cleaned_weights
+
+
+@cached()
+def create_weights_df(weights_dict, strategy):
+    return pd.DataFrame(
+        {
+            "strategy": strategy,
+            "assets": list(weights_dict.keys()),
+            "weights": list(weights_dict.values()),
+        }
+    )
+
+
+@cached(maxsize=64)
+def ids_with_histories(histories_df, start_date, end_date):
+    """
+    A function to return the coins with a full price history (no NaN values)
+    between start_date and end_date, in market cap order (see investable_ids).
+    """
+    return investable_ids(availability_index(histories_df), start_date, end_date)
+
+
+@cached()
+def uniform_weights_dict(ids_with_histories):
+    weight = 1 / len(ids_with_histories)
+    uniform_weights_dict = {}
+    for id in ids_with_histories:
+        uniform_weights_dict[id] = weight
+    return uniform_weights_dict
+
+
+@cached(maxsize=256, persist=True)
+def markowitz_weights_dict(
+    histories_df, start_port_date, ids_with_histories, analysis_days=365
+):
+    """
+    A function to return the cleaned max Sharpe weights of ids_with_histories
+    for start_port_date, sorted by weight, from walk_forward_markowitz or, on
+    dates it has no solution for, from pypfopt. Raises a ValueError if the
+    optimiser finds no solution.
+    """
+    cleaned_weights = walk_forward_weights(
+        histories_df, start_port_date, ids_with_histories, analysis_days
+    )
+    if cleaned_weights is not None:
+        return {
+            k: v
+            for k, v in sorted(
+                cleaned_weights.items(), key=lambda item: item[1], reverse=True
+            )
+        }
+
+    # imported lazily, see markowitz_weights
+    from cvxpy.error import SolverError
+    from pypfopt import EfficientFrontier, expected_returns, risk_models
+    from pypfopt.exceptions import OptimizationError
+
+    start_analysis_date = start_port_date - timedelta(analysis_days)
+    analysis_df = date_slice(histories_df, start_analysis_date, start_port_date)[
+        ids_with_histories
+    ]
+
+    # Calculate expected returns and sample covariance
+    mu = expected_returns.mean_historical_return(analysis_df)
+    S = risk_models.sample_cov(analysis_df)
+    # Optimize for maximal Sharpe ratio
+    attempts = 0
+    while attempts < 10:
+        try:
+            ef = EfficientFrontier(mu, S, weight_bounds=(0, 1))
+            ef.max_sharpe()
+            break
+        except (ValueError, OptimizationError, SolverError) as e:
+            attempts += 1
+            error = e
+    else:
+        raise ValueError(
+            "Could not find optimal solution, try changing optimisation constraints or investment set"
+        ) from error
+    cleaned_weights = ef.clean_weights()
+    return {
+        k: v
+        for k, v in sorted(
+            cleaned_weights.items(), key=lambda item: item[1], reverse=True
+        )
+    }
+    # return cleaned_weights
+
+
+@cached(maxsize=64)
+def gen_port_rtns(rebased_df, weights_dict):
+    new_weights_dict = {
+        k: v for k, v in weights_dict.items() if k in rebased_df.columns
+    }
+    new_weights_dict = {
+        k: v / sum(new_weights_dict.values()) for k, v in new_weights_dict.items()
+    }
+    return rebased_df[list(new_weights_dict.keys())].dot(
+        list(new_weights_dict.values())
+    )
+    # return rebased_df[list(weights_dict.keys())].dot(list(weights_dict.values()))
+
+
+def create_weights_matrix(strategy_dict, columns):
+    """
+    A function to stack the weights of every strategy in strategy_dict into a
+    single (strategies x columns) matrix aligned to columns. As in
+    gen_port_rtns, weights for coins not in columns are dropped and each
+    strategy's remaining weights are renormalised to sum to 1.
+    """
+    positions = {id: i for i, id in enumerate(columns)}
+    weights = np.zeros((len(strategy_dict), len(columns)))
+    for row, weights_dict in enumerate(strategy_dict.values()):
+        for id, weight in weights_dict.items():
+            if id in positions:
+                weights[row, positions[id]] = weight
+    return weights / weights.sum(axis=1, keepdims=True)
+
+
+@cached(maxsize=64)
+def gen_all_returns(rebased_df, ids_with_histories, strategy_dict):
+    """
+    A function to generate returns for all portfolios and all coins with full
+    histories over the backtest period, rebased to the start of the backtest
+    period.
+    N.B. every portfolio is valued with a single matrix multiply of the rebased
+    prices by the stacked weights matrix, written into a preallocated frame
+    with the Uniform portfolio first, then the other portfolios, then coins.
+    """
+    names = [name for name in strategy_dict if name == "Uniform"]
+    names += [name for name in strategy_dict if name != "Uniform"]
+    weights = create_weights_matrix(
+        {name: strategy_dict[name] for name in names}, rebased_df.columns
+    )
+    prices = rebased_df.to_numpy(dtype="float64")
+    coin_positions = rebased_df.columns.get_indexer(ids_with_histories)
+
+    values = np.empty((len(prices), len(names) + len(coin_positions)))
+    values[:, : len(names)] = prices @ weights.T
+    values[:, len(names) :] = prices[:, coin_positions]
+    return pd.DataFrame(
+        values, index=rebased_df.index, columns=names + list(ids_with_histories)
+    )
+
+
+# pandas period frequencies of the calendar rebalancing schedules.
+REBALANCE_FREQUENCIES = {"weekly": "W", "monthly": "M"}
+
+# Number of days of covariances rolling_moments computes at once.
+MOMENT_BLOCK_DAYS = 32
+
+
+def rebalance_rows(dates, schedule):
+    """
+    A function to return the row positions in dates (excluding the first, on
+    which the portfolio is bought) at which a calendar schedule rebalances:
+    never for "buy_and_hold", every row for "daily" and the first row of each
+    new week or month for "weekly" and "monthly".
+    """
+    if schedule == "buy_and_hold":
+        return np.array([], dtype=int)
+    if schedule == "daily":
+        return np.arange(1, len(dates))
+    days = np.asarray(dates, dtype="datetime64[D]")
+    if REBALANCE_FREQUENCIES[schedule] == "W":
+        # weeks start on Monday as pandas' "W" periods do, 1970-01-05 was one
+        periods = (days.astype("int64") + 3) // 7
+    else:
+        periods = days.astype("datetime64[M]")
+    return np.flatnonzero(periods[1:] != periods[:-1]) + 1
+
+
+def calendar_backtest(prices, weights, rows, cost=0.0):
+    """
+    A function to value every portfolio in weights (strategies x coins) over
+    prices (days x coins) when rebalanced back to its weights on the given rows.
+    Holdings are constant between rebalances, so each segment is valued with a
+    single matrix multiply. cost is the fraction of traded value lost to
+    transaction costs and slippage at each rebalance. Returns a days x strategies
+    array of values starting at 1.
+    """
+    values = np.empty((len(prices), len(weights)))
+    bounds = np.concatenate(([0], rows, [len(prices)])).astype(int)
+    value = np.ones(len(weights))
+    units = None
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        if units is not None:
+            pre_value = prices[lo] @ units.T
+            drifted = units * prices[lo] / pre_value[:, None]
+            value = pre_value * (1 - cost * np.abs(weights - drifted).sum(axis=1))
+        units = value[:, None] * weights / prices[lo]
+        values[lo:hi] = prices[lo:hi] @ units.T
+    return values
+
+
+def daily_backtest(prices, weights, cost=0.0):
+    """
+    A function equivalent to calendar_backtest rebalancing on every row, but
+    vectorised over days: each day's growth and the turnover needed to undo
+    that day's drift are computed for all days and strategies at once.
+    """
+    growth = prices[1:] / prices[:-1]
+    port_growth = growth @ weights.T
+    drifted = weights * growth[:, None, :] / port_growth[:, :, None]
+    turnover = np.abs(weights - drifted).sum(axis=2)
+    values = np.ones((len(prices), len(weights)))
+    values[1:] = np.cumprod(port_growth * (1 - cost * turnover), axis=0)
+    return values
+
+
+def threshold_backtest(prices, weights, threshold, cost=0.0):
+    """
+    A function to value every portfolio in weights over prices when it is
+    rebalanced only once any coin's weight has drifted more than threshold
+    (e.g. 0.05 for 5 percentage points) from its target. Each segment's values
+    and drift are computed in one pass up to the first breach.
+    """
+    values = np.empty((len(prices), len(weights)))
+    for s, target in enumerate(weights):
+        value, lo = 1.0, 0
+        while lo < len(prices):
+            units = value * target / prices[lo]
+            seg_values = prices[lo:] @ units
+            drift = np.abs(units * prices[lo:] / seg_values[:, None] - target)
+            breaches = np.flatnonzero(drift[1:].max(axis=1) > threshold)
+            hi = lo + 1 + breaches[0] if len(breaches) else len(prices)
+            values[lo:hi, s] = seg_values[: hi - lo]
+            if hi < len(prices):
+                pre_value = seg_values[hi - lo]
+                drifted = units * prices[hi] / pre_value
+                value = pre_value * (1 - cost * np.abs(target - drifted).sum())
+            lo = hi
+    return values
+
+
+def schedule_name(schedule):
+    if isinstance(schedule, str):
+        return schedule
+    return "threshold {:.0%}".format(schedule)
+
+
+@cached(maxsize=16)
+def backtest_rebalanced(
+    histories_df,
+    strategy_dict,
+    start_date,
+    end_date,
+    schedules=("buy_and_hold", "daily", "weekly", "monthly", 0.05),
+    cost_bps=0.0,
+    slippage_bps=0.0,
+):
+    """
+    A function to backtest every strategy in strategy_dict under every
+    rebalancing schedule in schedules over [start_date, end_date].
+
+    schedules may contain "buy_and_hold", "daily", "weekly", "monthly" or a
+    float drift threshold (see threshold_backtest). cost_bps and slippage_bps
+    are charged on the value traded at each rebalance; the initial purchase is
+    free, so "buy_and_hold" matches gen_port_rtns. As in gen_port_rtns, coins
+    without a full history over the period are dropped and the remaining
+    weights renormalised.
+
+    Returns a dataframe of portfolio values, rebased to 1 at start_date, with
+    (strategy, schedule) columns.
+    """
+    window_df = date_slice(histories_df, start_date, end_date).dropna(axis=1)
+    prices = window_df.to_numpy(dtype="float64")
+    prices = prices / prices[0]
+    weights = create_weights_matrix(strategy_dict, window_df.columns)
+    cost = (cost_bps + slippage_bps) / 10000
+
+    results = []
+    for schedule in schedules:
+        if schedule == "daily":
+            values = daily_backtest(prices, weights, cost)
+        elif isinstance(schedule, str):
+            rows = rebalance_rows(window_df.index, schedule)
+            values = calendar_backtest(prices, weights, rows, cost)
+        else:
+            values = threshold_backtest(prices, weights, schedule, cost)
+        results.append(values)
+
+    columns = pd.MultiIndex.from_tuples(
+        [
+            (strategy, schedule_name(schedule))
+            for schedule in schedules
+            for strategy in strategy_dict
+        ],
+        names=["strategy", "schedule"],
+    )
+    return pd.DataFrame(np.hstack(results), index=window_df.index, columns=columns)
+
+
+def window_starts(index, analysis_days):
+    """
+    Function to return, for every date of a sorted DatetimeIndex, the position
+    of the first date at most analysis_days days before it, i.e. the first row
+    of the analysis window markowitz_weights_dict slices for that start date.
+    """
+    values = index.asi8
+    return values.searchsorted((index - pd.Timedelta(days=analysis_days)).asi8)
+
+
+def rolling_moments(prices, starts, frequency=252):
+    """
+    A function to calculate, for every row k of prices (days x coins), the
+    annualised compounded mean return and sample covariance of the daily
+    returns of rows starts[k] to k, matching pypfopt's mean_historical_return
+    and sample_cov of those prices.
+
+    As in pypfopt (through pandas' pct_change and cov), missing prices are
+    padded forward within the window, so a coin's returns start at its first
+    price in the window, and the covariance of two coins is taken over the
+    returns they both have and normalised by their number. As each coin's
+    returns are a suffix of the window, every sum over a window is the
+    difference of two cumulative sums of log(1 + r), r or r r^T, so windows
+    may start anywhere. Moments of coins with fewer than two returns in a
+    window are NaN, and the moments of any subset of coins are a slice of
+    those of all coins.
+
+    Returns arrays of shape (days, coins) and (days, coins, coins).
+    """
+    n_days, n_coins = prices.shape
+    rows = np.arange(n_days)[:, None]
+    # first row at or after each row at which each coin has a price
+    first = np.where(np.isnan(prices), n_days, rows)
+    first = np.minimum.accumulate(first[::-1], axis=0)[::-1]
+    last = np.maximum.accumulate(np.where(np.isnan(prices), -1, rows), axis=0)
+    padded = np.take_along_axis(prices, np.maximum(last, 0), axis=0)
+    with np.errstate(invalid="ignore"):
+        returns = np.nan_to_num(padded[1:] / padded[:-1] - 1)
+
+    # cumulative sums of the returns before each row
+    cum_log = np.zeros((n_days, n_coins))
+    np.cumsum(np.log1p(returns), axis=0, out=cum_log[1:])
+    cum_r = np.zeros((n_days, n_coins))
+    np.cumsum(returns, axis=0, out=cum_r[1:])
+    cum_rr = np.zeros((n_days, n_coins, n_coins))
+    np.multiply(returns[:, :, None], returns[:, None, :], out=cum_rr[1:])
+    np.cumsum(cum_rr[1:], axis=0, out=cum_rr[1:])
+
+    # first row of each coin's returns in the window ending at each row
+    start = np.minimum(first[starts], rows)
+    count = rows - start
+    sum_log = cum_log - np.take_along_axis(cum_log, start, axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mu = np.exp(sum_log * frequency / count) - 1
+    mu[count < 2] = np.nan
+
+    # each pair of coins' sums are taken over the returns they both have, in
+    # blocks of days to bound the memory of the temporaries
+    coins = np.arange(n_coins)
+    cov = np.empty((n_days, n_coins, n_coins))
+    for lo in range(0, n_days, MOMENT_BLOCK_DAYS):
+        k = rows[lo : lo + MOMENT_BLOCK_DAYS, 0]
+        pair_start = np.maximum(start[k, :, None], start[k, None, :])
+        pair_count = (k[:, None, None] - pair_start).astype("float64")
+        pair_count[pair_count < 2] = np.nan
+        sum_rr = cum_rr[k] - cum_rr[pair_start, coins[:, None], coins[None, :]]
+        sum_r = cum_r[k][:, :, None] - cum_r[pair_start, coins[:, None]]
+        sum_rs = sum_r * sum_r.transpose(0, 2, 1)
+        cov[k] = (sum_rr - sum_rs / pair_count) / (pair_count - 1) * frequency
+    return mu, cov
+
+
+def fix_nonpositive_semidefinite(cov):
+    """
+    A function to fix the matrices of a batch of covariances which aren't
+    positive semidefinite as pypfopt's risk_models.fix_nonpositive_semidefinite
+    does by default, setting their negative eigenvalues to zero. Covariances
+    taken over different returns for each pair of coins (see rolling_moments)
+    needn't be positive semidefinite.
+    """
+    jitter = 1e-16 * np.eye(cov.shape[-1])
+    try:
+        np.linalg.cholesky(cov + jitter)
+        return cov
+    except np.linalg.LinAlgError:
+        pass
+    cov = cov.copy()
+    for k in range(len(cov)):
+        try:
+            np.linalg.cholesky(cov[k] + jitter)
+        except np.linalg.LinAlgError:
+            q, V = np.linalg.eigh(cov[k])
+            cov[k] = V @ np.diag(np.where(q > 0, q, 0)) @ V.T
+    return cov
+
+
+def max_sharpe_weights(mu, cov, risk_free_rate=0.02):
+    """
+    A function to find the long only, fully invested weights maximising the
+    Sharpe ratio for expected returns mu and covariance cov (see
+    engine.frontier.max_sharpe_batch). Returns None if no coin's expected
+    return exceeds the risk free rate, in which case pypfopt has no solution
+    either.
+    """
+    weights = max_sharpe_batch(mu[None], cov[None], risk_free_rate)[0]
+    return None if np.isnan(weights).any() else weights
+
+
+# Coins of the prefix of the columns (in market cap order) whose rolling
+# moments walk_forward_markowitz shares between investment sets, rounded up to
+# a power of two of at least MIN_MOMENT_COINS. Sets reaching beyond
+# MAX_MOMENT_COINS get moments of their own, as the moments take days x coins^2
+# memory.
+MIN_MOMENT_COINS = 16
+MAX_MOMENT_COINS = 64
+
+
+@cached(maxsize=4)
+def walk_forward_moments(histories_df, n_coins, analysis_days=365):
+    """
+    A function to calculate the rolling moments (see rolling_moments) of the
+    daily returns of the first n_coins coins of histories_df over the
+    analysis_days days before every date. They don't depend on the investment
+    set, so they are computed once per dataset and sliced by
+    walk_forward_markowitz for each investment set among those coins.
+    """
+    prices = histories_df.iloc[:, :n_coins].to_numpy(dtype="float64")
+    return rolling_moments(prices, window_starts(histories_df.index, analysis_days))
+
+
+@cached(maxsize=32)
+def walk_forward_markowitz(histories_df, investment_cols, analysis_days=365):
+    """
+    A function to precompute the max Sharpe weights of investment_cols for
+    every possible portfolio start date in histories_df, each using the
+    analysis_days days of history before it, as markowitz_weights_dict does.
+    The rolling moments of investment_cols are sliced from those shared by
+    every investment set among the largest coins (see walk_forward_moments)
+    and every day's optimisation is solved in a single batch (see
+    engine.frontier.max_sharpe_batch).
+
+    Each date's window is the one markowitz_weights_dict slices and coins
+    listed during it are included from their first price, as in pypfopt.
+    Returns a dataframe of cleaned weights indexed by start date, which is NaN
+    only on dates where pypfopt has no solution either: dates on which a coin
+    has fewer than two returns in the window and dates on which no coin's
+    expected return exceeds the risk free rate.
+    """
+    cols = histories_df.columns.get_indexer(list(investment_cols))
+    n_coins = max(MIN_MOMENT_COINS, 1 << int(cols.max(initial=0)).bit_length())
+    if n_coins <= MAX_MOMENT_COINS:
+        n_coins = min(n_coins, histories_df.shape[1])
+        mu, cov = walk_forward_moments(histories_df, n_coins, analysis_days)
+    else:
+        prices = histories_df.iloc[:, cols].to_numpy(dtype="float64")
+        mu, cov = rolling_moments(
+            prices, window_starts(histories_df.index, analysis_days)
+        )
+        cols = np.arange(len(cols))
+    weights = np.full((len(histories_df), len(cols)), np.nan)
+    valid = np.flatnonzero(~np.isnan(mu[:, cols]).any(axis=1))
+    if len(valid):
+        weights[valid] = max_sharpe_batch(
+            mu[np.ix_(valid, cols)],
+            fix_nonpositive_semidefinite(cov[np.ix_(valid, cols, cols)]),
+        )
+
+    # clean weights as pypfopt's clean_weights does
+    weights[np.abs(weights) < 1e-4] = 0
+    return pd.DataFrame(
+        np.round(weights, 5), index=histories_df.index, columns=list(investment_cols)
+    )
+
+
+def walk_forward_weights(histories_df, start_port_date, investment_cols, analysis_days):
+    """
+    Function to look up the precomputed Markowitz weights for start_port_date,
+    returning None if walk_forward_markowitz has no solution for that date.
+    """
+    weights_df = walk_forward_markowitz(
+        histories_df, tuple(investment_cols), analysis_days
+    )
+    row = date_position(weights_df.index, start_port_date)
+    if row == -1 or weights_df.iloc[row].isna().any():
+        return None
+    return weights_df.iloc[row].to_dict()
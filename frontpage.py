@@ -2,14 +2,13 @@
 # Imports
 # -------------------
 import streamlit as st
-import yfinance as yf
 import pandas as pd
 import numpy as np
 import plotly.graph_objs as go
 import plotly.io as pio
-from bs4 import BeautifulSoup
-import requests
 from datetime import datetime
+from image_cache import logo_png
+from market_data import daily_bars, market_snapshot, minute_bars
 
 # today's date
 today = datetime.today().strftime("%d %B %Y")
@@ -20,37 +19,9 @@ st.set_page_config(layout="wide")
 # -------------------
 # Web scraping Yahoo Finance
 # -------------------
-dic = {}
-url = "https://finance.yahoo.com/cryptocurrencies?offset=0&count=100"
-soup = BeautifulSoup(requests.get(url).text)
-
-# store values in separate lists and then in a dictionary
-for listing in soup.find_all("div", attrs={"id": "fin-scr-res-table"}):
-    symbol_list = []
-    name_list = []
-    price_list = []
-    change_list = []
-    mcap_list = []
-for symbol in listing.find_all("td", attrs={"aria-label": "Symbol"}):
-    symbol_list.append(symbol.text)
-    dic["Symbol"] = symbol_list
-for name in listing.find_all("td", attrs={"aria-label": "Name"}):
-    name_list.append(name.text)
-    dic["Name"] = name_list
-for price in listing.find_all("td", attrs={"aria-label": "Price (Intraday)"}):
-    price_list.append(price.text)
-    dic["Price"] = price_list
-for change in listing.find_all("td", attrs={"aria-label": "% Change"}):
-    change_list.append(change.text)
-    dic["% Change"] = change_list
-for mcap in listing.find_all("td", attrs={"aria-label": "Market Cap"}):
-    mcap_list.append(mcap.text)
-    dic["Market Cap"] = mcap_list
-
-# create a dataframe from dictionary
-df_scrape = pd.DataFrame(dic)
-df_scrape.Symbol = df_scrape.Symbol.str.replace("-USD", "")
-df_scrape.Name = df_scrape.Name.str.replace(" USD", "")
+# The snapshot and OHLC bars are cached and shared by every session, and only
+# refreshed from Yahoo when they are due (see market_data.py).
+df_scrape = market_snapshot()
 dic1 = dict(zip(df_scrape.Symbol, df_scrape.Name))
 
 
@@ -78,7 +49,7 @@ with st.sidebar.expander("Help"):
 with st.sidebar.expander("Sources"):
     st.markdown(
         """
-    - Python Libraries: yfinance, BeautifulSoup, Plotly, Pandas, Streamlit
+    - Python Libraries: BeautifulSoup, Plotly, Pandas, Streamlit
     - Prices: https://finance.yahoo.com
     - Logos: https://cryptologos.cc/
     """
@@ -92,7 +63,7 @@ st.write("Dashboard adapted from https://github.com/rohithteja/the-crypto-dashbo
 col1, col2 = st.columns([1, 10])
 with col1:
     try:
-        st.image(f"logos/{select_token}.png", width=70)
+        st.image(logo_png(select_token, 70), width=70)
     except:
         pass
 with col2:
@@ -110,7 +81,7 @@ st.markdown(
 )
 
 # download 5 year crypto prices from Yahoo Finance
-df = yf.download(tickers=f"{select_token}-{select_fiat}", period="5y", interval="1d")
+df = daily_bars(f"{select_token}-{select_fiat}").copy()
 
 # compute moving averages
 df["MA100"] = df.Close.rolling(100).mean()
@@ -163,7 +134,7 @@ st.markdown(
 )
 
 # download daily crypto prices from Yahoo Finance
-df = yf.download(tickers=f"{select_token}-{select_fiat}", period="1d", interval="1m")
+df = minute_bars(f"{select_token}-{select_fiat}")
 
 # Plotly line chart
 fig = go.Figure()
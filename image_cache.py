@@ -0,0 +1,102 @@
+"""
+In-memory cache of the app's logo and cart images.
+
+Logos are decoded from logos/<SYMBOL>.png once per process and kept as RGBA
+images, with resized tiles and encoded PNGs cached per size, so pages never
+decode or resize a logo on a rerun. The crypto_viewer cart is composited in
+memory from cached tiles over the cart image and returned as PNG bytes, which
+each session hands straight to st.image, so no shared file is written.
+
+All results are shared by every session in the process (see compute_cache)
+and must not be mutated by callers.
+"""
+
+import glob
+import io
+import os
+
+from PIL import Image
+
+from compute_cache import cached
+
+LOGO_DIR = "logos"
+CART_IMAGE = os.path.join("images", "cart.png")
+
+
+def logo_symbols():
+    """
+    Function to list the symbols of every logo in LOGO_DIR.
+    """
+    paths = glob.glob(os.path.join(LOGO_DIR, "*.png"))
+    return sorted(os.path.splitext(os.path.basename(path))[0] for path in paths)
+
+
+def encode_png(image):
+    """
+    Function to encode a PIL image as PNG bytes.
+    """
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def fit_width(image, width):
+    """
+    Function to scale an image down to width pixels wide, keeping its aspect
+    ratio. Images no wider than width are returned as they are.
+    """
+    if width is None or image.width <= width:
+        return image
+    height = max(round(image.height * width / image.width), 1)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+@cached(maxsize=128)
+def load_logo(symbol):
+    """
+    A function to decode the logo of symbol into an RGBA image.
+    """
+    with Image.open(os.path.join(LOGO_DIR, "{}.png".format(symbol))) as image:
+        return image.convert("RGBA")
+
+
+@cached(maxsize=1024)
+def logo_tile(symbol, size):
+    """
+    A function to return the logo of symbol resized to size=(width, height).
+    """
+    return load_logo(symbol).resize(size, Image.LANCZOS)
+
+
+@cached(maxsize=256)
+def logo_png(symbol, width):
+    """
+    A function to return the logo of symbol as PNG bytes width pixels wide,
+    i.e. already at the size st.image displays it, so streamlit doesn't decode
+    and resize it on every run.
+    """
+    return encode_png(fit_width(load_logo(symbol), width))
+
+
+@cached(maxsize=1)
+def load_cart():
+    with Image.open(CART_IMAGE) as image:
+        return image.convert("RGBA")
+
+
+@cached(maxsize=64)
+def cart_png(tiles, width=None):
+    """
+    A function to composite logos over the cart image and return the result
+    as PNG bytes, scaled down to width pixels wide if given. tiles is a tuple
+    of (symbol, position, size) triples: the logo of symbol is pasted with its
+    top left corner at position=(x, y), resized to size=(width, height). Tiles
+    with an empty size are skipped.
+    """
+    cart = load_cart().copy()
+    for symbol, position, size in tiles:
+        if min(size) <= 0:
+            continue
+        tile = logo_tile(symbol, tuple(size))
+        cart.paste(tile, box=tuple(position), mask=tile)
+    return encode_png(fit_width(cart, width))
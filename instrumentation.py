@@ -0,0 +1,222 @@
+"""
+Lightweight timing instrumentation of the app's reruns.
+
+A page starts a trace at the top of each run with start_trace, and every span
+and counter recorded while the run's thread executes is added to it:
+
+    trace = start_trace("cryptoTester")
+    with span("markowitz solve", rows=len(histories_df)):
+        ...
+    profiling_panel(trace)  # plot_creator, shows the trace in the sidebar
+
+Every call to a compute_cache.cached function is recorded as a span with its
+cache hit or miss and the number of rows of its frame arguments, and other
+functions can be wrapped with the instrumented decorator. Spans nest, so the
+time of a cache miss includes the spans of the cached functions it calls.
+
+Tracing is opt-in: start_trace only records when PROFILING=1 is set in the
+environment or the page is opened with ?profile=1. When no trace is running,
+span and count do nothing beyond a context variable lookup.
+
+Traces can be exported as json (Trace.to_dict) or in the Chrome trace event
+format (Trace.to_chrome_trace), which chrome://tracing and
+https://ui.perfetto.dev open.
+"""
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import pandas as pd
+
+PROFILING = os.environ.get("PROFILING", "0") == "1"
+
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Trace:
+    """
+    The spans and counters recorded during one run of a page. Each span is a
+    dict of its name, start and duration in seconds from the start of the
+    trace, nesting depth, thread id and args, e.g. {"cache": "hit"}.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.time()
+        self.spans = []
+        self.counters = {}
+        self.duration = None
+        self._start = time.perf_counter()
+        self._depth = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Context manager timing its body as a span called name. Yields the
+        span's args dict, so the body can add to them.
+        """
+        depth = self._depth
+        self._depth += 1
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            end = time.perf_counter()
+            self._depth = depth
+            with self._lock:
+                self.spans.append(
+                    {
+                        "name": name,
+                        "start": start - self._start,
+                        "duration": end - start,
+                        "depth": depth,
+                        "thread": threading.get_ident(),
+                        "args": args,
+                    }
+                )
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        """
+        Function to record the total wall time of the run, up to now.
+        """
+        self.duration = time.perf_counter() - self._start
+        return self
+
+    def summary(self):
+        """
+        A function to aggregate the spans by name into a dataframe with the
+        number of calls, total and maximum wall time in ms, cache hits and
+        misses and rows processed, slowest first.
+        """
+        rows = {}
+        for span in self.spans:
+            row = rows.setdefault(
+                span["name"],
+                {"calls": 0, "total ms": 0.0, "max ms": 0.0, "hits": 0, "misses": 0},
+            )
+            row["calls"] += 1
+            row["total ms"] += span["duration"] * 1000
+            row["max ms"] = max(row["max ms"], span["duration"] * 1000)
+            if span["args"].get("cache") == "hit":
+                row["hits"] += 1
+            elif span["args"].get("cache") == "miss":
+                row["misses"] += 1
+            if "rows" in span["args"]:
+                row["rows"] = row.get("rows", 0) + span["args"]["rows"]
+        summary_df = pd.DataFrame.from_dict(rows, orient="index")
+        if summary_df.empty:
+            return summary_df
+        return summary_df.sort_values("total ms", ascending=False)
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "duration": self.duration,
+            "spans": self.spans,
+            "counters": self.counters,
+        }
+
+    def to_chrome_trace(self):
+        """
+        A function to convert the trace into the Chrome trace event format, as
+        complete ("X") events in microseconds plus one counter ("C") event.
+        """
+        events = [
+            {
+                "name": span["name"],
+                "ph": "X",
+                "ts": span["start"] * 1e6,
+                "dur": span["duration"] * 1e6,
+                "pid": os.getpid(),
+                "tid": span["thread"],
+                "args": span["args"],
+            }
+            for span in self.spans
+        ]
+        if self.counters:
+            events.append(
+                {
+                    "name": "counters",
+                    "ph": "C",
+                    "ts": (self.duration or 0) * 1e6,
+                    "pid": os.getpid(),
+                    "args": self.counters,
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def start_trace(name, enabled=None):
+    """
+    Function to start a new trace called name for the current run, replacing
+    any previous one. Returns the trace, or None when tracing is not enabled
+    (by default PROFILING).
+    """
+    enabled = PROFILING if enabled is None else enabled
+    trace = Trace(name) if enabled else None
+    _current.set(trace)
+    return trace
+
+
+def current_trace():
+    return _current.get()
+
+
+@contextmanager
+def span(name, **args):
+    """
+    Context manager recording its body as a span of the current trace, if
+    there is one. Yields the span's args dict, or None.
+    """
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+    with trace.span(name, **args) as span_args:
+        yield span_args
+
+
+def count(name, n=1):
+    """
+    Function to add n to the counter called name of the current trace, if
+    there is one.
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def frame_rows(args):
+    """
+    Function to return the total number of rows of the DataFrame and Series
+    in args.
+    """
+    return sum(len(arg) for arg in args if isinstance(arg, (pd.DataFrame, pd.Series)))
+
+
+def instrumented(func):
+    """
+    Decorator recording every call to func as a span of the current trace,
+    with the number of rows of its frame arguments.
+    """
+    name = "{}.{}".format(func.__module__, func.__qualname__)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return func(*args, **kwargs)
+        with trace.span(name, rows=frame_rows(args)):
+            return func(*args, **kwargs)
+
+    return wrapper
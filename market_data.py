@@ -0,0 +1,254 @@
+"""
+Fetch layer for frontpage.py's market data: the Yahoo Finance crypto screener
+snapshot and each ticker's daily and minute OHLC bars.
+
+Every frame is refreshed at most once per refresh period: the snapshot every
+SNAPSHOT_TTL seconds, minute bars every minute and daily bars once per UTC day.
+Within a period results are served from an in-memory cache shared by every
+session (see compute_cache), and concurrent misses share a single request.
+Fetched frames are also written to the market directory of the price store,
+so a restarted app or another process serves them without a request, and a
+stored frame is served, stale, if Yahoo can't be reached. Daily bars are
+refreshed incrementally, only the days since the last stored bar are fetched.
+
+The endpoints can be pointed at the local stand-in serving recorded fixtures
+(see yahoo_server.py) with the YAHOO_SCREENER_URL and YAHOO_CHART_URL
+environment variables.
+"""
+
+import os
+import time
+
+import pandas as pd
+import requests
+
+import price_store
+from compute_cache import cached
+from engine.data import create_session, get_json
+
+YAHOO_SCREENER_URL = os.environ.get(
+    "YAHOO_SCREENER_URL", "https://finance.yahoo.com/cryptocurrencies"
+)
+YAHOO_CHART_URL = os.environ.get(
+    "YAHOO_CHART_URL", "https://query2.finance.yahoo.com/v8/finance/chart"
+)
+
+# Refresh periods in seconds of the screener snapshot, minute bars and daily
+# bars. Periods are aligned to the UNIX epoch, so the daily one is a UTC day.
+SNAPSHOT_TTL = 300
+MINUTE_TTL = 60
+DAILY_TTL = 24 * 60 * 60
+
+# Length of the daily history kept for each ticker.
+DAILY_RANGE = "5y"
+DAILY_YEARS = 5
+
+OHLC_COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+SCREENER_COLUMNS = {
+    "Symbol": "Symbol",
+    "Name": "Name",
+    "Price (Intraday)": "Price",
+    "% Change": "% Change",
+    "Market Cap": "Market Cap",
+}
+
+
+def refresh_period(ttl, now=None):
+    """
+    Function to return the number of the refresh period of length ttl seconds
+    that the UNIX time now (default the current time) falls in.
+    """
+    return int((time.time() if now is None else now) // ttl)
+
+
+def parse_screener(html):
+    """
+    A function to parse the table of the Yahoo Finance crypto screener page
+    into a dataframe with Symbol, Name, Price, % Change and Market Cap columns,
+    with the "-USD" and " USD" suffixes stripped from symbols and names.
+    """
+    # imported here as BeautifulSoup is only needed to refresh the snapshot
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("div", attrs={"id": "fin-scr-res-table"})
+    if table is None:
+        raise ValueError("no screener table in the response")
+    columns = {}
+    for label, column in SCREENER_COLUMNS.items():
+        cells = table.find_all("td", attrs={"aria-label": label})
+        columns[column] = [cell.text for cell in cells]
+    snapshot_df = pd.DataFrame(columns)
+    snapshot_df.Symbol = snapshot_df.Symbol.str.replace("-USD", "")
+    snapshot_df.Name = snapshot_df.Name.str.replace(" USD", "")
+    return snapshot_df
+
+
+def chart_to_df(chart_json):
+    """
+    A function to convert a Yahoo Finance chart api response into a dataframe
+    of OHLC bars with the OHLC_COLUMNS columns of yf.download, indexed by UTC
+    time. Bars without any prices are dropped.
+    """
+    result = chart_json["chart"]["result"][0]
+    timestamps = result.get("timestamp") or []
+    quote = result["indicators"]["quote"][0]
+    adjclose = result["indicators"].get("adjclose", [{}])[0].get("adjclose")
+    columns = {
+        "Open": quote.get("open"),
+        "High": quote.get("high"),
+        "Low": quote.get("low"),
+        "Close": quote.get("close"),
+        "Adj Close": adjclose or quote.get("close"),
+        "Volume": quote.get("volume"),
+    }
+    index = pd.to_datetime(timestamps, unit="s")
+    ohlc_df = pd.DataFrame(
+        {column: values or [None] * len(index) for column, values in columns.items()},
+        index=index,
+        dtype="float64",
+    )
+    return ohlc_df.dropna(how="all", subset=["Open", "High", "Low", "Close"])
+
+
+def fetch_snapshot():
+    """
+    A function to download and parse the Yahoo Finance crypto screener.
+    """
+    response = requests.get(
+        YAHOO_SCREENER_URL,
+        params={"offset": 0, "count": 100},
+        headers={"User-Agent": "Mozilla/5.0"},
+        timeout=30,
+    )
+    response.raise_for_status()
+    return parse_screener(response.text)
+
+
+def fetch_chart(ticker, params):
+    """
+    A function to download the chart api response for ticker with the given
+    query params (interval plus either range or period1 and period2) and
+    convert it with chart_to_df.
+    """
+    with create_session(pool_size=1) as session:
+        chart_json = get_json(session, "{}/{}".format(YAHOO_CHART_URL, ticker), params)
+    return chart_to_df(chart_json)
+
+
+def fetch_daily(ticker, stored_df=None):
+    """
+    A function to download DAILY_YEARS of daily bars of ticker. If stored_df
+    holds earlier bars, only the bars from its last day on are fetched (the
+    last one may have been partial) and appended to it.
+    """
+    if stored_df is None or stored_df.empty:
+        ohlc_df = fetch_chart(ticker, {"interval": "1d", "range": DAILY_RANGE})
+    else:
+        last_day = stored_df.index[-1]
+        new_df = fetch_chart(
+            ticker,
+            {
+                "interval": "1d",
+                "period1": int(last_day.timestamp()),
+                "period2": int(time.time()),
+            },
+        )
+        ohlc_df = pd.concat([stored_df[stored_df.index < last_day], new_df])
+        ohlc_df = ohlc_df[~ohlc_df.index.duplicated(keep="last")]
+        start = ohlc_df.index[-1] - pd.DateOffset(years=DAILY_YEARS)
+        ohlc_df = ohlc_df[ohlc_df.index >= start]
+    ohlc_df.index.name = "Date"
+    return ohlc_df
+
+
+def fetch_minute(ticker, stored_df=None):
+    """
+    A function to download the current day's minute bars of ticker.
+    """
+    ohlc_df = fetch_chart(ticker, {"interval": "1m", "range": "1d"})
+    ohlc_df.index.name = "Datetime"
+    return ohlc_df
+
+
+def load_market_frame(name, ttl, fetch, path):
+    """
+    A function to return the market frame called name from the price store at
+    path if it was fetched in the current refresh period, and otherwise to
+    fetch(stored_df) it, where stored_df is the stored frame or None, and store
+    the result. If the fetch fails the stored frame is returned instead, if
+    there is one.
+    """
+    stored_df = price_store.read_market_frame(name, path)
+    if stored_df is not None:
+        fetched_at = stored_df.attrs.get("fetched_at", 0)
+        if refresh_period(ttl, fetched_at) == refresh_period(ttl):
+            return stored_df
+    try:
+        frame = fetch(stored_df)
+    except (requests.RequestException, ValueError, KeyError, IndexError) as e:
+        if stored_df is None:
+            raise
+        print("Serving stored {} as the refresh failed: {!r}".format(name, e))
+        return stored_df
+    frame.attrs["fetched_at"] = time.time()
+    price_store.write_market_frame(frame, name, path)
+    return frame
+
+
+# N.B. the period arguments of the functions below are only part of the cache
+# key, so that the cached frames are refreshed when a new period starts.
+
+
+@cached(maxsize=4)
+def cached_snapshot(period, path):
+    return load_market_frame(
+        "snapshot", SNAPSHOT_TTL, lambda stored_df: fetch_snapshot(), path
+    )
+
+
+@cached(maxsize=64)
+def cached_daily_bars(ticker, period, path):
+    return load_market_frame(
+        ticker + "_1d",
+        DAILY_TTL,
+        lambda stored_df: fetch_daily(ticker, stored_df),
+        path,
+    )
+
+
+@cached(maxsize=64)
+def cached_minute_bars(ticker, period, path):
+    return load_market_frame(
+        ticker + "_1m",
+        MINUTE_TTL,
+        lambda stored_df: fetch_minute(ticker, stored_df),
+        path,
+    )
+
+
+def market_snapshot(path=None):
+    """
+    A function to return the current Yahoo Finance crypto screener snapshot
+    (see parse_screener), refreshed every SNAPSHOT_TTL seconds.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    return cached_snapshot(refresh_period(SNAPSHOT_TTL), path)
+
+
+def daily_bars(ticker, path=None):
+    """
+    A function to return DAILY_YEARS of daily OHLC bars of ticker, e.g.
+    "BTC-USD", refreshed once per UTC day.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    return cached_daily_bars(ticker, refresh_period(DAILY_TTL), path)
+
+
+def minute_bars(ticker, path=None):
+    """
+    A function to return the current day's minute OHLC bars of ticker,
+    refreshed every minute.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    return cached_minute_bars(ticker, refresh_period(MINUTE_TTL), path)
@@ -0,0 +1,188 @@
+"""
+Incremental recomputation of a page's pipeline across Streamlit reruns.
+
+Any widget change reruns the whole page script, so without help every stage of
+the page (the data, the investment universe, the portfolio weights, the
+rebased prices, the portfolio returns, the performance metrics and the
+figures) is looked up again, re-fingerprinting its frames in compute_cache,
+even when only a text line depends on the widget. A Pipeline instead holds the
+stages as a dependency graph of nodes over versioned inputs:
+
+    pipeline = st.session_state.pipeline  # one Pipeline per session
+    pipeline.set_input("start_date", st.session_state.start_date)
+
+    @pipeline.node("universe", "data", "start_date", "end_date")
+    def universe(data, start_date, end_date):
+        return ids_with_histories(data["histories_df"], start_date, end_date)
+
+    ids = pipeline.get("universe")
+
+An input's version changes only when its key (by default its fingerprint, see
+compute_cache.fingerprint) changes, and a node's version changes each time it
+is recomputed. get returns a node's stored value if the versions of its
+dependencies, its dependencies and its code (see compute_cache.code_hash) are
+the same as when it was last computed, and otherwise recomputes it, so only
+the nodes downstream of a changed input are recomputed.
+
+A node's value must only depend on its dependencies, as nothing else is
+tracked: node raises a ValueError if the function reads any value from the
+page's globals (e.g. a widget's value or st.session_state) rather than from
+its arguments, only functions, classes, modules and the constants of imported
+modules may be used. Nodes are registered on every run and each input must be
+set before the first get of a node depending on it (otherwise the previous
+run's value is used). While a trace is running every recompute is recorded as
+a span and recomputes and reuses are counted (see instrumentation.py).
+"""
+
+import builtins
+import dis
+import inspect
+import itertools
+
+from compute_cache import code_hash, fingerprint
+from instrumentation import count, span
+
+# Types of the values of imported modules that nodes may read as constants,
+# e.g. np.nan.
+CONSTANT_TYPES = (bool, int, float, complex, str, bytes, type(None))
+
+
+def global_reads(code):
+    """
+    Function to return the chains of names code, and the code nested in it,
+    reads from its globals, e.g. ["st", "session_state", "max_coins"] for
+    st.session_state.max_coins.
+    """
+    chains, chain = [], None
+    for instruction in dis.get_instructions(code):
+        if instruction.opname == "LOAD_GLOBAL":
+            chain = [instruction.argval]
+            chains.append(chain)
+        elif instruction.opname in ("LOAD_ATTR", "LOAD_METHOD") and chain:
+            chain.append(instruction.argval)
+        else:
+            chain = None
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            chains.extend(global_reads(const))
+    return chains
+
+
+def is_code(value):
+    return callable(value) or inspect.ismodule(value)
+
+
+def undeclared_reads(func):
+    """
+    Function to return the names of the values func reads from its globals
+    and closure which aren't functions, classes, modules or constants of
+    imported modules.
+    """
+    undeclared = []
+    for chain in global_reads(func.__code__):
+        value = func.__globals__.get(chain[0], getattr(builtins, chain[0], None))
+        depth = 1
+        while inspect.ismodule(value) and depth < len(chain):
+            value = getattr(value, chain[depth], None)
+            depth += 1
+        if not (is_code(value) or depth > 1 and isinstance(value, CONSTANT_TYPES)):
+            undeclared.append(".".join(chain[:depth]))
+    for name, cell in zip(func.__code__.co_freevars, func.__closure__ or ()):
+        if not is_code(cell.cell_contents):
+            undeclared.append(name)
+    return undeclared
+
+
+class Pipeline:
+    """
+    A dependency graph of nodes, each a function of inputs and other nodes,
+    whose results are kept until one of their dependencies changes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._versions = itertools.count(1)
+        self._inputs = {}  # name: (key, value, version)
+        self._nodes = {}  # name: (func, deps)
+        self._results = {}  # name: (dependency state, value, version)
+
+    def set_input(self, name, value, key=None):
+        """
+        Function to set the input called name to value. Its version only
+        changes if key, by default the fingerprint of value, has changed.
+        """
+        key = fingerprint(value) if key is None else key
+        current = self._inputs.get(name)
+        if current is None or current[0] != key:
+            self._inputs[name] = (key, value, next(self._versions))
+
+    def node(self, name, *deps):
+        """
+        Decorator registering a function as the node called name, computed
+        from the values of the inputs and nodes called deps, in order. Raises a
+        ValueError if the function reads values other than its arguments (see
+        undeclared_reads), which must be declared as inputs instead.
+        """
+
+        def decorator(func):
+            undeclared = undeclared_reads(func)
+            if undeclared:
+                raise ValueError(
+                    "node {} of {} reads {}, declare them as inputs".format(
+                        name, self.name, ", ".join(sorted(set(undeclared)))
+                    )
+                )
+            self._nodes[name] = (func, deps)
+            return func
+
+        return decorator
+
+    def get(self, name):
+        """
+        Function to return the value of the input or node called name,
+        recomputing the node and any of its dependencies that are out of date.
+        """
+        return self._resolve(name)[0]
+
+    def version(self, name):
+        return self._resolve(name)[1]
+
+    def invalidate(self, name=None):
+        """
+        Function to discard the stored result of the node called name, or of
+        every node if name is None.
+        """
+        if name is None:
+            self._results.clear()
+        else:
+            self._results.pop(name, None)
+
+    def _resolve(self, name):
+        """
+        Function to return a (value, version) pair for the input or node
+        called name.
+        """
+        if name in self._inputs:
+            _, value, version = self._inputs[name]
+            return value, version
+        if name not in self._nodes:
+            raise KeyError("{} is not an input or node of {}".format(name, self.name))
+
+        func, deps = self._nodes[name]
+        resolved = [self._resolve(dep) for dep in deps]
+        state = (
+            code_hash(func.__code__),
+            deps,
+            tuple(version for _, version in resolved),
+        )
+        result = self._results.get(name)
+        if result is not None and result[0] == state:
+            count("pipeline reuses")
+            return result[1], result[2]
+
+        count("pipeline recomputes")
+        with span("pipeline: " + name):
+            value = func(*(value for value, _ in resolved))
+        version = next(self._versions)
+        self._results[name] = (state, value, version)
+        return value, version
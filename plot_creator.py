@@ -1,39 +1,43 @@
 import pandas as pd
-import plotly.express as px
 import streamlit as st
-from PIL import Image
-import glob
-from risk_metrics import absolute_return, annual_vol, max_drawdown
-from streamlit_custom_slider import st_custom_slider
-
-
-@st.cache(persist=True, show_spinner=False)
-def create_rebase_chart(rebased_df, num_coins):
-    melt_df = pd.melt(rebased_df.iloc[:, :num_coins], ignore_index=False)
-    melt_df.columns = ["coin", "price (USD)"]
-    return melt_df
+from compute_cache import cached
+from image_cache import load_logo, logo_symbols
+from instrumentation import PROFILING, start_trace
+import json
+from engine.charts import CHART_POINTS, melt_downsampled
+from risk_metrics import max_drawdown
+from engine.metrics import gen_performance_df, gen_performance_ag_df
+
+# N.B. the chart dataframes below are downsampled to at most about
+# max_points points per line (see engine.charts.downsample_mask), keeping the
+# max drawdown of each line so add_drawdown still marks its true extremes.
+
+
+@cached(maxsize=64)
+def create_rebase_chart(rebased_df, num_coins, max_points=CHART_POINTS):
+    return melt_downsampled(
+        rebased_df, rebased_df.columns[:num_coins], "coin", "price (USD)", max_points
+    )
 
 
-@st.cache(persist=True, show_spinner=False)
-def create_chart_df(all_returns_df, portfolio, coin):
-    melt_df = pd.melt(all_returns_df, value_vars=[portfolio, coin], ignore_index=False)
-    melt_df.columns = ["Asset", "Value (USD)"]
-    return melt_df
+@cached(maxsize=64)
+def create_chart_df(all_returns_df, portfolio, coin, max_points=CHART_POINTS):
+    return melt_downsampled(
+        all_returns_df, [portfolio, coin], "Asset", "Value (USD)", max_points
+    )
 
 
-@st.cache(persist=True, show_spinner=False)
-def create_comparison_df(all_returns_df, selected_assets):
+@cached(maxsize=64)
+def create_comparison_df(all_returns_df, selected_assets, max_points=CHART_POINTS):
     selected_assets_present = [
         asset for asset in selected_assets if asset in list(all_returns_df.columns)
     ]
-    melt_df = pd.melt(
-        all_returns_df, value_vars=selected_assets_present, ignore_index=False
+    return melt_downsampled(
+        all_returns_df, selected_assets_present, "Asset", "Value (USD)", max_points
     )
-    melt_df.columns = ["Asset", "Value (USD)"]
-    return melt_df
 
 
-@st.cache(persist=True, show_spinner=False)
+@cached()
 def ordered_dict(dictionary):
     return {
         k: v
@@ -41,74 +45,16 @@ def ordered_dict(dictionary):
     }
 
 
-# allow output mutation in this function because I'm not worried about mutation
-# and i want to reduce the time it takes streamlit to check it hasn't mutated.
-@st.cache(persist=True, show_spinner=False, allow_output_mutation=True)
+@cached(maxsize=1)
 def load_images():
-    image_dict = {}
-    for filename in glob.glob("logos/*.jpg"):  # assuming all logos are png format
-        im = Image.open(filename)
-        image_dict[filename[6:][:-4]] = im
-    return image_dict
-
-
-@st.cache(persist=True, show_spinner=False)
-def gen_performance_df(all_returns_df, market_cap_dict, strategy_dict):
-    assets = all_returns_df.columns
-    performance_df = pd.DataFrame(index=assets)
-    performance_df["Type"] = [
-        "Portfolio" if x in list(strategy_dict.keys()) else "Coin" for x in assets
-    ]
-    abs_return = all_returns_df.apply(absolute_return)
-    ann_vol = all_returns_df.apply(annual_vol)
-    drawdown_triples = all_returns_df.apply(max_drawdown)
-    sharpe = abs_return.divide(ann_vol)
-    market_caps = []
-    for asset in assets:
-        try:
-            market_caps.append(int(market_cap_dict[asset]))
-        except:
-            market_caps.append(0)
-    performance_df["Total return %"] = abs_return * 100
-    performance_df["Risk / return"] = sharpe * 100
-    performance_df["Annual vol"] = ann_vol * 100
-    performance_df["Max loss %"] = drawdown_triples.iloc[0] * 100
-    performance_df["Market cap $M"] = [cap / 1000000 for cap in market_caps]
-    return performance_df
-
-
-@st.cache(persist=True, show_spinner=False)
-def gen_performance_ag_df(all_returns_df, market_cap_dict, strategy_dict):
-    assets = all_returns_df.columns
-    performance_df = pd.DataFrame(index=assets)
-    performance_df["Asset"] = assets
-    performance_df["Type"] = [
-        "Portfolio" if x in list(strategy_dict.keys()) else "Coin" for x in assets
-    ]
-    abs_return = all_returns_df.apply(absolute_return)
-    ann_vol = all_returns_df.apply(annual_vol)
-    drawdown_triples = all_returns_df.apply(max_drawdown)
-    sharpe = abs_return.divide(ann_vol)
-    market_caps = []
-    for asset in assets:
-        try:
-            market_caps.append(int(market_cap_dict[asset]))
-        except:
-            market_caps.append(0)
-    performance_df["Risk adjusted return %"] = sharpe * 100
-    performance_df["Return over period %"] = abs_return * 100
-    performance_df["Annual volatility"] = ann_vol * 100
-    performance_df["Max loss %"] = drawdown_triples.iloc[0] * 100
-    performance_df["Market cap $M"] = [cap / 1000000 for cap in market_caps]
-    return performance_df
-
-
-@st.cache(persist=True, show_spinner=False)
+    return {symbol: load_logo(symbol) for symbol in logo_symbols()}
+
+
 def add_drawdown(fig, all_returns_df, selected_asset):
     # calculate max drawdown
     max_dd, start_idx, end_idx = max_drawdown(all_returns_df[selected_asset])
-    start_dd = all_returns_df.index[start_idx]
-    end_dd = all_returns_df.index[end_idx]
+    start_dd = all_returns_df.index[start_idx].date()
+    end_dd = all_returns_df.index[end_idx].date()
     fig.add_vline(x=start_dd, line_width=1, line_color="red")
     fig.add_vline(x=end_dd, line_width=1, line_color="red")
     fig.add_vrect(
@@ -169,6 +115,10 @@ def write_bespoke_coins(coin_names, n_cols=2):
 
 
 def write_coins_custom(coin_names, n_cols=2):
+    # imported here as declaring the custom component is slow and it is only
+    # shown for "Create your own" portfolios
+    from streamlit_custom_slider import st_custom_slider
+
     n_coins = len(coin_names)
     n_rows = 1 + n_coins // int(n_cols)
 
@@ -189,6 +139,47 @@ def write_coins_custom(coin_names, n_cols=2):
     return weights_list
 
 
-@st.cache(persist=True, show_spinner=False)
+@cached()
 def get_pre_selected_idx(assets, pre_selected):
     return [i for i in range(len(assets)) if assets[i] in pre_selected]
+
+
+def start_page_trace(name):
+    """
+    A function to start the trace of this run of the page called name (see
+    instrumentation.py), if profiling is enabled by PROFILING=1 or by opening
+    the page with ?profile=1. Returns the trace or None.
+    """
+    profile = st.experimental_get_query_params().get("profile", ["0"])
+    return start_trace(name, enabled=PROFILING or profile[0] == "1")
+
+
+def profiling_panel(trace):
+    """
+    A function to show the spans and counters of trace in a sidebar panel,
+    with buttons to download it as json or as a Chrome trace. Does nothing if
+    trace is None, i.e. profiling is off.
+    """
+    if trace is None:
+        return
+    trace.finish()
+    with st.sidebar.expander("Profiling", expanded=True):
+        st.write("Run time: {:,.1f} ms".format(trace.duration * 1000))
+        st.write(trace.counters)
+        summary_df = trace.summary()
+        if not summary_df.empty:
+            st.dataframe(
+                summary_df.style.format("{:,.1f}", subset=["total ms", "max ms"])
+            )
+        st.download_button(
+            "Download json",
+            json.dumps(trace.to_dict(), default=str),
+            file_name="{}_trace.json".format(trace.name),
+            mime="application/json",
+        )
+        st.download_button(
+            "Download Chrome trace",
+            json.dumps(trace.to_chrome_trace(), default=str),
+            file_name="{}_chrome_trace.json".format(trace.name),
+            mime="application/json",
+        )
@@ -2,27 +2,30 @@ import streamlit as st
 import json
 import plotly.express as px
 import pandas as pd
-from datetime import date, timedelta, datetime
+from datetime import timedelta, datetime
 from risk_metrics import annual_return, absolute_return, annual_vol, max_drawdown
 import numpy as np
 from data_creator import (
-    create_assets,
     gen_symbols,
-    create_histories_df,
-    create_unix_dates,
     create_returns_df,
-    create_rebased_df,
+    create_cumulative_df,
+    rebase_cumulative_df,
     date_range,
+    utc_today,
 )
-from plot_creator import create_rebase_chart
+from plot_creator import create_rebase_chart, start_page_trace, profiling_panel
 from port_creator import uniform, create_port_rtns, markowitz_weights, create_weights_df
 from risk_metrics import max_drawdown
+from refresher import current_dataset, start_refresher
+from instrumentation import span
+
+trace = start_page_trace("port_viewer")
 
 
 # load start and end dates for investment analysis
 lookback_years = 5
-start_date = date.today() - timedelta(365)
-end_date = date.today()
+start_date = utc_today() - timedelta(365)
+end_date = utc_today()
 
 
 with st.sidebar:
@@ -49,36 +52,47 @@ with st.sidebar:
     )
 
 
-# Pull down histories from coincap, and create dataframes for historic prices,
-# returns and rebased cumulative price; histories_df, returns_df, and
-# rebased_df, respectively.
-# All fo the functions in the block below have been decorated with st.cache()
-# and so will only be re-run if their arguments, or their underlying code, are
-# changed
-assets_json = create_assets(total_coins=100)
+# Load histories, and create dataframes for historic prices, returns and
+# rebased cumulative price; histories_df, returns_df, and rebased_df,
+# respectively.
+# The dataset is kept up to date by the background refresher (see refresher.py).
+# The functions in the block below are cached and so will only be re-run if
+# their arguments, or their underlying code, are changed
+start_refresher()
+dataset = current_dataset(total_coins=100, lookback_years=lookback_years)
+if dataset is None:
+    st.info(
+        "The price data is being prepared, please reload the page in a few minutes."
+    )
+    st.stop()
+assets_json = dataset.assets_json
 symbols, names, coin_ids = gen_symbols(assets_json)
-start_unix, end_unix = create_unix_dates(
-    today=date.today(), lookback_years=lookback_years
-)
-histories_df = create_histories_df(coin_ids, start_unix, end_unix)
+histories_df = dataset.histories_df
 returns_df = create_returns_df(histories_df)
-rebased_df = create_rebased_df(returns_df, start_date=start_date, end_date=end_date)
+cumulative_df = create_cumulative_df(histories_df)
+# sessions keep only their date range, rebased_df is rebuilt from the shared
+# cumulative_df by binary search on every run
+if "rebase_dates" not in st.session_state:
+    st.session_state.rebase_dates = (start_date, end_date)
 
-if "rebased_df" not in st.session_state:
-    st.session_state.rebased_df = rebased_df
 
 # def adjust_rebased(returns_df, start_date, end_date):
 def adjust_rebased():
-    st.session_state.rebased_df = create_rebased_df(
-        returns_df,
-        start_date=st.session_state.myslider[0],
-        end_date=st.session_state.myslider[1],
-    )
+    st.session_state.rebase_dates = st.session_state.myslider
 
 
+rebased_df = rebase_cumulative_df(
+    cumulative_df,
+    cumulative_df.columns,
+    start_date=st.session_state.rebase_dates[0],
+    end_date=st.session_state.rebase_dates[1],
+)
+
 # Draw rebased graph
-melt_df = create_rebase_chart(st.session_state.rebased_df, num_coins=investment_set)
-fig = px.line(melt_df, x=melt_df.index, y="price (USD)", color="coin")
+melt_df = create_rebase_chart(rebased_df, num_coins=investment_set)
+fig = px.line(
+    melt_df, x=melt_df.index, y="price (USD)", color="coin", render_mode="webgl"
+)
 
 with st.expander("Quick explantion", expanded=True):
     st.subheader("What's this all about then, eh?")
@@ -112,13 +126,14 @@ start_port_date, end_port_date = st.select_slider(
     "Select date range for portolio backtest",
     key="myslider",
     options=date_list,
-    value=(date.today() - timedelta(365), date.today()),
+    value=(utc_today() - timedelta(365), utc_today()),
     on_change=adjust_rebased,
 )
 
 with st.expander("Coin view", expanded=False):
     st.subheader("Individual coin performance")
-    st.write(fig)
+    with span("plotly chart"):
+        st.write(fig)
 
 uniform_weights, investment_cols = uniform(
     returns_df,
@@ -150,8 +165,8 @@ port_return = returns_dict[portfolio_type]
 
 # calculate max drawdown
 max_dd, start_idx, end_idx = max_drawdown(port_return)
-start_dd = port_return.index[start_idx]
-end_dd = port_return.index[end_idx]
+start_dd = port_return.index[start_idx].date()
+end_dd = port_return.index[end_idx].date()
 
 
 port_fig = px.line(port_return, x=port_return.index, y="price (USD)")
@@ -177,8 +192,9 @@ bar_fig.update_layout(
 
 
 cols = st.columns([8, 1])
-cols[0].write(port_fig)
-cols[1].write(bar_fig)
+with span("plotly chart"):
+    cols[0].write(port_fig)
+    cols[1].write(bar_fig)
 
 cols = st.columns([1, 3])
 outlay = cols[0].number_input("Initial $ amount", min_value=0, value=1000, step=1)
@@ -195,3 +211,5 @@ cols[1].write(
         outlay, int(final_amount), max_dd * 100, start_dd, end_dd
     )
 )
+
+profiling_panel(trace)
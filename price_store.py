@@ -0,0 +1,268 @@
+"""
+A columnar on-disk store for daily coin prices.
+
+A store is a directory holding one or more versions of the price data plus a
+CURRENT file naming the latest version. Each version directory contains:
+
+    prices.npy  float64 matrix of shape (n_coins, n_days), one row per coin so
+                that each coin's history is contiguous on disk.
+    days.npy    int32 sorted day numbers (days since 1970-01-01), one per column.
+    ids.json    coin ids, one per row of prices.npy.
+
+The store directory also holds assets.json, the latest coincap assets
+response, so the coin universe can be read without a call to coincap, and a
+market directory of the frames fetched for frontpage.py (see market_data.py).
+
+Arrays are opened with np.load(mmap_mode="r") so reading a subset of coins and
+dates only touches the pages holding them. New versions are written alongside
+the old one and published by atomically replacing CURRENT, so readers never see
+a partially written store. Processes refreshing the store serialise on a file
+lock (see store_lock), so a refresh done by one is seen by the others.
+
+Convert the existing histories.csv with:
+
+    python price_store.py histories.csv price_store
+"""
+
+import json
+import os
+import shutil
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+import numpy as np
+import pandas as pd
+
+PRICE_STORE_PATH = os.environ.get("PRICE_STORE_PATH", "price_store")
+
+# Number of old versions kept on disk after a write, so that readers holding a
+# memory map of a previous version are not left with a deleted directory.
+KEEP_VERSIONS = 2
+
+
+def dates2days(dates):
+    """
+    Function to convert an iterable of datetime.date (or date strings) into an
+    array of int32 day numbers.
+    """
+    return np.asarray(dates, dtype="datetime64[D]").astype("int32")
+
+
+def days2dates(days):
+    """
+    Function to convert an array of day numbers into an array of datetime.date.
+    """
+    return np.asarray(days).astype("datetime64[D]").astype(object)
+
+
+def days2index(days):
+    """
+    Function to convert a sorted array of day numbers into the DatetimeIndex
+    used by every price frame, whose int64 values are searched in O(log n)
+    when slicing by date.
+    """
+    return pd.DatetimeIndex(np.asarray(days).astype("datetime64[D]"), name="date")
+
+
+def store_version(path=PRICE_STORE_PATH):
+    """
+    Function to return the name of the current version of the store at path, or
+    None if nothing has been written there yet.
+    """
+    try:
+        with open(os.path.join(path, "CURRENT")) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def store_exists(path=PRICE_STORE_PATH):
+    return store_version(path) is not None
+
+
+@contextmanager
+def store_lock(path=PRICE_STORE_PATH):
+    """
+    A context manager holding an exclusive lock on the store at path, shared
+    by every process on the machine, for the duration of a read-update-write of
+    the store. On platforms without fcntl only the directory is created.
+    """
+    os.makedirs(path, exist_ok=True)
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(path, "LOCK"), "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def open_store(path=PRICE_STORE_PATH, version=None):
+    """
+    Function to memory map a version of the store at path, the current one if
+    version is None. Returns the prices matrix, the day numbers and the list
+    of coin ids.
+    """
+    version_path = os.path.join(path, version or store_version(path))
+    prices = np.load(os.path.join(version_path, "prices.npy"), mmap_mode="r")
+    days = np.load(os.path.join(version_path, "days.npy"), mmap_mode="r")
+    with open(os.path.join(version_path, "ids.json")) as f:
+        ids = json.load(f)
+    return prices, days, ids
+
+
+def read_store(path=PRICE_STORE_PATH, coin_ids=None, start_date=None, end_date=None):
+    """
+    A function to read a dataframe of prices indexed by date (see days2index) from the
+    store at path. Only the coins in coin_ids (all coins if None) and the dates
+    in [start_date, end_date] are read from disk. Coins in coin_ids which are
+    not in the store are skipped. The returned frame is read only, and when
+    coin_ids are stored next to each other it is backed by the memory map
+    itself rather than a copy. The version read is recorded in the frame's
+    data_version attribute.
+    """
+    version = store_version(path)
+    prices, days, ids = open_store(path, version)
+
+    lo, hi = 0, len(days)
+    if start_date is not None:
+        lo = np.searchsorted(days, dates2days([start_date])[0], side="left")
+    if end_date is not None:
+        hi = np.searchsorted(days, dates2days([end_date])[0], side="right")
+
+    if coin_ids is None:
+        coin_ids = ids
+    positions = {id: i for i, id in enumerate(ids)}
+    coin_ids = [id for id in coin_ids if id in positions]
+    rows = [positions[id] for id in coin_ids]
+
+    if rows and rows == list(range(rows[0], rows[-1] + 1)):
+        # a contiguous block of coins is a read only view of the memory map,
+        # so every reader on the machine shares the same pages
+        values = prices[rows[0] : rows[-1] + 1, lo:hi].T
+    elif rows:
+        values = np.array(prices[rows, lo:hi]).T
+        values.flags.writeable = False
+    else:
+        values = np.empty((hi - lo, 0))
+    histories_df = pd.DataFrame(
+        values,
+        index=days2index(days[lo:hi]),
+        columns=coin_ids,
+    )
+    histories_df.attrs["data_version"] = version
+    return histories_df
+
+
+def write_store(histories_df, path=PRICE_STORE_PATH):
+    """
+    A function to write histories_df (prices indexed by date, one column per
+    coin) as a new version of the store at path and make it the current one.
+    Returns the name of the new version.
+    """
+    histories_df = histories_df.sort_index()
+    os.makedirs(path, exist_ok=True)
+    version = "{}-{}".format(time.time_ns(), os.getpid())
+    version_path = os.path.join(path, version)
+    os.makedirs(version_path)
+
+    prices = np.ascontiguousarray(histories_df.to_numpy(dtype="float64").T)
+    np.save(os.path.join(version_path, "prices.npy"), prices)
+    np.save(os.path.join(version_path, "days.npy"), dates2days(histories_df.index))
+    with open(os.path.join(version_path, "ids.json"), "w") as f:
+        json.dump([str(id) for id in histories_df.columns], f)
+
+    # publish the new version by atomically replacing CURRENT
+    tmp_path = os.path.join(path, "CURRENT.{}".format(os.getpid()))
+    with open(tmp_path, "w") as f:
+        f.write(version)
+    os.replace(tmp_path, os.path.join(path, "CURRENT"))
+
+    prune_store(path)
+    return version
+
+
+def prune_store(path=PRICE_STORE_PATH, keep=KEEP_VERSIONS):
+    """
+    Function to delete all but the newest keep versions of the store at path.
+    Versions newer than the current one may still be being written and are
+    left alone.
+    """
+    current = store_version(path)
+    versions = sorted(
+        name
+        for name in os.listdir(path)
+        if os.path.isdir(os.path.join(path, name)) and name < current
+    )
+    for name in versions[: max(0, len(versions) - (keep - 1))]:
+        shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def write_assets(assets_json, path=PRICE_STORE_PATH):
+    """
+    Function to atomically replace the assets snapshot of the store at path.
+    """
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, "assets.json.{}".format(os.getpid()))
+    with open(tmp_path, "w") as f:
+        json.dump(assets_json, f)
+    os.replace(tmp_path, os.path.join(path, "assets.json"))
+
+
+def read_assets(path=PRICE_STORE_PATH):
+    """
+    Function to read the assets snapshot of the store at path, or None if none
+    has been written.
+    """
+    try:
+        with open(os.path.join(path, "assets.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def write_market_frame(frame, name, path=PRICE_STORE_PATH):
+    """
+    Function to atomically replace the market frame called name in the store at
+    path, e.g. a ticker's OHLC bars. The frame's attrs are stored with it.
+    """
+    market_path = os.path.join(path, "market")
+    os.makedirs(market_path, exist_ok=True)
+    tmp_path = os.path.join(market_path, "{}.pkl.{}".format(name, os.getpid()))
+    frame.to_pickle(tmp_path)
+    os.replace(tmp_path, os.path.join(market_path, name + ".pkl"))
+
+
+def read_market_frame(name, path=PRICE_STORE_PATH):
+    """
+    Function to read the market frame called name from the store at path, or
+    None if none has been written.
+    """
+    try:
+        return pd.read_pickle(os.path.join(path, "market", name + ".pkl"))
+    except FileNotFoundError:
+        return None
+
+
+def csv_to_store(csv_path="histories.csv", path=PRICE_STORE_PATH):
+    """
+    A function to convert a wide csv of prices, such as histories.csv, into a
+    price store at path.
+    """
+    histories_df = pd.read_csv(csv_path, index_col=0)
+    histories_df.index = days2index(dates2days(histories_df.index))
+    return write_store(histories_df, path)
+
+
+if __name__ == "__main__":
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "histories.csv"
+    path = sys.argv[2] if len(sys.argv) > 2 else PRICE_STORE_PATH
+    print("Wrote version {} of {}".format(csv_to_store(csv_path, path), path))
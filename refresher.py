@@ -0,0 +1,339 @@
+"""
+Background refresh of the app's data, so that no page request waits on
+coincap.
+
+A refresh downloads the latest assets snapshot and the new day's closes into
+the price store, rebuilds the derived matrices and prewarms the compute caches
+for the default views, then publishes the new dataset. Pages get the current
+dataset from current_dataset, which never touches the network: it returns the
+published dataset, reloading it from disk when another process has written a
+newer version of the store, or None while nothing has been stored yet, in
+which case the pages show that the data is being prepared.
+
+Refreshes are run at startup if the store doesn't hold the last daily close
+and then shortly after each UTC midnight, either by a daemon thread in the app
+process (start_refresher, called by the pages unless REFRESH_IN_APP=0) or by a
+separate worker process:
+
+    python refresher.py             # refresh if stale and then daily
+    python refresher.py --once      # refresh and prewarm once, e.g. at deploy
+
+Either can be triggered early by a POST to the local-only endpoint
+http://127.0.0.1:<REFRESH_TRIGGER_PORT>/refresh.
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import price_store
+from compute_cache import single_flight
+from instrumentation import instrumented
+from engine.data import (
+    create_cumulative_df,
+    create_market_cap_dict,
+    create_unix_dates,
+    fetch_assets,
+    gen_symbols,
+    load_histories_df,
+    read_histories_df,
+    rebase_cumulative_df,
+    utc_today,
+)
+from engine.metrics import gen_performance_df
+from engine.portfolio import (
+    gen_all_returns,
+    ids_with_histories,
+    markowitz_weights_dict,
+    uniform_weights_dict,
+)
+
+# Number of coins downloaded by a refresh. Pages using fewer coins take the
+# largest ones, as coincap ranks assets by market cap.
+REFRESH_COINS = 100
+LOOKBACK_YEARS = 5
+
+# Delay after UTC midnight before refreshing, to give coincap time to publish
+# the previous day's close, and before retrying a failed refresh.
+REFRESH_DELAY = timedelta(minutes=15)
+RETRY_DELAY = timedelta(minutes=5)
+
+# (total_coins, max_coins) of the default view of each page, prewarmed after
+# every refresh.
+PREWARM_VIEWS = ((50, 8), (50, 10))
+
+REFRESH_IN_APP = os.environ.get("REFRESH_IN_APP", "1") == "1"
+REFRESH_TRIGGER_PORT = os.environ.get("REFRESH_TRIGGER_PORT")
+
+Dataset = namedtuple(
+    "Dataset", ["assets_json", "start_unix", "end_unix", "histories_df", "version"]
+)
+
+logger = logging.getLogger(__name__)
+
+_datasets = {}
+_datasets_lock = threading.Lock()
+_refresher = None
+_refresher_lock = threading.Lock()
+
+
+def load_dataset(total_coins=50, lookback_years=LOOKBACK_YEARS, path=None):
+    """
+    A function to build the dataset of the largest total_coins coins from the
+    assets snapshot and prices in the price store at path, without downloading
+    anything. Returns None if nothing has been stored yet.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    assets_json = price_store.read_assets(path)
+    if assets_json is None or not price_store.store_exists(path):
+        return None
+    assets_json = dict(assets_json, data=assets_json["data"][:total_coins])
+    _, _, coin_ids = gen_symbols(assets_json)
+    start_unix, end_unix = create_unix_dates(lookback_years=lookback_years)
+    histories_df = read_histories_df(coin_ids, start_unix, path)
+    return Dataset(
+        assets_json,
+        start_unix,
+        end_unix,
+        histories_df,
+        histories_df.attrs["data_version"],
+    )
+
+
+def publish(total_coins, lookback_years, dataset):
+    with _datasets_lock:
+        _datasets[total_coins, lookback_years] = dataset
+
+
+def prewarm(dataset, max_coins=8, analysis_days=365):
+    """
+    A function to compute the results the pages need for their default view of
+    dataset (the last 365 days, Uniform and Markowitz portfolios of max_coins
+    coins), with the same arguments as the pages so their cache lookups hit.
+    """
+    histories_df = dataset.histories_df
+    end_date = utc_today()
+    start_date = end_date - timedelta(365)
+    cumulative_df = create_cumulative_df(histories_df)
+    ids = ids_with_histories(histories_df, start_date, end_date)
+    strategy_dict = {"Uniform": uniform_weights_dict(ids[:max_coins])}
+    try:
+        strategy_dict["Markowitz"] = markowitz_weights_dict(
+            histories_df, start_date, ids[:max_coins], analysis_days=analysis_days
+        )
+    except ValueError:
+        # the optimiser found no solution, as the page will show
+        pass
+    rebased_df = rebase_cumulative_df(cumulative_df, ids, start_date, end_date)
+    all_returns_df = gen_all_returns(rebased_df, ids, strategy_dict)
+    gen_performance_df(
+        all_returns_df, create_market_cap_dict(dataset.assets_json), strategy_dict
+    )
+
+
+@single_flight
+def refresh(path=None):
+    """
+    A function to download the latest assets snapshot and prices into the
+    price store at path, prewarm the default views of the new data and publish
+    it, replacing any dataset already published.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    start = time.perf_counter()
+    assets_json = fetch_assets(REFRESH_COINS)
+    _, _, coin_ids = gen_symbols(assets_json)
+    start_unix, end_unix = create_unix_dates(lookback_years=LOOKBACK_YEARS)
+    load_histories_df(coin_ids, start_unix, end_unix, path)
+    price_store.write_assets(assets_json, path)
+
+    with _datasets_lock:
+        keys = set(_datasets)
+    keys.update((total_coins, LOOKBACK_YEARS) for total_coins, _ in PREWARM_VIEWS)
+    datasets = {key: load_dataset(*key, path) for key in keys}
+    for total_coins, max_coins in PREWARM_VIEWS:
+        prewarm(datasets[total_coins, LOOKBACK_YEARS], max_coins)
+    for key, dataset in datasets.items():
+        publish(*key, dataset)
+    logger.info(
+        "Refreshed version %s in %.1fs",
+        price_store.store_version(path),
+        time.perf_counter() - start,
+    )
+
+
+def request_refresh():
+    """
+    Function to wake the in-app scheduler so that it refreshes now, unless a
+    refresh is already running. Does nothing if the scheduler runs in a worker
+    process, which refreshes an empty store at its own startup.
+    """
+    if _refresher is not None and not refresh.flights.busy():
+        _refresher.set()
+
+
+@instrumented
+def current_dataset(total_coins=50, lookback_years=LOOKBACK_YEARS):
+    """
+    A function to return the current dataset of the largest total_coins coins.
+    The published dataset is returned unless the store has been refreshed
+    since, in which case it is reloaded from disk. If nothing has been stored
+    yet (the very first start) a refresh is requested from the scheduler and
+    None is returned, the page request never waits on the download.
+    """
+    path = price_store.PRICE_STORE_PATH
+    with _datasets_lock:
+        dataset = _datasets.get((total_coins, lookback_years))
+    if dataset is not None and dataset.version == price_store.store_version(path):
+        return dataset
+
+    dataset = load_dataset(total_coins, lookback_years, path)
+    if dataset is None:
+        request_refresh()
+        return None
+    publish(total_coins, lookback_years, dataset)
+    return dataset
+
+
+def seconds_until_refresh(now=None):
+    """
+    Function to return the number of seconds until REFRESH_DELAY after the next
+    UTC midnight.
+    """
+    now = now or datetime.now(timezone.utc)
+    midnight = datetime.combine(now.date(), datetime.min.time(), timezone.utc)
+    next_refresh = midnight + REFRESH_DELAY
+    if next_refresh <= now:
+        next_refresh += timedelta(1)
+    return (next_refresh - now).total_seconds()
+
+
+def last_close(now=None):
+    """
+    Function to return the date of the last daily close available from coincap,
+    that of the day ended by the last UTC midnight at least REFRESH_DELAY ago.
+    """
+    now = now or datetime.now(timezone.utc)
+    return (now - REFRESH_DELAY).date() - timedelta(1)
+
+
+def store_is_stale(path=None, now=None):
+    """
+    Function to return whether the price store at path needs refreshing: it
+    holds no assets snapshot or prices, or its prices end before last_close.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    if price_store.read_assets(path) is None or not price_store.store_exists(path):
+        return True
+    _, days, _ = price_store.open_store(path)
+    return price_store.days2dates(days[-1:])[0] < last_close(now)
+
+
+def run_scheduler(trigger, path=None):
+    """
+    Function to refresh whenever the store is stale, i.e. at startup only if it
+    doesn't hold the last daily close and then daily, or early whenever trigger
+    is set. Failed refreshes are logged and retried after RETRY_DELAY, as are
+    refreshes after which the store is still stale, e.g. when coincap
+    publishes the last close late.
+    """
+    path = path or price_store.PRICE_STORE_PATH
+    triggered = False
+    while True:
+        try:
+            if triggered or store_is_stale(path):
+                # requests made before this refresh starts are served by it
+                trigger.clear()
+                refresh(path)
+            if store_is_stale(path):
+                wait = RETRY_DELAY.total_seconds()
+            else:
+                wait = seconds_until_refresh()
+        except Exception:
+            logger.exception("Refresh failed, retrying in %s", RETRY_DELAY)
+            wait = RETRY_DELAY.total_seconds()
+        triggered = trigger.wait(wait)
+        trigger.clear()
+
+
+def make_trigger_handler(trigger):
+    """
+    Function to create a request handler which sets trigger on a POST to
+    /refresh from the local machine.
+    """
+
+    class TriggerHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.client_address[0] != "127.0.0.1":
+                return self.send_text("forbidden", 403)
+            if self.path.rstrip("/") != "/refresh":
+                return self.send_text("not found", 404)
+            trigger.set()
+            self.send_text("refresh triggered", 202)
+
+        def send_text(self, body, status):
+            payload = body.encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return TriggerHandler
+
+
+def serve_trigger(trigger, port):
+    """
+    Function to serve the refresh trigger on 127.0.0.1:port from a daemon
+    thread. Returns the server.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_trigger_handler(trigger))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_refresher(path=None, port=REFRESH_TRIGGER_PORT):
+    """
+    Function to start the scheduler on a daemon thread of this process, plus
+    the trigger endpoint if port is set. Does nothing if REFRESH_IN_APP is off
+    or the refresher is already running, so pages can call it on every run.
+    Returns the trigger event, or None.
+    """
+    global _refresher
+    if not REFRESH_IN_APP:
+        return None
+    with _refresher_lock:
+        if _refresher is None:
+            trigger = threading.Event()
+            threading.Thread(
+                target=run_scheduler, args=(trigger, path), daemon=True
+            ).start()
+            if port:
+                serve_trigger(trigger, int(port))
+            _refresher = trigger
+    return _refresher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--once", action="store_true")
+    parser.add_argument("--port", type=int, default=REFRESH_TRIGGER_PORT or 8766)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s"
+    )
+
+    if args.once:
+        refresh()
+    else:
+        trigger = threading.Event()
+        serve_trigger(trigger, args.port)
+        logger.info("Refresh trigger on http://127.0.0.1:%d/refresh", args.port)
+        run_scheduler(trigger)
@@ -0,0 +1,162 @@
+"""
+A local stand-in for the Yahoo Finance endpoints used by market_data.py,
+serving responses recorded in a fixtures directory:
+
+    <fixtures>/cryptocurrencies.html           the crypto screener page
+    <fixtures>/chart/<TICKER>_<interval>.json  chart api responses
+
+Fixtures for BTC-USD and ETH-USD are committed in fixtures/yahoo and are
+exercised by benchmarks/check_market_data.py. Record fixtures for some tickers
+(this needs network access) with:
+
+    python yahoo_server.py --record BTC-USD ETH-USD
+
+then serve them with:
+
+    python yahoo_server.py --port 8767
+
+and point frontpage.py at the stand-in with:
+
+    YAHOO_SCREENER_URL=http://127.0.0.1:8767/cryptocurrencies \\
+    YAHOO_CHART_URL=http://127.0.0.1:8767/v8/finance/chart \\
+    streamlit run frontpage.py
+
+Chart responses are cut to the period1/period2 of the request, if given, so
+the incremental refresh of daily bars can be exercised.
+"""
+
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+FIXTURES_DIR = os.path.join("fixtures", "yahoo")
+
+# The chart requests market_data.py makes for each ticker, recorded by --record.
+RECORDED_CHARTS = ({"interval": "1d", "range": "5y"}, {"interval": "1m", "range": "1d"})
+
+
+def chart_path(fixtures_dir, ticker, interval):
+    return os.path.join(fixtures_dir, "chart", "{}_{}.json".format(ticker, interval))
+
+
+def cut_chart(chart_json, period1=None, period2=None):
+    """
+    Function to cut a chart api response to the bars with a timestamp in
+    [period1, period2].
+    """
+    result = dict(chart_json["chart"]["result"][0])
+    timestamps = result.get("timestamp") or []
+    keep = [
+        i
+        for i, t in enumerate(timestamps)
+        if (period1 is None or t >= period1) and (period2 is None or t <= period2)
+    ]
+    result["timestamp"] = [timestamps[i] for i in keep]
+    indicators = {}
+    for name, series_list in result["indicators"].items():
+        indicators[name] = [
+            {key: [values[i] for i in keep] for key, values in series.items()}
+            for series in series_list
+        ]
+    result["indicators"] = indicators
+    return {"chart": {"result": [result], "error": None}}
+
+
+def make_handler(fixtures_dir=FIXTURES_DIR):
+    """
+    Function to create a request handler class serving the fixtures in
+    fixtures_dir.
+    """
+
+    class YahooHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = urlsplit(self.path)
+            query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+            path = parts.path.rstrip("/").split("/")
+            if path[-1] == "cryptocurrencies":
+                html_path = os.path.join(fixtures_dir, "cryptocurrencies.html")
+                if os.path.exists(html_path):
+                    with open(html_path, "rb") as f:
+                        return self.send_body(f.read(), "text/html")
+            elif path[-2:-1] == ["chart"]:
+                json_path = chart_path(fixtures_dir, path[-1], query.get("interval"))
+                if os.path.exists(json_path):
+                    with open(json_path) as f:
+                        chart_json = json.load(f)
+                    period1 = int(query["period1"]) if "period1" in query else None
+                    period2 = int(query["period2"]) if "period2" in query else None
+                    chart_json = cut_chart(chart_json, period1, period2)
+                    body = json.dumps(chart_json).encode()
+                    return self.send_body(body, "application/json")
+            self.send_body(b"not found", "text/plain", 404)
+
+        def send_body(self, payload, content_type, status=200):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    return YahooHandler
+
+
+def serve_in_thread(fixtures_dir=FIXTURES_DIR, port=0):
+    """
+    Function to start the stand-in server on a daemon thread. Returns the
+    server and its base url, e.g. "http://127.0.0.1:54321". Call
+    server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fixtures_dir))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:{}".format(server.server_address[1])
+
+
+def record(tickers, fixtures_dir=FIXTURES_DIR):
+    """
+    Function to record the live screener page and the chart responses
+    market_data.py requests for each of tickers into fixtures_dir.
+    """
+    from market_data import YAHOO_CHART_URL, YAHOO_SCREENER_URL
+
+    headers = {"User-Agent": "Mozilla/5.0"}
+    os.makedirs(os.path.join(fixtures_dir, "chart"), exist_ok=True)
+    response = requests.get(
+        YAHOO_SCREENER_URL, params={"offset": 0, "count": 100}, headers=headers
+    )
+    response.raise_for_status()
+    with open(os.path.join(fixtures_dir, "cryptocurrencies.html"), "wb") as f:
+        f.write(response.content)
+    for ticker in tickers:
+        for params in RECORDED_CHARTS:
+            response = requests.get(
+                "{}/{}".format(YAHOO_CHART_URL, ticker), params=params, headers=headers
+            )
+            response.raise_for_status()
+            with open(chart_path(fixtures_dir, ticker, params["interval"]), "w") as f:
+                json.dump(response.json(), f)
+    print("Recorded {} tickers to {}".format(len(tickers), fixtures_dir))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--record", nargs="+", metavar="TICKER")
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.fixtures)
+    else:
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", args.port), make_handler(args.fixtures)
+        )
+        print("Serving Yahoo stand-in on http://127.0.0.1:{}".format(args.port))
+        server.serve_forever()